@@ -0,0 +1 @@
+# 임베딩 서버 벤치마크 (python -m benchmarks.run --help)
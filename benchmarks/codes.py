@@ -0,0 +1,168 @@
+# --- 압축 벡터 코드 벤치마크 (float32 전체 스캔 vs float16 / binary + 재채점) ---
+# 서버 없이 합성 기억을 인코딩해 두고, 같은 질의에 대해 저장 방식별 recall@k, 질의 지연 시간, 행당 저장 바이트를 비교합니다.
+# 저장 방식은 서버 설정 조합과 같습니다: float32 (VECTOR_CODES 없음), <kind> (코드 컬럼 + float32 vector),
+# <kind> compact (VECTOR_CODES_COMPACT=1: float16 vector, binary 는 코드 컬럼 추가, 재채점도 float16 으로)
+# 행당 저장 바이트는 각 방식의 컬럼(id 포함)으로 임시 LanceDB 테이블을 만들어 디스크에서 잰 값입니다.
+#
+#   python -m benchmarks.codes --corpus-size 100000 --queries 200 --k 10 --rescore 1,4,10,20
+#   python -m benchmarks.codes --backend torch --corpus-size 20000 --out codes.json
+#
+# 정답은 float32 전체 스캔의 top-k 입니다. stub 인코더는 대부분의 차원이 0 인 희소 벡터라 binary(부호 비트) 의
+# recall 이 실제 모델보다 훨씬 낮게 나오므로, binary 를 판단할 때는 --backend torch / onnx 로 재세요.
+# 코드 스캔과 재채점은 메모리 행렬에서 하므로, 서버(코드 컬럼과 후보 벡터를 LanceDB 에서 읽음)보다 지연이 작게 나옵니다.
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import encoder_backends  # noqa: E402
+import vector_codes  # noqa: E402
+from benchmarks import corpus  # noqa: E402
+from benchmarks.run import _percentiles  # noqa: E402
+
+ENCODE_BATCH_SIZE = 256
+
+
+def _encode_corpus(backend, size: int, seed: int) -> np.ndarray:
+    vectors, batch = [], []
+    for record in corpus.memories(size, seed=seed):
+        batch.append(record["text"])
+        if len(batch) == ENCODE_BATCH_SIZE:
+            vectors.append(backend.encode(batch, batch_size=len(batch)))
+            batch = []
+    if batch:
+        vectors.append(backend.encode(batch, batch_size=len(batch)))
+    return np.vstack(vectors).astype(np.float32, copy=False)
+
+
+def _exact_top_k(matrix: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    return vector_codes.top_candidates(matrix @ query, k)
+
+
+def _recall(matrix: np.ndarray, query: np.ndarray, found: np.ndarray, kth_score: float, k: int) -> float:
+    # 점수가 같은 행이 여럿이면 어느 쪽을 골라도 정답이므로, id 대신 "k 번째 정답 점수 이상인가" 로 셉니다.
+    if len(found) == 0:
+        return 0.0
+    return float(np.count_nonzero(matrix[found] @ query >= kth_score - 1e-5)) / k
+
+
+def _layouts(kinds: List[str]) -> Iterator[Tuple[str, Optional[str], str]]:
+    """(이름, 코드 형식, vector 컬럼 형식) 을 서버 설정 조합 순서대로 돌려줍니다."""
+    yield "float32", None, "float32"
+    for kind in kinds:
+        yield kind, kind, "float32"
+        yield f"{kind} compact", kind, "float16"
+
+
+def _stored_bytes_per_row(matrix: np.ndarray, kind: Optional[str], vector_dtype: str, workdir: str, name: str) -> float:
+    """서버와 같은 컬럼 구성(id, vector, 필요하면 vector_code)으로 LanceDB 테이블을 만들어 디스크 크기 / 행 수를 잽니다."""
+    import lancedb
+
+    vectors = matrix.astype(np.float16 if vector_dtype == "float16" else np.float32)
+    columns = {
+        "id": pa.array(np.arange(matrix.shape[0]), type=pa.int64()),
+        "vector": pa.FixedSizeListArray.from_arrays(pa.array(vectors.ravel()), matrix.shape[1]),
+    }
+    if kind is not None and not (kind == "float16" and vector_dtype == "float16"):  # float16 compact 는 vector 가 곧 코드
+        columns["vector_code"] = vector_codes.to_arrow(kind, matrix)
+    table_name = name.replace(" ", "_")
+    lancedb.connect(workdir).create_table(table_name, data=pa.table(columns))
+    total = 0
+    for root, _, files in os.walk(os.path.join(workdir, f"{table_name}.lance")):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return round(total / matrix.shape[0], 1)
+
+
+def _measure(name: str, search, matrix: np.ndarray, queries: np.ndarray, kth_scores: List[float],
+             bytes_per_row: float, k: int) -> Dict[str, Any]:
+    latencies, recalls = [], []
+    for query, kth_score in zip(queries, kth_scores):
+        started = time.perf_counter()
+        found = search(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+        recalls.append(_recall(matrix, query, found[:k], kth_score, k))
+    return {"method": name, f"recall@{k}": round(float(np.mean(recalls)), 4),
+            "latency_ms": _percentiles(latencies), "stored_bytes_per_row": bytes_per_row}
+
+
+def run(args) -> Dict[str, Any]:
+    backend = encoder_backends.load_backend(args.backend, args.model, device="cpu")
+    started = time.perf_counter()
+    matrix = _encode_corpus(backend, args.corpus_size, args.seed)
+    queries = backend.encode(corpus.queries(args.queries, seed=args.seed), batch_size=ENCODE_BATCH_SIZE).astype(np.float32)
+    encode_sec = round(time.perf_counter() - started, 2)
+    dim = matrix.shape[1]
+    kth_scores = [float(matrix[_exact_top_k(matrix, query, args.k)[-1]] @ query) for query in queries]
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_codes_") as workdir:
+        for layout, kind, vector_dtype in _layouts(args.kinds):
+            stored = _stored_bytes_per_row(matrix, kind, vector_dtype, workdir, layout)
+            if kind is None:
+                results.append(_measure(layout, lambda q: _exact_top_k(matrix, q, args.k), matrix, queries, kth_scores,
+                                        stored, args.k))
+                continue
+            codes = vector_codes.encode(kind, matrix)
+            # 재채점은 그 방식에 실제로 저장된 vector 로 합니다. (compact 는 float16)
+            stored_vectors = matrix if vector_dtype == "float32" else matrix.astype(np.float16).astype(np.float32)
+
+            def two_stage(query, factor, codes=codes, kind=kind, stored_vectors=stored_vectors):
+                candidates = vector_codes.top_candidates(vector_codes.approximate_scores(kind, codes, query), args.k * factor)
+                if factor == 1:
+                    return candidates  # 재채점 없이 코드 순위 그대로
+                return candidates[vector_codes.top_candidates(stored_vectors[candidates] @ query, args.k)]
+
+            for factor in args.rescore:
+                name = layout if factor == 1 else f"{layout}+rescore x{factor}"
+                results.append(_measure(name, lambda q, f=factor: two_stage(q, f), matrix, queries, kth_scores,
+                                        stored, args.k))
+    return {
+        "config": {"backend": args.backend, "model": args.model, "corpus_size": args.corpus_size, "queries": args.queries,
+                   "k": args.k, "dim": dim, "seed": args.seed, "encode_sec": encode_sec},
+        "results": results,
+    }
+
+
+def _print_table(results: List[Dict[str, Any]], k: int):
+    print(f"{'method':<32} {'recall@' + str(k):>10} {'p50 ms':>9} {'p95 ms':>9} {'stored B/row':>13}")
+    for row in results:
+        latency = row["latency_ms"]
+        print(f"{row['method']:<32} {row[f'recall@{k}']:>10} {latency['p50']:>9} {latency['p95']:>9} {row['stored_bytes_per_row']:>13}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="압축 벡터 코드 recall / 지연 시간 / 저장 크기 비교")
+    parser.add_argument("--backend", default="stub", help="encoder_backends 이름 (stub 은 모델 다운로드 없음)")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--corpus-size", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--kinds", default=",".join(vector_codes.KINDS), help="쉼표로 구분한 코드 형식")
+    parser.add_argument("--rescore", default="1,4,10,20", help="후보 배수 (1 이면 재채점 없음)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="", help="결과 JSON 경로")
+    args = parser.parse_args(argv)
+    args.kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+    args.rescore = [int(f) for f in args.rescore.split(",") if f.strip()]
+
+    report = run(args)
+    _print_table(report["results"], args.k)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"결과 저장: {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
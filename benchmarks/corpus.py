@@ -0,0 +1,48 @@
+# --- 벤치마크용 합성 데이터 ---
+# 실제 대화 기록 대신, 시드로 재현 가능한 한국어/영어 혼합 "기억" 문장과 긴 자막(세그먼트 목록)을 만듭니다.
+# 100만 건도 메모리에 한꺼번에 올리지 않도록 모든 생성기는 iterator 입니다.
+import random
+from typing import Dict, Iterator, List
+
+SUBJECTS = ["오늘", "어제", "주말에", "아침에", "회의에서", "산책하다가", "퇴근길에", "점심시간에",
+            "today", "yesterday", "at the meeting", "after work"]
+TOPICS = ["프로젝트 일정", "서울 여행", "새로운 노트북", "운동 계획", "영어 공부", "가족 모임", "카페 메뉴",
+          "LanceDB 인덱스", "임베딩 서버", "주간 보고서", "감정 일기", "유튜브 영상", "독서 모임", "이사 준비",
+          "the quarterly report", "a new recipe", "the deployment pipeline", "my reading list"]
+VERBS = ["에 대해 이야기했다", "을 정리했다", "때문에 고민했다", "을 다시 확인했다", "이 생각났다",
+         "을 기록해 두었다", "에 대해 검색했다", "을 미뤘다", "was discussed", "needs a follow-up"]
+DETAILS = ["기분이 꽤 좋았다", "조금 피곤했다", "다음 주까지 끝내야 한다", "루나에게 도움을 받았다",
+           "생각보다 오래 걸렸다", "메모를 남겼다", "사진을 찍어 두었다", "it felt productive",
+           "remember to ask again", "the numbers looked wrong"]
+
+
+def _sentence(rng: random.Random) -> str:
+    parts = [rng.choice(SUBJECTS), rng.choice(TOPICS) + rng.choice(VERBS), rng.choice(DETAILS)]
+    if rng.random() < 0.3:
+        parts.append(f"({rng.randint(1, 12)}월 {rng.randint(1, 28)}일, #{rng.randint(1, 9999)})")
+    return " ".join(parts)
+
+
+def memories(count: int, seed: int = 0, start_id: int = 1) -> Iterator[Dict]:
+    """{id, text} 기억 레코드를 count 개 만듭니다. 문장 수(1~4개)로 길이를 섞습니다."""
+    rng = random.Random(seed)
+    for offset in range(count):
+        text = " ".join(_sentence(rng) for _ in range(rng.randint(1, 4)))
+        yield {"id": start_id + offset, "text": text}
+
+
+def queries(count: int, seed: int = 0) -> List[str]:
+    """검색 질의. 기억 문장과 어휘가 겹치도록 같은 단어 목록에서 짧게 만듭니다."""
+    rng = random.Random(seed + 1)
+    return [f"{rng.choice(TOPICS)} {rng.choice(DETAILS)}" if rng.random() < 0.5 else rng.choice(TOPICS)
+            for _ in range(count)]
+
+
+def transcript(segment_count: int, seed: int = 0, segment_seconds: float = 4.0) -> List[Dict]:
+    """긴 영상 자막처럼 연속된 {start, end, text} 세그먼트 목록."""
+    rng = random.Random(seed + 2)
+    segments = []
+    for i in range(segment_count):
+        start = i * segment_seconds
+        segments.append({"start": start, "end": start + segment_seconds, "text": _sentence(rng)})
+    return segments
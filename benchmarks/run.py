@@ -0,0 +1,353 @@
+# --- 임베딩 서버 벤치마크 / 부하 생성기 ---
+# /embedding, /add, /search, /search-segments, /cluster 를 고정 동시성으로 두드려 처리량과 지연 시간을 잽니다.
+#
+#   # 프로세스 안에서 앱을 띄워 측정 (모델 다운로드 없이 stub 인코더 사용, 임시 디렉터리에 LanceDB 생성)
+#   python -m benchmarks.run --corpus-size 10000 --concurrency 1,8,32 --out bench.json
+#
+#   # 이미 떠 있는 서버를 HTTP 로 측정 (서버 PID 를 주면 서버 프로세스의 최대 RSS 도 기록)
+#   python -m benchmarks.run --target http://127.0.0.1:8001 --server-pid 12345 --endpoints search,embedding
+#
+#   # 이전 결과와 비교해 p95 / QPS 가 허용치 이상 나빠지면 종료 코드 1
+#   python -m benchmarks.run --compare baseline.json --tolerance 0.15 --fail-on-regression
+#
+# 단계별 시간은 서버의 Server-Timing 헤더(stage_timing.py)에서 가져옵니다.
+#   encode / search / lexical / db_write / sqlite_write / cluster : 서버에서 잰 구간
+#   server_other  : 서버 전체 시간 - 위 구간 합 (요청 검증, JSON 직렬화, 프레임워크)
+#   transport     : 클라이언트 지연 - 서버 전체 시간 (네트워크, ASGI 전달)
+#   client_decode : 클라이언트에서 응답 JSON 을 파싱한 시간
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import stage_timing  # noqa: E402
+from benchmarks import corpus  # noqa: E402
+
+ENDPOINTS = ("embedding", "add", "search", "search-segments", "cluster")
+SERVER_STAGES = ("encode", "search", "lexical", "db_write", "sqlite_write", "cluster")
+BENCH_VIDEO_ID = "bench-transcript"
+LOAD_BATCH_SIZE = 2000  # /add_batch 요청 하나에 담는 레코드 수
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    arr = np.asarray(values)
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3),
+            "mean": round(float(arr.mean()), 3), "max": round(float(arr.max()), 3)}
+
+
+def _peak_rss_mb(server_pid: Optional[int]) -> Dict[str, Optional[float]]:
+    # ru_maxrss 는 리눅스에서 KB, macOS 에서 바이트 단위입니다.
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    result = {"client_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1), "server_mb": None}
+    if server_pid:
+        try:
+            with open(f"/proc/{server_pid}/status", encoding="utf-8") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        result["server_mb"] = round(int(line.split()[1]) / 1024, 1)
+        except OSError as e:
+            print(f"WARN: 서버 RSS 를 읽지 못했습니다 (pid={server_pid}): {e}")
+    return result
+
+
+# ==================================================
+# 대상 서버 연결 (프로세스 내 / HTTP)
+# ==================================================
+@contextlib.asynccontextmanager
+async def _inprocess_client(workdir: str, timeout: float):
+    import httpx
+
+    # 상대 경로(./lancedb, ./memory_fts.sqlite3, 캐시 파일)가 작업 디렉터리 아래에 생기도록 먼저 옮깁니다.
+    os.environ.setdefault("EMBEDDING_BACKEND", "stub")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    import embedding_server
+
+    transport = httpx.ASGITransport(app=embedding_server.app)
+    async with embedding_server.lifespan(embedding_server.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+            yield client
+
+
+@contextlib.asynccontextmanager
+async def _http_client(base_url: str, timeout: float, concurrency: int):
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        yield client
+
+
+async def _wait_ready(client, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            response = await client.get("/health/ready")
+            if response.status_code == 200:
+                return response.json()
+        except Exception:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{timeout:.0f}초 안에 서버가 준비되지 않았습니다.")
+        await asyncio.sleep(0.2)
+
+
+# ==================================================
+# 데이터 적재
+# ==================================================
+async def _load_corpus(client, size: int, seed: int) -> Dict[str, Any]:
+    """합성 기억을 NDJSON 스트림으로 /add_batch 에 적재합니다."""
+    records = corpus.memories(size, seed=seed)
+    started = time.perf_counter()
+    loaded = failed = 0
+    while True:
+        batch = list(itertools.islice(records, LOAD_BATCH_SIZE))
+        if not batch:
+            break
+
+        async def body(rows=batch):
+            for row in rows:
+                yield (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+
+        response = await client.post("/add_batch", content=body(), headers={"Content-Type": "application/x-ndjson"})
+        response.raise_for_status()
+        summary = response.json()
+        loaded += summary.get("inserted", 0) + summary.get("updated", 0)
+        failed += summary.get("failed", 0)
+        print(f"INFO: 적재 {loaded:,}/{size:,}")
+    seconds = time.perf_counter() - started
+    return {"records": loaded, "failed": failed, "seconds": round(seconds, 2),
+            "records_per_sec": round(loaded / seconds, 1) if seconds > 0 else None}
+
+
+async def _load_transcript(client, segment_count: int, seed: int) -> Dict[str, Any]:
+    started = time.perf_counter()
+    response = await client.post("/segments/index", json={"video_id": BENCH_VIDEO_ID,
+                                                           "segments": corpus.transcript(segment_count, seed=seed)})
+    response.raise_for_status()
+    return {"segments": response.json()["count"], "seconds": round(time.perf_counter() - started, 2)}
+
+
+# ==================================================
+# 엔드포인트별 요청 생성
+# ==================================================
+class Workload:
+    def __init__(self, args, queries: List[str], dimension: int):
+        self.args = args
+        self.queries = queries
+        self.rng = random.Random(args.seed)
+        self.next_id = itertools.count(args.corpus_size + 1)  # /add 는 적재한 기억 뒤의 id 를 씁니다.
+        self.new_memories = corpus.memories(10 ** 9, seed=args.seed + 7, start_id=0)
+        self.cluster_vectors = np.random.default_rng(args.seed).standard_normal(
+            (args.cluster_vectors, dimension)).astype(np.float32).round(5).tolist()
+
+    def request(self, endpoint: str):
+        query = self.rng.choice(self.queries)
+        if endpoint == "embedding":
+            return "/embedding", {"text": query}
+        if endpoint == "add":
+            return "/add", {"id": next(self.next_id), "text": next(self.new_memories)["text"]}
+        if endpoint == "search":
+            return "/search", {"text": query, "limit": self.args.limit}
+        if endpoint == "search-segments":
+            return "/search-segments", {"query": query, "video_id": BENCH_VIDEO_ID, "top_k": self.args.limit, "min_score": 0.0}
+        if endpoint == "cluster":
+            return "/cluster", {"vectors": self.cluster_vectors, "num_clusters": self.args.num_clusters}
+        raise ValueError(f"알 수 없는 엔드포인트: {endpoint}")
+
+
+async def _timed_request(client, path: str, payload: dict) -> Dict[str, Any]:
+    started = time.perf_counter()
+    response = await client.post(path, json=payload)
+    latency = (time.perf_counter() - started) * 1000
+    decode_started = time.perf_counter()
+    response.json()
+    decode = (time.perf_counter() - decode_started) * 1000
+    return {"ok": response.status_code == 200, "status": response.status_code, "latency_ms": latency,
+            "decode_ms": decode, "stages": stage_timing.parse_server_timing(response.headers.get("server-timing"))}
+
+
+async def _run_level(client, workload: Workload, endpoint: str, concurrency: int, total: int, warmup: int) -> Dict[str, Any]:
+    for _ in range(warmup):
+        await _timed_request(client, *workload.request(endpoint))
+
+    samples: List[Dict[str, Any]] = []
+    remaining = itertools.count()
+
+    async def worker():
+        while next(remaining) < total:
+            try:
+                samples.append(await _timed_request(client, *workload.request(endpoint)))
+            except Exception as e:
+                samples.append({"ok": False, "status": type(e).__name__})
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ok = [s for s in samples if s["ok"]]
+    breakdown: Dict[str, List[float]] = {name: [] for name in SERVER_STAGES + ("server_other", "transport", "client_decode")}
+    for s in ok:
+        stages = s["stages"]
+        server_total = stages.get("total")
+        for name in SERVER_STAGES:
+            breakdown[name].append(stages.get(name, 0.0))
+        if server_total is not None:
+            breakdown["server_other"].append(max(0.0, server_total - sum(stages.get(n, 0.0) for n in SERVER_STAGES)))
+            breakdown["transport"].append(max(0.0, s["latency_ms"] - server_total))
+        breakdown["client_decode"].append(s["decode_ms"])
+
+    errors: Dict[str, int] = {}
+    for s in samples:
+        if not s["ok"]:
+            errors[str(s["status"])] = errors.get(str(s["status"]), 0) + 1
+    return {
+        "endpoint": endpoint, "concurrency": concurrency, "requests": len(samples), "errors": errors,
+        "seconds": round(elapsed, 3), "qps": round(len(ok) / elapsed, 2) if elapsed > 0 else None,
+        "latency_ms": _percentiles([s["latency_ms"] for s in ok]),
+        # 구간별 평균 ms. 요청마다 없는 구간(예: /embedding 의 search)은 0 으로 셉니다.
+        "breakdown_ms": {name: round(float(np.mean(v)), 3) if v else None for name, v in breakdown.items()},
+    }
+
+
+# ==================================================
+# 결과 비교
+# ==================================================
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """(endpoint, concurrency) 가 같은 항목끼리 p95 지연과 QPS 를 비교합니다."""
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline.get("results", [])}
+    rows = []
+    for current in results:
+        before = previous.get((current["endpoint"], current["concurrency"]))
+        if before is None:
+            continue
+        p95_now, p95_before = current["latency_ms"]["p95"], before["latency_ms"]["p95"]
+        qps_now, qps_before = current["qps"], before["qps"]
+        p95_ratio = p95_now / p95_before if p95_now and p95_before else None
+        qps_ratio = qps_now / qps_before if qps_now and qps_before else None
+        regressed = bool((p95_ratio and p95_ratio > 1 + tolerance) or (qps_ratio and qps_ratio < 1 - tolerance))
+        rows.append({"endpoint": current["endpoint"], "concurrency": current["concurrency"],
+                     "p95_ratio": round(p95_ratio, 3) if p95_ratio else None,
+                     "qps_ratio": round(qps_ratio, 3) if qps_ratio else None, "regressed": regressed})
+    return rows
+
+
+def _print_table(results: List[Dict[str, Any]]):
+    print(f"\n{'endpoint':<16}{'conc':>5}{'qps':>10}{'p50':>9}{'p95':>9}{'p99':>9}  breakdown(ms)")
+    for r in results:
+        lat = r["latency_ms"]
+        parts = ", ".join(f"{k}={v:.2f}" for k, v in r["breakdown_ms"].items() if v)
+        print(f"{r['endpoint']:<16}{r['concurrency']:>5}{r['qps'] or 0:>10.1f}"
+              f"{lat['p50'] or 0:>9.2f}{lat['p95'] or 0:>9.2f}{lat['p99'] or 0:>9.2f}  {parts}"
+              + (f"  errors={r['errors']}" if r["errors"] else ""))
+
+
+async def run(args) -> Dict[str, Any]:
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = [e for e in endpoints if e not in ENDPOINTS]
+    if unknown:
+        raise SystemExit(f"알 수 없는 엔드포인트: {', '.join(unknown)} (사용 가능: {', '.join(ENDPOINTS)})")
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    if args.target == "inprocess":
+        workdir = args.workdir or tempfile.mkdtemp(prefix="luna-bench-")
+        print(f"INFO: 프로세스 내 모드 (작업 디렉터리: {workdir})")
+        connect = _inprocess_client(workdir, args.timeout)
+    else:
+        connect = _http_client(args.target.rstrip("/"), args.timeout, max(levels))
+
+    report: Dict[str, Any] = {"meta": {
+        "target": args.target, "backend": os.getenv("EMBEDDING_BACKEND", "stub" if args.target == "inprocess" else None),
+        "corpus_size": args.corpus_size, "transcript_segments": args.transcript_segments, "seed": args.seed,
+        "requests_per_level": args.requests, "concurrency": levels, "python": platform.python_version(),
+        "platform": platform.platform(), "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }}
+    async with connect as client:
+        report["meta"]["ready"] = await _wait_ready(client, args.ready_timeout)
+        if args.corpus_size and not args.skip_load and {"search", "add"} & set(endpoints):
+            report["load"] = await _load_corpus(client, args.corpus_size, args.seed)
+        if "search-segments" in endpoints:
+            report["transcript"] = await _load_transcript(client, args.transcript_segments, args.seed)
+
+        probe = await client.post("/embedding", json={"text": "dimension probe"})
+        probe.raise_for_status()
+        workload = Workload(args, corpus.queries(args.query_pool, seed=args.seed), len(probe.json()["embedding"]))
+
+        results = []
+        for endpoint in endpoints:
+            for concurrency in levels:
+                result = await _run_level(client, workload, endpoint, concurrency, args.requests, args.warmup)
+                print(f"INFO: {endpoint} x{concurrency}: {result['qps']} req/s, p95 {result['latency_ms']['p95']} ms")
+                results.append(result)
+        report["results"] = results
+    report["peak_rss"] = _peak_rss_mb(args.server_pid)
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="임베딩 서버 벤치마크")
+    parser.add_argument("--target", default="inprocess", help="'inprocess' 또는 서버 주소 (예: http://127.0.0.1:8001)")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", default="1,8,32", help="쉼표로 구분한 동시성 단계")
+    parser.add_argument("--requests", type=int, default=200, help="단계마다 보낼 요청 수")
+    parser.add_argument("--warmup", type=int, default=5, help="단계마다 기록하지 않는 예열 요청 수")
+    parser.add_argument("--corpus-size", type=int, default=1000, help="적재할 합성 기억 수 (1k ~ 1M)")
+    parser.add_argument("--skip-load", action="store_true", help="이미 적재된 서버라면 기억 적재를 건너뜀")
+    parser.add_argument("--transcript-segments", type=int, default=2000, help="합성 자막 세그먼트 수")
+    parser.add_argument("--query-pool", type=int, default=500, help="서로 다른 검색 질의 수")
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--cluster-vectors", type=int, default=500, help="/cluster 요청 하나에 담는 벡터 수")
+    parser.add_argument("--num-clusters", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--workdir", default="", help="프로세스 내 모드의 데이터 디렉터리 (기본: 임시 디렉터리)")
+    parser.add_argument("--server-pid", type=int, default=0, help="HTTP 모드에서 최대 RSS 를 읽을 서버 PID")
+    parser.add_argument("--out", default="", help="결과 JSON 경로")
+    parser.add_argument("--compare", default="", help="비교할 이전 결과 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="회귀로 볼 p95 / QPS 변화 비율")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    out_path = os.path.abspath(args.out) if args.out else ""  # 프로세스 내 모드는 작업 디렉터리를 옮기므로 미리 절대 경로로
+    compare_path = os.path.abspath(args.compare) if args.compare else ""
+    report = asyncio.run(run(args))
+    _print_table(report["results"])
+    print(f"\n최대 RSS: {report['peak_rss']}")
+
+    regressed = False
+    if compare_path:
+        with open(compare_path, encoding="utf-8") as f:
+            report["comparison"] = compare(report["results"], json.load(f), args.tolerance)
+        for row in report["comparison"]:
+            mark = "❌" if row["regressed"] else "✅"
+            print(f"{mark} {row['endpoint']} x{row['concurrency']}: p95 x{row['p95_ratio']}, qps x{row['qps_ratio']}")
+        regressed = any(row["regressed"] for row in report["comparison"])
+
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"결과 저장: {out_path}")
+    return 1 if regressed and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,6 +14,13 @@ const dbConnections = {
     reports: new Database(path.join(dbDir, 'reports.db')),
     tasks: new Database(path.join(dbDir, 'tasks.db')),
 };
+// Python 서버(db_access.py)와 같은 설정: WAL 이면 한쪽이 쓰는 동안에도 다른 쪽이 읽을 수 있고,
+// 쓰기가 겹치면 바로 SQLITE_BUSY 를 내지 않고 잠시 기다립니다.
+for (const conn of Object.values(dbConnections)) {
+    conn.pragma('journal_mode = WAL');
+    conn.pragma('synchronous = NORMAL');
+    conn.pragma('busy_timeout = 5000');
+}
 console.log("[DB Manager v2.0] Notion-Style 데이터베이스 멀티-커넥션 완료.");
 const db = dbConnections.main; // <<< 기존 코드와의 호환성을 위해 'db' 변수는 main을 가리키도록 유지
 
@@ -7,20 +7,51 @@ const PYTHON_SERVER_URL = 'http://localhost:8001';
 // 이제 이 파일은 lancedb 라이브러리를 직접 사용하지 않습니다.
 // 모든 작업은 Python 서버에 요청을 보내 처리합니다.
 
+// long_term_memory.sentiment (Memory Profiler 가 붙이는 positive / negative / neutral) 를 감정 강도 점수로 바꿀 때 쓰는 값
+const SENTIMENT_SCORES = { positive: 1, negative: -1, neutral: 0 };
+
+/**
+ * long_term_memory 의 sentiment 문자열을 Python 서버의 기억 메타데이터로 바꿉니다. (salience 순위용)
+ * @param {string|null} sentiment - 'positive' | 'negative' | 'neutral' (없으면 빈 객체)
+ * @returns {Object} - { emotion_tag, sentiment_score }
+ */
+function sentimentMetadata(sentiment) {
+    const tag = typeof sentiment === 'string' ? sentiment.trim().toLowerCase() : '';
+    if (!(tag in SENTIMENT_SCORES)) return {};
+    return { emotion_tag: tag, sentiment_score: SENTIMENT_SCORES[tag] };
+}
+
 /**
  * 새로운 기억(텍스트와 ID)을 Python 서버로 보내 벡터로 변환 후 DB에 저장하도록 요청합니다.
  * @param {number} id - SQLite에 저장된 기억의 고유 ID
  * @param {string} text - 요약된 기억 텍스트
+ * @param {Object} metadata - { timestamp (ISO 문자열 또는 epoch 초), emotion_tag, sentiment_score (-1~1) } (검색 순위 / 필터용)
  */
-async function addMemory(id, text) {
+async function addMemory(id, text, metadata = {}) {
     try {
-        await axios.post(`${PYTHON_SERVER_URL}/add`, { id: id, text: text });
+        await axios.post(`${PYTHON_SERVER_URL}/add`, { id: id, text: text, ...metadata });
         console.log(`[VectorDB] 기억 ID ${id}를 Python 서버를 통해 성공적으로 저장했습니다.`);
     } catch (error) {
         console.error(`[VectorDB] 기억 추가 중 오류 (Python 서버 통신):`, error.message);
     }
 }
 
+/**
+ * 여러 기억을 한 번의 요청으로 Python 서버에 적재합니다. (id 기준 upsert 이므로 재시도해도 중복되지 않습니다)
+ * @param {Array<Object>} memories - [{id, text}, ...] 형식의 배열
+ * @returns {Promise<Object|null>} - 레코드별 처리 결과 ({inserted, updated, failed, results})
+ */
+async function addMemoriesBatch(memories) {
+    try {
+        const response = await axios.post(`${PYTHON_SERVER_URL}/add_batch`, memories);
+        console.log(`[VectorDB] 기억 ${memories.length}개 일괄 적재 완료 (삽입 ${response.data.inserted}, 갱신 ${response.data.updated}, 실패 ${response.data.failed})`);
+        return response.data;
+    } catch (error) {
+        console.error(`[VectorDB] 기억 일괄 적재 중 오류 (Python 서버 통신):`, error.message);
+        return null;
+    }
+}
+
 /**
  * 검색할 텍스트를 Python 서버로 보내, 의미적으로 가장 유사한 기억들을 찾아오도록 요청합니다.
  * @param {string} queryText - 검색할 문장
@@ -37,19 +68,126 @@ async function searchMemories(queryText, limit = 5) {
     }
 }
 
+/**
+ * v2 검색: SQLite 와 다시 연결할 수 있도록 id 와 유사도 점수를 함께 받아옵니다.
+ * @param {string} queryText - 검색할 문장
+ * @param {Object} options - { limit, minScore, filters: { id_min, id_max, ids, timestamp_from, timestamp_to, emotion_tags },
+ *                            ranking: { recency_weight, half_life_hours, salience_weight, emotion_weights } }
+ *   ranking 을 주면 Python 서버가 유사도에 최신성 / 감정 강도를 더한 점수로 top-k 를 골라 줍니다. (따로 많이 가져와 다시 정렬할 필요 없음)
+ * @returns {Promise<Array<{id: number, text: string, score: number, similarity?: number, timestamp?: number}>>}
+ */
+async function searchMemoriesV2(queryText, { limit = 5, minScore = null, filters = null, ranking = null } = {}) {
+    try {
+        const response = await axios.post(`${PYTHON_SERVER_URL}/search_v2`, {
+            text: queryText, limit: limit, min_score: minScore, filters: filters, ranking: ranking
+        });
+        return response.data.results || [];
+    } catch (error) {
+        console.error(`[VectorDB] 기억 검색(v2) 중 오류 (Python 서버 통신):`, error.message);
+        return [];
+    }
+}
+
+/**
+ * 하이브리드 검색: 전문(BM25) 검색과 벡터 검색을 Python 서버에서 동시에 실행해 합친 결과를 받습니다.
+ * 정확한 이름, 날짜, 드문 단어가 들어간 질문에 유리합니다.
+ * @param {string} queryText - 검색할 문장
+ * @param {Object} options - { limit, fusion: 'rrf' | 'weighted', vectorWeight, filters }
+ * @returns {Promise<Array<{id: number, text: string, score: number, vector_score: number|null, lexical_score: number|null}>>}
+ */
+async function searchMemoriesHybrid(queryText, { limit = 5, fusion = 'rrf', vectorWeight = 0.5, filters = null } = {}) {
+    try {
+        const response = await axios.post(`${PYTHON_SERVER_URL}/search_hybrid`, {
+            text: queryText, limit: limit, fusion: fusion, vector_weight: vectorWeight, filters: filters
+        });
+        return response.data.results || [];
+    } catch (error) {
+        console.error(`[VectorDB] 하이브리드 기억 검색 중 오류 (Python 서버 통신):`, error.message);
+        return [];
+    }
+}
+
+/**
+ * 업로드된 파일 내용(청크)에서 의미적으로 가장 가까운 부분을 찾습니다.
+ * @param {string} queryText - 검색할 문장
+ * @param {Object} options - { limit, fileIds: files.id 배열 (특정 파일로 한정), minScore }
+ * @returns {Promise<Array<{file_id: number, filename: string, chunk_index: number, text: string, score: number}>>}
+ */
+async function searchFiles(queryText, { limit = 5, fileIds = null, minScore = null } = {}) {
+    try {
+        const response = await axios.post(`${PYTHON_SERVER_URL}/files/search`, {
+            query: queryText, limit: limit, file_ids: fileIds, min_score: minScore
+        });
+        return response.data.results || [];
+    } catch (error) {
+        console.error(`[VectorDB] 파일 내용 검색 중 오류 (Python 서버 통신):`, error.message);
+        return [];
+    }
+}
+
+/**
+ * Python 서버의 바이너리 벡터 프레임("LVEC" | rows | dim | flags | [ids int64] | float32...)을 해석합니다.
+ * @param {Buffer} buffer - application/octet-stream 응답 본문 (프레임이 여러 개 이어질 수 있음)
+ * @returns {{ids: number[], vectors: Float32Array[]}}
+ */
+function decodeVectorFrames(buffer) {
+    const ids = [];
+    const vectors = [];
+    let offset = 0;
+    while (offset < buffer.length) {
+        if (buffer.toString('ascii', offset, offset + 4) !== 'LVEC') throw new Error('잘못된 벡터 프레임입니다.');
+        const rows = buffer.readUInt32LE(offset + 4);
+        const dim = buffer.readUInt32LE(offset + 8);
+        const hasIds = (buffer.readUInt32LE(offset + 12) & 1) === 1;
+        offset += 16;
+        if (hasIds) {
+            for (let r = 0; r < rows; r++) ids.push(Number(buffer.readBigInt64LE(offset + r * 8)));
+            offset += rows * 8;
+        }
+        for (let r = 0; r < rows; r++) {
+            // Buffer 의 byteOffset 이 4의 배수가 아닐 수 있으므로 복사본으로 Float32Array 를 만듭니다.
+            const start = offset + r * dim * 4;
+            const bytes = buffer.buffer.slice(buffer.byteOffset + start, buffer.byteOffset + start + dim * 4);
+            vectors.push(new Float32Array(bytes));
+        }
+        offset += rows * dim * 4;
+    }
+    return { ids, vectors };
+}
+
 /**
  * 클러스터링을 위해 Python 서버에 모든 벡터를 요청합니다.
- * @returns {Promise<number[][]>} - 모든 벡터들의 배열
+ * JSON float 리스트 대신 float32 바이너리 스트림으로 받아 직렬화 비용을 줄입니다.
+ * @returns {Promise<Float32Array[]>} - 모든 벡터들의 배열
  */
 async function getAllVectors() {
     try {
-        const response = await axios.get(`${PYTHON_SERVER_URL}/get_all_vectors`);
-        return response.data.vectors || [];
+        const response = await axios.get(`${PYTHON_SERVER_URL}/get_all_vectors`, {
+            params: { stream: true },
+            headers: { Accept: 'application/octet-stream' },
+            responseType: 'arraybuffer'
+        });
+        return decodeVectorFrames(Buffer.from(response.data)).vectors;
     } catch (error) {
         console.error('[VectorDB] 모든 벡터 조회 중 오류 (Python 서버 통신):', error.message);
         return [];
     }
 }
+/**
+ * Python 서버의 구성 요소별 준비 상태를 확인합니다. (모델 로드는 백그라운드에서 진행되므로,
+ * 자막/파일 같은 비-ML 엔드포인트는 ready 가 false 여도 바로 사용할 수 있습니다.)
+ * @returns {Promise<{alive: boolean, ready: boolean, components: Object}>}
+ */
+async function getPythonReadiness() {
+    try {
+        // 준비 전에는 503 을 돌려주므로, 상태 코드와 관계없이 본문을 읽습니다.
+        const response = await axios.get(`${PYTHON_SERVER_URL}/health/ready`, { validateStatus: () => true, timeout: 2000 });
+        return { alive: true, ready: response.data.ready === true, components: response.data.components || {} };
+    } catch (error) {
+        return { alive: false, ready: false, components: {} };
+    }
+}
+
 // 이 함수들은 이제 Python 서버가 담당하므로, 여기서는 더 이상 필요 없습니다.
 // async function initializeVectorDB() { ... }
 
@@ -87,7 +225,14 @@ async function rebuildVectorDB(allMemories) {
 
 module.exports = {
     addMemory,
+    addMemoriesBatch,
     searchMemories,
+    searchMemoriesV2,
+    searchMemoriesHybrid,
+    searchFiles,
     getAllVectors,
-    rebuildVectorDB
+    decodeVectorFrames,
+    getPythonReadiness,
+    rebuildVectorDB,
+    sentimentMetadata
 };
\ No newline at end of file
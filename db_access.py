@@ -0,0 +1,195 @@
+# --- SQLite 공용 접근 계층 ---
+# Python 쪽 모듈(db_initializer.py, embedding_server.py)이 같이 쓰는 작은 데이터 접근 모듈입니다.
+# - 스레드별 연결 풀: 같은 스레드는 DB 마다 연결 하나를 재사용합니다. (요청마다 connect/close 하지 않음)
+# - WAL + synchronous=NORMAL: Node(db-manager.js)와 Python 이 동시에 써도 읽기가 쓰기를 막지 않습니다.
+# - executemany 일괄 삽입
+# - PRAGMA user_version 기반의 버전별 스키마 마이그레이션 (자주 조회하는 컬럼 인덱스 포함)
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import stage_timing
+
+DB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database")
+
+DB_PATHS = {
+    "memories": os.path.join(DB_DIR, "memories.db"),
+    "files": os.path.join(DB_DIR, "files.db"),
+    "reports": os.path.join(DB_DIR, "reports.db"),
+    "tasks": os.path.join(DB_DIR, "tasks.db"),
+}
+
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# ==================================================
+# 🧠 DB 별 마이그레이션 목록: (버전, SQL 스크립트)
+# 한 번 배포된 항목은 고치지 말고, 새 버전을 뒤에 추가하세요.
+# ==================================================
+MIGRATIONS: Dict[str, List[Tuple[int, str]]] = {
+    "memories": [
+        (1, """
+        CREATE TABLE IF NOT EXISTS memories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            user_message TEXT,
+            luna_response TEXT,
+            emotion_tag TEXT,
+            sentiment_score REAL,
+            related_task_id INTEGER,
+            related_report_id INTEGER,
+            related_file_id INTEGER
+        );
+        """),
+        (2, "CREATE INDEX IF NOT EXISTS idx_memories_timestamp ON memories(timestamp);"),
+    ],
+    "files": [
+        (1, """
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT,
+            extension TEXT,
+            file_path TEXT,
+            file_size_kb REAL,
+            summary TEXT,
+            keywords TEXT,
+            related_report_id INTEGER,
+            uploaded_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """),
+        (2, "CREATE INDEX IF NOT EXISTS idx_files_uploaded_at ON files(uploaded_at);"),
+    ],
+    "reports": [
+        (1, """
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            type TEXT,
+            content_md TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            linked_memory_id INTEGER,
+            linked_file_id INTEGER
+        );
+        """),
+        (2, "CREATE INDEX IF NOT EXISTS idx_reports_created_at ON reports(created_at);"),
+    ],
+    "tasks": [
+        (1, """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT,
+            category TEXT,
+            title TEXT,
+            status TEXT DEFAULT 'todo',
+            duration_minutes INTEGER,
+            related_memory_id INTEGER,
+            focus_level INTEGER,
+            emotion_snapshot TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """),
+        (2, """
+        CREATE INDEX IF NOT EXISTS idx_tasks_date ON tasks(date);
+        CREATE INDEX IF NOT EXISTS idx_tasks_status_date ON tasks(status, date);
+        """),
+    ],
+}
+
+
+def configure(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """모든 연결에 공통으로 거는 PRAGMA. (journal_mode=WAL 은 DB 파일에 기록되어 Node 쪽 연결에도 적용됩니다)"""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+class ConnectionPool:
+    """DB 이름별로 스레드마다 연결 하나를 만들어 재사용합니다."""
+
+    def __init__(self, paths: Dict[str, str]):
+        self.paths = paths
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all: List[sqlite3.Connection] = []
+
+    def connection(self, name: str) -> sqlite3.Connection:
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(name)
+        if conn is None:
+            path = self.paths[name]
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # 풀이 연결을 스레드별로 나누므로 check_same_thread 는 끄고, close_all 에서 한꺼번에 닫습니다.
+            conn = configure(sqlite3.connect(path, check_same_thread=False))
+            conn.row_factory = sqlite3.Row
+            conns[name] = conn
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._all:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._all.clear()
+        self._local = threading.local()
+
+
+pool = ConnectionPool(DB_PATHS)
+
+
+@contextmanager
+def transaction(name: str):
+    """with 블록이 끝나면 commit, 예외가 나면 rollback 합니다."""
+    conn = pool.connection(name)
+    with stage_timing.stage("sqlite_write"), conn:
+        yield conn
+
+
+def execute(name: str, sql: str, params: Sequence[Any] = ()) -> sqlite3.Cursor:
+    with transaction(name) as conn:
+        return conn.execute(sql, params)
+
+
+def executemany(name: str, sql: str, rows: Iterable[Sequence[Any]]) -> int:
+    """여러 행을 한 트랜잭션 안에서 삽입/갱신합니다. 처리한 행 수를 돌려줍니다."""
+    with transaction(name) as conn:
+        return conn.executemany(sql, rows).rowcount
+
+
+def query(name: str, sql: str, params: Sequence[Any] = ()) -> List[sqlite3.Row]:
+    return pool.connection(name).execute(sql, params).fetchall()
+
+
+def schema_version(name: str) -> int:
+    return pool.connection(name).execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(name: str) -> List[int]:
+    """아직 적용되지 않은 마이그레이션을 버전 순서대로 적용하고, 적용한 버전 목록을 돌려줍니다."""
+    conn = pool.connection(name)
+    applied = []
+    current = schema_version(name)
+    for version, script in sorted(MIGRATIONS[name]):
+        if version <= current:
+            continue
+        # executescript 는 자체적으로 COMMIT 하므로, 스크립트와 버전 기록을 명시적 트랜잭션으로 묶습니다.
+        try:
+            conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {int(version)};\nCOMMIT;")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def migrate_all(names: Optional[Iterable[str]] = None) -> Dict[str, List[int]]:
+    return {name: migrate(name) for name in (names or DB_PATHS)}
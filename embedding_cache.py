@@ -0,0 +1,195 @@
+# --- 2단계 임베딩 캐시 ---
+# 1단계: 프로세스 내부 LRU (바이트 단위로 크기 제한)
+# 2단계: ./lancedb 옆의 SQLite 파일 (서버를 재시작해도 유지)
+# 키는 "모델 키 + 정규화된 텍스트" 의 해시입니다. 모델 키가 다른 행은 서로 섞이지 않으므로,
+# 모델 / 백엔드를 바꿔도 디스크 캐시를 비우지 않고, 쓰이지 않는 행은 오래된 순서대로 정리됩니다.
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """캐시 키용 정규화: 유니코드 NFC + 공백 정리."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+class EmbeddingCache:
+    def __init__(self, model_name: str, max_memory_bytes: int = 64 * 1024 * 1024,
+                 disk_path: Optional[str] = None, max_disk_rows: int = 500_000):
+        self.model_name = model_name
+        self.max_memory_bytes = max(0, int(max_memory_bytes))
+        self.max_disk_rows = max(0, int(max_disk_rows))
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_bytes = 0
+        # 메모리 계층과 디스크 계층은 잠금을 따로 둡니다.
+        # get_memory 는 이벤트 루프에서 호출되므로, 실행기 스레드의 SQLite 작업이 끝나길 기다리면 안 됩니다.
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_rows = 0
+        self.counters = {
+            "memory_hits": 0, "disk_hits": 0, "misses": 0,
+            "memory_evictions": 0, "disk_evictions": 0, "disk_writes": 0,
+        }
+        self._disk: Optional[sqlite3.Connection] = None
+        if disk_path:
+            self._open_disk(disk_path)
+
+    # --- 키 ---
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    # --- 디스크 계층 ---
+    def _open_disk(self, path: str):
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )""")
+        row = conn.execute("SELECT value FROM meta WHERE key = 'model_name'").fetchone()
+        if row is None or row[0] != self.model_name:
+            # 행 키에 모델 키가 들어 있으므로 예전 모델의 벡터는 그대로 두고, 개수 제한에 따라 오래된 것부터 정리됩니다.
+            if row is not None:
+                print(f"INFO: (Embedding Cache) 모델 변경 감지 ({row[0]} -> {self.model_name}), 예전 모델의 디스크 캐시는 유지합니다.")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('model_name', ?)", (self.model_name,))
+        conn.commit()
+        # 행 수는 열 때 한 번만 세고, 이후에는 추가 / 정리할 때마다 직접 갱신합니다.
+        self._disk_rows = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._disk = conn
+
+    def _disk_get_many(self, keys: List[str]) -> dict:
+        if self._disk is None or not keys:
+            return {}
+        found = {}
+        # SQLite 변수 개수 제한을 넘지 않도록 나눠서 조회합니다.
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            rows = self._disk.execute(
+                f"SELECT key, dim, vector FROM embeddings WHERE key IN ({', '.join('?' * len(part))})", part
+            ).fetchall()
+            for key, dim, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32, count=dim)
+        return found
+
+    def _disk_put_many(self, items: List[tuple]):
+        if self._disk is None or not items:
+            return
+        now = time.time()
+        # 같은 키는 같은 벡터이므로 이미 있으면 건너뜁니다. 그래야 rowcount 가 새로 추가된 행 수와 같습니다.
+        cursor = self._disk.executemany(
+            "INSERT OR IGNORE INTO embeddings (key, dim, vector, created_at) VALUES (?, ?, ?, ?)",
+            [(key, vec.shape[0], vec.astype(np.float32, copy=False).tobytes(), now) for key, vec in items],
+        )
+        inserted = max(0, cursor.rowcount)
+        self._disk_rows += inserted
+        self.counters["disk_writes"] += inserted
+        if self.max_disk_rows:
+            overflow = self._disk_rows - self.max_disk_rows
+            if overflow > 0:
+                # 가장 오래된 항목부터 정리합니다.
+                deleted = self._disk.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY created_at LIMIT ?)", (overflow,)
+                ).rowcount
+                self._disk_rows -= deleted
+                self.counters["disk_evictions"] += deleted
+        self._disk.commit()
+
+    # --- 메모리 계층 ---
+    def _memory_put(self, key: str, vec: np.ndarray):
+        if self.max_memory_bytes == 0 or vec.nbytes > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= old.nbytes
+        self._memory[key] = vec
+        self._memory_bytes += vec.nbytes
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+            self.counters["memory_evictions"] += 1
+
+    def get_memory(self, text: str) -> Optional[np.ndarray]:
+        """메모리 계층만 확인합니다 (이벤트 루프에서 호출해도 되는 가벼운 조회)."""
+        key = self.key(text)
+        with self._lock:
+            vec = self._memory.get(key)
+            if vec is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+            return vec
+
+    # --- 공개 API ---
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """메모리 -> 디스크 순서로 조회합니다. 디스크에서 찾은 벡터는 메모리로 올립니다."""
+        keys = [self.key(t) for t in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                vec = self._memory.get(key)
+                if vec is not None:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    results[i] = vec
+                else:
+                    missing.append(i)
+        if not missing:
+            return results
+        # 디스크 조회 중에는 메모리 계층 잠금을 잡지 않습니다.
+        with self._disk_lock:
+            found = self._disk_get_many(list({keys[i] for i in missing}))
+        with self._lock:
+            for i in missing:
+                vec = found.get(keys[i])
+                if vec is not None:
+                    self.counters["disk_hits"] += 1
+                    self._memory_put(keys[i], vec)
+                    results[i] = vec
+                else:
+                    self.counters["misses"] += 1
+        return results
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        items = [(self.key(t), np.asarray(v, dtype=np.float32)) for t, v in zip(texts, vectors)]
+        with self._lock:
+            for key, vec in items:
+                self._memory_put(key, vec)
+        with self._disk_lock:
+            self._disk_put_many(items)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        with self._disk_lock:
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM embeddings")
+                self._disk.commit()
+                self._disk_rows = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            disk_rows = self._disk_rows
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            return {
+                "model": self.model_name,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "disk_rows": disk_rows,
+                "hit_ratio": round((lookups - self.counters["misses"]) / lookups, 4) if lookups else None,
+                **self.counters,
+            }
@@ -1,109 +1,1479 @@
 # --- 1. 필요한 라이브러리 불러오기 ---
-from fastapi import FastAPI, HTTPException
+# torch / sentence_transformers / sklearn / lancedb 같은 무거운 라이브러리는 처음 쓸 때 불러옵니다.
+# (모델이 필요 없는 자막/파일 엔드포인트가 서버 시작 직후부터 응답할 수 있도록)
+import time
+_PROCESS_STARTED = time.perf_counter()
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer
 import uvicorn
-import torch
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Union
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.metrics.pairwise import cosine_similarity
 from contextlib import asynccontextmanager
-import lancedb
 import os
-import subprocess
-import tempfile
-import re
-from urllib.parse import urlparse, parse_qs
-import webvtt
-from io import StringIO
-import time
 import threading
 import json
-import csv
 import io
-import sqlite3
+import tempfile
+import asyncio
+import hashlib
+import math
+import uuid
+from datetime import timedelta
+import pyarrow as pa
+from encoder_service import EncoderService
+import encoder_backends
+from embedding_cache import EmbeddingCache
+from segment_store import SegmentEntry, SegmentStore, normalize_rows, top_k_cosine
+from media_jobs import DownloadJobManager
+import memory_clustering
+import memory_consolidation
+import memory_ranking
+import vector_transport
+import file_ingest
+import db_access
+import stage_timing
+import metrics
+import worker_pool
+import vector_codes
+import text_chunking
+from memory_fts import MemoryTextIndex
+from stage_timing import log
+from transcript_service import TranscriptCache, TranscriptNotFound, TranscriptService, extract_video_id, load_fetcher
 
 # --- 2. 설정 및 모델/DB 로드 ---
 MODEL_NAME = 'all-MiniLM-L6-v2'
 
+# --- 인코더 마이크로 배칭 설정 ---
+# 동시에 들어온 요청을 최대 ENCODER_MAX_BATCH_SIZE 개까지, ENCODER_MAX_WAIT_MS 동안 모아서 한 번에 인코딩합니다.
+ENCODER_MAX_BATCH_SIZE = int(os.getenv("ENCODER_MAX_BATCH_SIZE", "32"))
+ENCODER_MAX_WAIT_MS = float(os.getenv("ENCODER_MAX_WAIT_MS", "5"))
+model = None # 임베딩 백엔드 (백그라운드 워밍업이 끝나면 채워짐)
+encoder = None # 공유 인코더 서비스 (EncoderService)
+
+# --- 임베딩 백엔드 설정 ---
+# torch (기본) / onnx (ONNX Runtime) / int8 (동적 양자화). 빠른 백엔드로 바꾸기 전에 /encoder/parity 로 오차를 확인하세요.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+ENCODER_NUM_THREADS = int(os.getenv("ENCODER_NUM_THREADS", "0")) # intra-op 스레드 수 (0 이면 라이브러리 기본값)
+ENCODER_MAX_SEQ_LENGTH = int(os.getenv("ENCODER_MAX_SEQ_LENGTH", "0")) # 0 이면 모델 기본값 (MiniLM 은 256 토큰)
+ENCODER_ONNX_FILE = os.getenv("ENCODER_ONNX_FILE", "") # 예: onnx/model_qint8_avx512.onnx
+# --- 다중 프로세스 워커 (worker_pool.py) ---
+# SERVER_WORKERS > 1 이면 모델을 한 번 로드한 뒤 fork 한 자식 프로세스들이 인코딩과 벡터 검색을 나눠 맡습니다.
+# HTTP 와 LanceDB 쓰기는 계속 이 프로세스 하나가 담당합니다. (uvicorn --workers 로 여러 개 띄우면 쓰기 주체가 여러 개가 되므로 쓰지 마세요)
+# 워커마다 ENCODER_NUM_THREADS 개 (0 이면 코어 수 / 워커 수) 의 intra-op 스레드를 씁니다.
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+process_pool = None # worker_pool.WorkerPool (SERVER_WORKERS > 1 이고 fork 가 가능할 때만)
+PARITY_SAMPLE_SIZE = int(os.getenv("PARITY_SAMPLE_SIZE", "64")) # /encoder/parity 가 테이블에서 뽑아 비교할 문장 수
+_parity_backends: Dict[str, Any] = {} # 비교용으로 로드한 다른 백엔드 (한 번만 로드)
+
+# --- 임베딩 캐시 설정 ---
+# 1단계: 메모리 LRU (EMBEDDING_CACHE_MAX_BYTES), 2단계: ./lancedb 옆의 SQLite 파일 (EMBEDDING_CACHE_PATH)
+# 키에 모델 키(_cache_model_key)가 포함되어 있어, 모델 / 백엔드를 바꿔도 예전 행은 남고 개수 제한에 따라 오래된 것부터 정리됩니다.
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite3") # 빈 문자열이면 디스크 계층 비활성화
+EMBEDDING_CACHE_MAX_DISK_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_DISK_ROWS", "500000"))
+
+# --- 대량 적재(/add_batch) 설정 ---
+# 인코딩은 ADD_BATCH_ENCODE_CHUNK 개 단위로, LanceDB 쓰기는 ADD_BATCH_WRITE_SIZE 개 단위로 모아서 합니다.
+# (작은 fragment 가 잔뜩 생기면 이후 table.search 가 느려지기 때문입니다.)
+ADD_BATCH_ENCODE_CHUNK = int(os.getenv("ADD_BATCH_ENCODE_CHUNK", "64"))
+ADD_BATCH_WRITE_SIZE = int(os.getenv("ADD_BATCH_WRITE_SIZE", "1024"))
+
+# --- 벡터 내보내기 설정 ---
+# /get_all_vectors 스트리밍 모드에서 한 번에 읽어 보내는 행 수
+VECTOR_EXPORT_PAGE_SIZE = int(os.getenv("VECTOR_EXPORT_PAGE_SIZE", "4096"))
+
+# --- 하이브리드(전문 + 벡터) 검색 설정 ---
+# 기억 text 를 SQLite FTS5 에도 색인해 BM25 검색과 벡터 검색을 함께 돌리고 결과를 합칩니다.
+MEMORY_FTS_PATH = os.getenv("MEMORY_FTS_PATH", "./memory_fts.sqlite3")
+HYBRID_CANDIDATE_FACTOR = int(os.getenv("HYBRID_CANDIDATE_FACTOR", "4")) # 각 검색에서 limit * 이 값만큼 후보를 가져옴
+text_index = None # MemoryTextIndex (테이블이 준비되면 열림)
+
+# --- 파일 내용 청크 인덱싱 설정 ---
+# 업로드된 파일을 겹치는 청크로 나눠 임베딩하고, files.db 의 files.id 와 연결해 file_chunks 테이블에 저장합니다.
+FILE_CHUNK_TABLE = "file_chunks"
+FILE_CHUNK_CHARS = int(os.getenv("FILE_CHUNK_CHARS", "1000"))
+FILE_CHUNK_OVERLAP = int(os.getenv("FILE_CHUNK_OVERLAP", "200"))
+FILE_TEXT_MAX_CHARS = int(os.getenv("FILE_TEXT_MAX_CHARS", "200000")) # 코드/텍스트 파일 응답에 담는 최대 글자 수
+FILE_UPLOAD_MAX_BYTES = int(os.getenv("FILE_UPLOAD_MAX_BYTES", str(512 * 1024 * 1024)))
+FILE_UPLOAD_WRITE_BYTES = 1024 * 1024 # 업로드 본문을 임시 파일에 한 번에 쓰는 크기
+file_chunks_table = None # 첫 청크를 쓸 때 열거나 생성
+_file_chunks_lock = threading.Lock()
+
+# --- 긴 텍스트 청크 분할 (text_chunking.py) ---
+# 모델 최대 길이를 넘는 텍스트는 토큰 단위로 겹치게 나눠 모두 인코딩합니다. 요청마다 chunking 으로 고릅니다.
+#   none: 기존처럼 앞부분만 / pooled: 청크 벡터의 가중 평균 하나 / chunks: pooled + 청크 벡터를 memory_chunks 에 따로 저장
+# 기본값은 none 입니다. 기본값을 pooled 로 바꾸면 긴 기억의 벡터가 달라지므로, 바꾼 뒤에는 /rebuild_db 를 mode=full 로
+# 한 번 실행해야 합니다. (incremental 은 내용 해시가 같으면 예전(잘린) 벡터를 재사용해 두 방식이 섞입니다)
+# 검색은 memory_chunks 의 청크 결과를 부모 기억(id)으로 합치고, 점수는 (기억, 청크들) 중 최댓값을 씁니다.
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "0")) # 0 이면 모델 최대 길이 (특수 토큰 제외)
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+CHUNK_DEFAULT_MODE = os.getenv("CHUNK_DEFAULT_MODE", "none").lower()
+CHUNK_SEARCH_FACTOR = int(os.getenv("CHUNK_SEARCH_FACTOR", "3")) # 청크 검색은 limit * 이 값만큼 가져와 부모로 합침
+MEMORY_CHUNK_TABLE = "memory_chunks"
+memory_chunks_table = None # chunks 모드로 처음 저장할 때 열거나 생성
+_memory_chunks_lock = threading.Lock()
+
+# --- 자막 세그먼트 벡터 캐시 설정 ---
+# 서버가 video_id 별 세그먼트 행렬을 직접 임베딩해 보관하므로, 클라이언트는 video_id + 질의만 보내면 됩니다.
+SEGMENT_CACHE_MAX_VIDEOS = int(os.getenv("SEGMENT_CACHE_MAX_VIDEOS", "32"))
+SEGMENT_CACHE_MAX_BYTES = int(os.getenv("SEGMENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+segment_store = SegmentStore(max_videos=SEGMENT_CACHE_MAX_VIDEOS, max_bytes=SEGMENT_CACHE_MAX_BYTES)
+
+# --- 유튜브 자막 캐시 / yt-dlp 실행 풀 설정 ---
+TRANSCRIPT_CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR", "./transcript_cache")
+TRANSCRIPT_CACHE_TTL_HOURS = float(os.getenv("TRANSCRIPT_CACHE_TTL_HOURS", "168"))
+TRANSCRIPT_MAX_CONCURRENCY = int(os.getenv("TRANSCRIPT_MAX_CONCURRENCY", "2")) # 동시에 실행할 yt-dlp 프로세스 수
+TRANSCRIPT_FETCHER = os.getenv("TRANSCRIPT_FETCHER", "") # "모듈:이름" 형식. 비어 있으면 yt-dlp 사용 (테스트용 스텁 교체)
+transcript_service = TranscriptService(
+    load_fetcher(TRANSCRIPT_FETCHER),
+    TranscriptCache(TRANSCRIPT_CACHE_DIR, TRANSCRIPT_CACHE_TTL_HOURS * 3600),
+    max_concurrency=TRANSCRIPT_MAX_CONCURRENCY,
+)
+
+# --- 미디어 다운로드 작업 큐 설정 ---
+DOWNLOAD_MAX_WORKERS = int(os.getenv("DOWNLOAD_MAX_WORKERS", "2"))
+DOWNLOAD_PER_HOST_LIMIT = int(os.getenv("DOWNLOAD_PER_HOST_LIMIT", "1"))
+
+def _media_key(url: str) -> str:
+    # 유튜브 URL 은 형식이 달라도 같은 영상이면 같은 키가 되도록 video_id 를 사용합니다.
+    try:
+        return extract_video_id(url)
+    except ValueError:
+        return url
+
+download_jobs = DownloadJobManager(max_workers=DOWNLOAD_MAX_WORKERS, per_host_limit=DOWNLOAD_PER_HOST_LIMIT, key_fn=_media_key)
+
 # --- LanceDB 설정 ---
 db_path = "./lancedb" # 프로젝트 루트에 lancedb 폴더 생성
-db = lancedb.connect(db_path)
+db = None # LanceDB 연결 (_get_db() 로 처음 쓸 때 연결)
+_db_lock = threading.Lock()
 table = None # 테이블 객체를 저장할 전역 변수
+MEMORY_TABLE = "memories" # 논리적인 테이블 이름
+# 논리 이름 -> 실제 LanceDB 테이블 이름. 재구축은 새 그림자 테이블을 만든 뒤 이 포인터만 교체합니다.
+ACTIVE_TABLE_FILE = os.path.join(db_path, "active_tables.json")
+# 교체된 옛 테이블은 진행 중인 검색이 끝날 시간을 준 뒤 삭제합니다.
+REBUILD_DROP_DELAY_SEC = float(os.getenv("REBUILD_DROP_DELAY_SEC", "30"))
+_background_tasks = set() # 가비지 컬렉션되지 않도록 백그라운드 태스크 참조를 보관
+
+# --- ANN 벡터 인덱스 설정 ---
+# 행 수가 ANN_INDEX_MIN_ROWS 를 넘으면 vector 컬럼에 인덱스를 만들고, 백그라운드에서 주기적으로 관리합니다.
+ANN_INDEX_TYPE = os.getenv("ANN_INDEX_TYPE", "IVF_PQ") # IVF_PQ / IVF_HNSW_SQ / IVF_HNSW_PQ 등
+ANN_INDEX_METRIC = "l2" # 검색 쿼리의 기본 거리 함수와 같아야 인덱스가 사용됩니다.
+ANN_INDEX_MIN_ROWS = int(os.getenv("ANN_INDEX_MIN_ROWS", "10000"))
+ANN_INDEX_CHECK_INTERVAL_SEC = float(os.getenv("ANN_INDEX_CHECK_INTERVAL_SEC", "60"))
+ANN_INDEX_OPTIMIZE_MIN_UNINDEXED = int(os.getenv("ANN_INDEX_OPTIMIZE_MIN_UNINDEXED", "1000")) # 이만큼 쌓이면 증분 반영
+ANN_INDEX_RETRAIN_GROWTH = float(os.getenv("ANN_INDEX_RETRAIN_GROWTH", "2.0")) # 학습 당시보다 이 배수로 커지면 재학습
+# --- LanceDB 저장소 정리 (compaction / 옛 버전 삭제) ---
+# /add 할 때마다 작은 fragment 와 새 버전(manifest)이 하나씩 쌓이므로, 임계값을 넘으면 백그라운드에서
+# 작은 파일을 합치고 보존 기간이 지난 버전을 지웁니다. 최근 STORAGE_IDLE_SEC 동안 검색 / 쓰기가 있었으면 미룹니다.
+STORAGE_CHECK_INTERVAL_SEC = float(os.getenv("STORAGE_CHECK_INTERVAL_SEC", "300"))
+STORAGE_COMPACT_MIN_SMALL_FRAGMENTS = int(os.getenv("STORAGE_COMPACT_MIN_SMALL_FRAGMENTS", "32"))
+STORAGE_COMPACT_DELETED_RATIO = float(os.getenv("STORAGE_COMPACT_DELETED_RATIO", "0.1")) # 삭제 표시된 행 비율
+STORAGE_CLEANUP_MIN_VERSIONS = int(os.getenv("STORAGE_CLEANUP_MIN_VERSIONS", "100"))
+STORAGE_VERSION_RETENTION_HOURS = float(os.getenv("STORAGE_VERSION_RETENTION_HOURS", "24")) # 이보다 오래된 버전은 삭제
+STORAGE_IDLE_SEC = float(os.getenv("STORAGE_IDLE_SEC", "30"))
+# --- 압축 벡터 코드 (vector_codes.py) ---
+# VECTOR_CODES=float16 / binary 이면 기억 테이블에 압축 코드 컬럼(vector_code)을 함께 저장하고, 필터 없는 기억 검색을
+# "코드 컬럼만 읽어 훑기 -> 상위 limit x VECTOR_CODES_RESCORE 개를 원래 벡터로 재채점" 의 2단계로 처리합니다.
+# 기존 테이블은 시작할 때 백그라운드에서 컬럼을 추가해 채우고, 다 채워지기 전까지는 LanceDB 벡터 검색을 씁니다.
+# VECTOR_CODES_COMPACT=1 이면 새로 만드는 테이블(첫 생성 / 재구축)의 vector 컬럼을 float16 으로 저장해 float32 를 두지 않습니다.
+#   float16 코드는 vector 컬럼 자체가 코드가 되어 별도 컬럼이 없고, binary 코드는 float16 vector 로 재채점합니다.
+#   기존 테이블은 /rebuild_db (mode=full 권장) 로 다시 만들어야 바뀝니다.
+# 군집화와 /get_all_vectors?dtype=float16 / binary 는 저장된 컬럼 중 가장 작은 것을 읽습니다.
+# 비교는 python -m benchmarks.codes 로 (recall@k / 지연 시간 / 실제 저장 바이트)
+VECTOR_CODES = os.getenv("VECTOR_CODES", "").lower() # 빈 문자열이면 사용하지 않음
+VECTOR_CODES_RESCORE = int(os.getenv("VECTOR_CODES_RESCORE", "10"))
+VECTOR_CODES_COMPACT = os.getenv("VECTOR_CODES_COMPACT", "0").lower() in ("1", "true", "yes")
+if VECTOR_CODES and VECTOR_CODES not in vector_codes.KINDS:
+    print(f"WARN: (Codes) 알 수 없는 VECTOR_CODES='{VECTOR_CODES}' 는 무시합니다. (사용 가능: {', '.join(vector_codes.KINDS)})")
+    VECTOR_CODES = ""
+VECTOR_CODES_BUILD_PAGE_SIZE = 65536
+VECTOR_CODES_SCAN_PAGE_SIZE = 65536 # 1단계에서 코드 컬럼을 한 번에 읽는 행 수
+CODE_COLUMN = "vector_code"
+code_table_ready: Optional[str] = None # 코드가 모든 행에 채워진 테이블 이름 (2단계 검색은 이 테이블에서만)
+# --- 중복에 가까운 기억 정리 (memory_consolidation.py) ---
+# 각 기억의 벡터 인덱스 이웃 CONSOLIDATION_NEIGHBORS 개 중 코사인 유사도가 CONSOLIDATION_THRESHOLD 이상인 쌍을 묶습니다.
+# mark: 중복 기억의 canonical_id 컬럼에 대표 id 를 적어 두고 검색 / 군집화 / 벡터 내보내기에서 숨김 (include_duplicates 로 포함)
+# merge: 중복 기억을 테이블 / 청크 / 전문 인덱스 / 압축 코드에서 지움. 둘 다 {중복 id: 대표 id} 매핑을 돌려줍니다.
+CONSOLIDATION_THRESHOLD = float(os.getenv("CONSOLIDATION_THRESHOLD", "0.95"))
+CONSOLIDATION_NEIGHBORS = int(os.getenv("CONSOLIDATION_NEIGHBORS", "10"))
+CONSOLIDATION_QUERY_BATCH = 256 # 다중 벡터 검색 한 번에 넣는 기억 수
+CONSOLIDATION_INTERVAL_SEC = float(os.getenv("CONSOLIDATION_INTERVAL_SEC", "3600")) # 0 이면 주기 실행 안 함
+CONSOLIDATION_MODE = os.getenv("CONSOLIDATION_MODE", "mark").lower() # 주기 실행에서 쓰는 mode (mark / merge)
+# --- MMR 다양화 ---
+# 검색 요청에 mmr_lambda 를 주면 limit x MMR_CANDIDATE_FACTOR 개 후보에서 서로 덜 겹치는 limit 개를 고릅니다.
+MMR_CANDIDATE_FACTOR = int(os.getenv("MMR_CANDIDATE_FACTOR", "4"))
+# --- 최신성 / 감정 강도 순위 (memory_ranking.py) ---
+# 검색 요청에 ranking 을 주면 유사도에 시간 감쇠와 감정 강도를 더한 점수로 top-k 를 고릅니다. (요청에 없는 값은 아래 기본값)
+# 처음에는 limit x RANK_INITIAL_FACTOR 개 후보를 보고, 아직 보지 않은 기억이 순위를 바꿀 수 있으면 후보를 두 배로 늘립니다.
+RANK_RECENCY_WEIGHT = float(os.getenv("RANK_RECENCY_WEIGHT", "0.2"))
+RANK_HALF_LIFE_HOURS = float(os.getenv("RANK_HALF_LIFE_HOURS", "720")) # 30일이 지나면 최신성 점수가 절반
+RANK_SALIENCE_WEIGHT = float(os.getenv("RANK_SALIENCE_WEIGHT", "0.1"))
+RANK_INITIAL_FACTOR = int(os.getenv("RANK_INITIAL_FACTOR", "2"))
+RANK_MAX_CANDIDATES = int(os.getenv("RANK_MAX_CANDIDATES", "1000"))
+ANN_DEFAULT_NPROBES = int(os.getenv("ANN_DEFAULT_NPROBES", "20"))
+ANN_DEFAULT_REFINE_FACTOR = int(os.getenv("ANN_DEFAULT_REFINE_FACTOR", "0")) # 0 이면 refine 하지 않음
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# 벡터 옆에 함께 저장하는 기억 메타데이터 (Node 의 SQLite memories 테이블과 같은 이름). 검색 필터와 ranking 에 씁니다.
+MEMORY_METADATA_COLUMNS = {"timestamp": pa.float64(), "emotion_tag": pa.string(), "sentiment_score": pa.float64()}
+
+def _memory_row(id: int, text: str, vector: List[float], timestamp: Optional[float] = None,
+                emotion_tag: Optional[str] = None, sentiment_score: Optional[float] = None) -> Dict[str, Any]:
+    """memories 테이블에 저장할 한 행. 모든 쓰기 경로가 이 함수를 거칩니다. (timestamp 는 epoch 초)"""
+    return {"vector": vector, "id": id, "text": text, "content_hash": _content_hash(text),
+            "timestamp": timestamp, "emotion_tag": emotion_tag, "sentiment_score": sentiment_score}
+
+def _memory_schema(dim: int) -> pa.Schema:
+    # 메타데이터가 모두 비어 있는 행으로 테이블을 만들 때 null 타입 컬럼이 생기지 않도록 스키마를 명시합니다.
+    return pa.schema([
+        pa.field("vector", pa.list_(pa.float16() if VECTOR_CODES_COMPACT else pa.float32(), dim)), pa.field("id", pa.int64()),
+        pa.field("text", pa.string()), pa.field("content_hash", pa.string()),
+        *(pa.field(name, type_) for name, type_ in MEMORY_METADATA_COLUMNS.items()),
+        *([pa.field(CODE_COLUMN, vector_codes.arrow_type(VECTOR_CODES, dim))] if _needs_code_column() else []),
+    ])
+
+def _needs_code_column() -> bool:
+    """새 테이블에 별도 코드 컬럼이 필요한지. float16 코드 + COMPACT 이면 vector 컬럼이 곧 코드입니다."""
+    return bool(VECTOR_CODES) and not (VECTOR_CODES == "float16" and VECTOR_CODES_COMPACT)
+
+def _code_column(tbl) -> Optional[str]:
+    """이 테이블에서 VECTOR_CODES 형식의 코드가 들어 있는 컬럼. 없으면 None."""
+    if not VECTOR_CODES:
+        return None
+    schema = tbl.schema
+    if CODE_COLUMN in schema.names and vector_codes.kind_of(schema.field(CODE_COLUMN).type) == VECTOR_CODES:
+        return CODE_COLUMN
+    if VECTOR_CODES == "float16" and vector_codes.kind_of(schema.field("vector").type) == "float16":
+        return "vector"
+    return None
+
+def _vector_array(vectors: np.ndarray) -> pa.FixedSizeListArray:
+    """(N, dim) 벡터를 새 테이블의 vector 컬럼 형식(float32, 또는 COMPACT 이면 float16)의 Arrow 배열로 만듭니다."""
+    value_type = pa.float16() if VECTOR_CODES_COMPACT else pa.float32()
+    vectors = np.asarray(vectors, dtype=np.float16 if value_type == pa.float16() else np.float32)
+    return pa.FixedSizeListArray.from_arrays(pa.array(vectors.ravel()), vectors.shape[1])
+
+def _with_codes(schema: pa.Schema, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """스키마에 코드 컬럼이 있으면 행마다 벡터의 압축 코드를 채웁니다. (기억 테이블에 쓰기 직전에 호출)"""
+    field = schema.field(CODE_COLUMN) if CODE_COLUMN in schema.names else None
+    if field is None or not rows:
+        return rows
+    kind = vector_codes.kind_of(field.type)
+    codes = vector_codes.encode(kind, np.asarray([row["vector"] for row in rows], dtype=np.float32))
+    return [{**row, CODE_COLUMN: code.tolist()} for row, code in zip(rows, codes)]
+
+def _memory_metadata(record) -> Dict[str, Any]:
+    """AddMemoryRequest 의 메타데이터를 저장 형식으로 바꿉니다. timestamp 를 읽을 수 없으면 ValueError."""
+    return {"timestamp": memory_ranking.to_epoch(record.timestamp), "emotion_tag": record.emotion_tag or None,
+            "sentiment_score": record.sentiment_score}
+
+def _vector_column_to_numpy(column) -> np.ndarray:
+    """Arrow fixed_size_list 벡터 컬럼을 (N, dim) float32 배열로 변환합니다."""
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    dim = column.type.list_size
+    return column.flatten().to_numpy(zero_copy_only=False).reshape(-1, dim).astype(np.float32, copy=False)
+
+def _load_ids_and_vectors(tbl, where: Optional[str] = None, column: str = "vector") -> tuple:
+    """id / 벡터 두 컬럼만 Arrow 로 읽어 (int64 배열, (N, dim) float32 행렬) 로 돌려줍니다. (column 은 float 벡터 컬럼)"""
+    query = tbl.search().select(["id", column])
+    if where:
+        query = query.where(where)
+    arrow = query.limit(max(1, tbl.count_rows(where))).to_arrow()
+    ids = arrow.column("id").to_numpy()
+    return ids, _vector_column_to_numpy(arrow.column(column))
+
+def _vector_source(tbl, dtype: str) -> str:
+    """dtype(float32 / float16 / binary) 벡터를 만들 때 읽을 컬럼. 저장된 컬럼 중 그 형식으로 바꿀 수 있는 가장 작은 것입니다."""
+    code_kind = vector_codes.kind_of(tbl.schema.field(CODE_COLUMN).type) if CODE_COLUMN in tbl.schema.names else None
+    if dtype != "float32" and code_kind == dtype:
+        return CODE_COLUMN
+    return "vector"
+
+def _get_db():
+    global db
+    with _db_lock:
+        if db is None:
+            import lancedb
+            db = lancedb.connect(db_path)
+        return db
+
+def _active_table_name(logical: str = MEMORY_TABLE) -> str:
+    try:
+        with open(ACTIVE_TABLE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f).get(logical, logical)
+    except (FileNotFoundError, ValueError):
+        return logical
 
-# 서버 시작 시 실행되는 이벤트 핸들러
-async def startup_event():
-    global model, table
-    
-    # 모델 로드
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+def _set_active_table_name(physical: str, logical: str = MEMORY_TABLE):
+    try:
+        with open(ACTIVE_TABLE_FILE, "r", encoding="utf-8") as f: mapping = json.load(f)
+    except (FileNotFoundError, ValueError):
+        mapping = {}
+    mapping[logical] = physical
+    os.makedirs(db_path, exist_ok=True)
+    tmp_path = ACTIVE_TABLE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f: json.dump(mapping, f)
+    os.replace(tmp_path, ACTIVE_TABLE_FILE) # 원자적 교체
+
+def _ensure_memory_columns(tbl):
+    """예전 버전에서 만든 테이블에 없는 컬럼을 추가합니다."""
+    if "content_hash" not in tbl.schema.names:
+        tbl.add_columns({"content_hash": "CAST(NULL AS STRING)"})
+        print("INFO: (Schema) 'content_hash' 컬럼을 추가했습니다.")
+    sql_types = {pa.float64(): "DOUBLE", pa.string(): "STRING"}
+    missing = {name: f"CAST(NULL AS {sql_types[type_]})" for name, type_ in MEMORY_METADATA_COLUMNS.items()
+               if name not in tbl.schema.names}
+    if missing:
+        tbl.add_columns(missing)
+        print(f"INFO: (Schema) {', '.join(repr(name) for name in missing)} 컬럼을 추가했습니다.")
+
+def _start_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+# --- ANN 인덱스 관리 ---
+_index_state = {
+    "table": None, "building": False, "rows_at_build": None,
+    "last_build": None, "last_build_sec": None, "last_optimize": None, "last_error": None,
+}
+_index_lock = asyncio.Lock()
+
+def _vector_index(tbl):
+    for idx in tbl.list_indices():
+        if "vector" in idx.columns:
+            return idx
+    return None
+
+def _pq_sub_vectors(dim: int) -> int:
+    # PQ 서브벡터 수는 차원을 나눠 떨어져야 합니다. (384 -> 48)
+    for m in range(max(1, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+def _vector_query(tbl, vector, limit: int, nprobes: Optional[int] = None, refine_factor: Optional[int] = None):
+    """ANN 파라미터(nprobes / refine_factor)를 적용한 벡터 검색 쿼리를 만듭니다."""
+    query = tbl.search(vector).limit(limit).nprobes(nprobes or ANN_DEFAULT_NPROBES)
+    refine = ANN_DEFAULT_REFINE_FACTOR if refine_factor is None else refine_factor
+    if refine:
+        query = query.refine_factor(refine)
+    return query
+
+def _build_vector_index(tbl):
+    rows = tbl.count_rows()
+    dim = tbl.schema.field("vector").type.list_size
+    kwargs = dict(metric=ANN_INDEX_METRIC, num_partitions=max(1, int(math.sqrt(rows))), index_type=ANN_INDEX_TYPE, replace=True)
+    if ANN_INDEX_TYPE.endswith("PQ"):
+        kwargs["num_sub_vectors"] = _pq_sub_vectors(dim)
+    started = time.perf_counter()
+    tbl.create_index(**kwargs)
+    _index_state.update(rows_at_build=rows, last_build=time.time(), last_build_sec=round(time.perf_counter() - started, 3))
+    print(f"INFO: (Index) {ANN_INDEX_TYPE} 인덱스 생성 완료 ({rows}행, {_index_state['last_build_sec']}초)")
+
+def _index_status(tbl) -> dict:
+    rows = tbl.count_rows()
+    idx = _vector_index(tbl)
+    status = {
+        "table": tbl.name, "rows": rows, "indexed": idx is not None,
+        "index_type": None, "num_indexed_rows": 0, "num_unindexed_rows": rows,
+        "min_rows": ANN_INDEX_MIN_ROWS, "configured_type": ANN_INDEX_TYPE,
+        **{k: v for k, v in _index_state.items() if k != "table"},
+    }
+    if idx is not None:
+        stats = tbl.index_stats(idx.name)
+        status.update(index_name=idx.name, index_type=stats.index_type,
+                      num_indexed_rows=stats.num_indexed_rows, num_unindexed_rows=stats.num_unindexed_rows)
+    return status
+
+async def maintain_vector_index(force: bool = False) -> str:
+    """
+    인덱스가 없으면 (행 수가 임계값을 넘을 때) 만들고, 색인되지 않은 행이 쌓이면 증분 반영,
+    학습 당시보다 데이터가 크게 늘었으면 재학습합니다. 수행한 작업 이름을 돌려줍니다.
+    """
+    tbl = table
+    if tbl is None or _index_lock.locked() or _rebuild_lock.locked():
+        return "skipped"
+    async with _index_lock:
+        if _index_state["table"] != tbl.name:
+            # 재구축으로 테이블이 교체되었으면 상태를 초기화합니다.
+            _index_state.update(table=tbl.name, rows_at_build=None)
+        try:
+            status = await asyncio.to_thread(_index_status, tbl)
+            action = "none"
+            if not status["indexed"]:
+                if force or status["rows"] >= ANN_INDEX_MIN_ROWS:
+                    action = "build"
+            else:
+                if _index_state["rows_at_build"] is None:
+                    _index_state["rows_at_build"] = status["num_indexed_rows"]
+                if force or status["rows"] >= _index_state["rows_at_build"] * ANN_INDEX_RETRAIN_GROWTH:
+                    action = "retrain"
+                elif status["num_unindexed_rows"] >= ANN_INDEX_OPTIMIZE_MIN_UNINDEXED:
+                    action = "optimize"
+
+            if action in ("build", "retrain"):
+                _index_state["building"] = True
+                await asyncio.to_thread(_build_vector_index, tbl)
+            elif action == "optimize":
+                _index_state["building"] = True
+                await asyncio.to_thread(tbl.optimize)
+                _index_state["last_optimize"] = time.time()
+                print(f"INFO: (Index) 색인되지 않은 {status['num_unindexed_rows']}행을 인덱스에 반영했습니다.")
+            _index_state["last_error"] = None
+            return action
+        except Exception as e:
+            _index_state["last_error"] = str(e)
+            print(f"ERROR: (Index) 인덱스 관리 중 오류: {e}")
+            return "error"
+        finally:
+            _index_state["building"] = False
+
+async def _index_maintenance_loop():
+    while True:
+        await asyncio.sleep(ANN_INDEX_CHECK_INTERVAL_SEC)
+        await maintain_vector_index()
+
+# --- 저장소 정리 ---
+_storage_state = {
+    "running": False, "last_run": None, "last_run_sec": None, "last_action": None,
+    "last_reasons": [], "last_before": None, "last_after": None, "last_error": None,
+}
+_last_table_activity = time.monotonic() # 마지막 검색 / 쓰기가 끝난 시각
+
+def _note_table_activity(name: str, ms: float):
+    global _last_table_activity
+    if name in ("search", "lexical", "db_write"):
+        _last_table_activity = time.monotonic()
+
+stage_timing.add_observer(_note_table_activity)
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # 정리 중에 지워진 파일
+    return total
+
+def _storage_stats(tbl) -> Dict[str, Any]:
+    """fragment / 버전 / 삭제 표시 행 / 디스크 사용량. (버전 목록은 최신 manifest 의 메타데이터를 씀)"""
+    stats = tbl.stats()
+    fragments = stats.get("fragment_stats") or {}
+    versions = tbl.list_versions()
+    latest = (versions[-1].get("metadata") or {}) if versions else {}
+    data_rows = int(latest.get("total_data_file_rows") or 0)
+    deleted_rows = int(latest.get("total_deletion_file_rows") or 0)
+    return {
+        "table": tbl.name, "version": tbl.version, "num_versions": len(versions),
+        "oldest_version_at": versions[0]["timestamp"].isoformat() if versions else None,
+        "rows": stats.get("num_rows", 0),
+        "fragments": fragments.get("num_fragments", 0), "small_fragments": fragments.get("num_small_fragments", 0),
+        "deleted_rows": deleted_rows, "deleted_ratio": round(deleted_rows / data_rows, 4) if data_rows else 0.0,
+        "data_bytes": stats.get("total_bytes", 0),
+        "table_disk_bytes": _dir_bytes(os.path.join(db_path, f"{tbl.name}.lance")),
+    }
+
+def _storage_reasons(stats: Dict[str, Any]) -> List[str]:
+    reasons = []
+    if stats["small_fragments"] >= STORAGE_COMPACT_MIN_SMALL_FRAGMENTS:
+        reasons.append(f"small_fragments={stats['small_fragments']}")
+    if stats["deleted_rows"] and stats["deleted_ratio"] >= STORAGE_COMPACT_DELETED_RATIO:
+        reasons.append(f"deleted_ratio={stats['deleted_ratio']}")
+    if stats["num_versions"] >= STORAGE_CLEANUP_MIN_VERSIONS:
+        reasons.append(f"versions={stats['num_versions']}")
+    return reasons
+
+def _optimize_storage(tbl):
+    # optimize = 작은 fragment 병합 + 삭제 표시 행 정리 + 보존 기간이 지난 버전 삭제 (+ 인덱스 증분 반영)
+    tbl.optimize(cleanup_older_than=timedelta(hours=STORAGE_VERSION_RETENTION_HOURS))
+
+async def maintain_storage(force: bool = False) -> str:
+    """
+    임계값(작은 fragment 수, 삭제 행 비율, 버전 수)을 넘었고 최근 STORAGE_IDLE_SEC 동안 검색 / 쓰기가 없으면
+    테이블을 정리합니다. 인덱스 관리와 같은 락을 써서 두 작업이 겹치지 않습니다. 수행한 작업 이름을 돌려줍니다.
+    """
+    tbl = table
+    if tbl is None or _index_lock.locked() or _rebuild_lock.locked():
+        return "skipped"
+    if not force and time.monotonic() - _last_table_activity < STORAGE_IDLE_SEC:
+        return "busy"
+    async with _index_lock:
+        _storage_state["running"] = True
+        try:
+            before = await asyncio.to_thread(_storage_stats, tbl)
+            reasons = ["forced"] if force else _storage_reasons(before)
+            if not reasons:
+                return "none"
+            started = time.perf_counter()
+            await asyncio.to_thread(_optimize_storage, tbl)
+            after = await asyncio.to_thread(_storage_stats, tbl)
+            _storage_state.update(last_run=time.time(), last_run_sec=round(time.perf_counter() - started, 3),
+                                  last_action="optimize", last_reasons=reasons, last_before=before, last_after=after,
+                                  last_error=None)
+            print(f"INFO: (Storage) 테이블 정리 완료 ({', '.join(reasons)}): fragment {before['fragments']} -> {after['fragments']}, "
+                  f"버전 {before['num_versions']} -> {after['num_versions']}, "
+                  f"디스크 {before['table_disk_bytes']} -> {after['table_disk_bytes']} bytes ({_storage_state['last_run_sec']}초)")
+            return "optimize"
+        except Exception as e:
+            _storage_state["last_error"] = str(e)
+            print(f"ERROR: (Storage) 테이블 정리 중 오류: {e}")
+            return "error"
+        finally:
+            _storage_state["running"] = False
+
+async def _storage_maintenance_loop():
+    while True:
+        await asyncio.sleep(STORAGE_CHECK_INTERVAL_SEC)
+        await maintain_storage()
+
+# --- 긴 텍스트 인코딩 ---
+def _chunk_mode(value: Optional[str]) -> str:
+    """요청의 chunking 값을 확인합니다. 비어 있으면 CHUNK_DEFAULT_MODE, 알 수 없는 값이면 ValueError."""
+    mode = (value or CHUNK_DEFAULT_MODE).lower()
+    if mode not in text_chunking.MODES:
+        raise ValueError(f"chunking 은 {', '.join(text_chunking.MODES)} 중 하나여야 합니다.")
+    return mode
+
+def _split_for_encoding(texts: List[str], modes: List[str]) -> tuple:
+    backend = model
+    limit = CHUNK_MAX_TOKENS or backend.token_limit()
+    # 토큰은 한 글자 이상이므로 글자 수가 limit 이하인 텍스트는 토큰화하지 않아도 청크 하나입니다. (none 은 나누지 않음)
+    long_texts = [i for i, (text, mode) in enumerate(zip(texts, modes)) if mode != "none" and len(text) > limit]
+    offsets: List[list] = [[] for _ in texts]
+    for i, spans in zip(long_texts, backend.token_offsets([texts[i] for i in long_texts]) if long_texts else []):
+        offsets[i] = spans
+    return text_chunking.split_many(texts, offsets, limit, CHUNK_OVERLAP_TOKENS)
+
+async def _encode_long(texts: List[str], modes) -> tuple:
+    """
+    texts 를 (텍스트별 벡터 (n, dim), 텍스트별 [(청크 텍스트, 청크 벡터), ...]) 로 인코딩합니다.
+    모든 텍스트의 청크를 모아 encode_many 한 번으로 (마이크로 배칭 / 캐시를 거쳐) 인코딩하고,
+    청크가 하나뿐인 텍스트는 청크 목록이 비어 있고 벡터도 기존과 같습니다. modes 는 문자열 하나 또는 텍스트별 목록.
+    """
+    modes = [modes] * len(texts) if isinstance(modes, str) else list(modes)
+    chunks, owners, weights = await asyncio.to_thread(_split_for_encoding, texts, modes)
+    if len(chunks) == len(texts):  # 모두 모델 길이 안에 들어감
+        return await encoder.encode_many(texts), [[] for _ in texts]
+    chunk_vectors = await encoder.encode_many(chunks)
+    per_text: List[List[tuple]] = [[] for _ in texts]
+    for chunk, owner, vector in zip(chunks, owners, chunk_vectors):
+        per_text[owner].append((chunk, vector))
+    per_text = [items if len(items) > 1 else [] for items in per_text]
+    return text_chunking.pool(chunk_vectors, owners, weights, len(texts)), per_text
+
+def _get_memory_chunks_table(create_rows: Optional[List[Dict[str, Any]]] = None):
+    """memory_chunks 테이블을 엽니다. 없으면 create_rows 로 생성하고, create_rows 도 없으면 None."""
+    global memory_chunks_table
+    with _memory_chunks_lock:
+        if memory_chunks_table is None:
+            try:
+                memory_chunks_table = _get_db().open_table(MEMORY_CHUNK_TABLE)
+            except Exception:
+                if create_rows is None:
+                    return None
+                memory_chunks_table = _get_db().create_table(MEMORY_CHUNK_TABLE, data=create_rows)
+                return memory_chunks_table
+        if create_rows:
+            memory_chunks_table.add(create_rows)
+        return memory_chunks_table
+
+def _store_memory_chunks(ids: List[int], chunk_lists: List[List[tuple]]):
+    """ids 의 예전 청크를 지우고 새 청크를 저장합니다. (기억 내용이 바뀌면 예전 청크는 더 이상 맞지 않음)"""
+    rows = [
+        {"vector": vector.tolist(), "id": int(id_), "chunk_index": i, "text": chunk}
+        for id_, chunks in zip(ids, chunk_lists) for i, (chunk, vector) in enumerate(chunks)
+    ]
+    with stage_timing.stage("db_write"):
+        tbl = _get_memory_chunks_table()
+        if tbl is not None and ids:
+            tbl.delete(f"id IN ({', '.join(str(int(i)) for i in ids)})")
+        if rows:
+            _get_memory_chunks_table(rows)
+
+def _delete_memory_chunks(ids) -> None:
+    ids = list(ids)
+    if ids and _get_memory_chunks_table() is not None:
+        _store_memory_chunks(ids, [[] for _ in ids])
+
+# --- 검색 공통 도우미 ---
+def _sql_quote(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _visible_filter_sql(tbl) -> Optional[str]:
+    """중복 정리(mark)로 숨긴 기억을 빼는 where 절. 아직 한 번도 표시하지 않은 테이블이면 None."""
+    return f"{CANONICAL_COLUMN} IS NULL" if CANONICAL_COLUMN in tbl.schema.names else None
+
+def _and_where(*clauses: Optional[str]) -> Optional[str]:
+    clauses = [clause for clause in clauses if clause]
+    if len(clauses) <= 1:
+        return clauses[0] if clauses else None
+    return " AND ".join(f"({clause})" for clause in clauses)
+
+def _mmr_lambda(value: Optional[float]) -> Optional[float]:
+    """요청의 mmr_lambda 를 확인합니다. 0~1 밖이면 ValueError."""
+    if value is not None and not 0.0 <= value <= 1.0:
+        raise ValueError("mmr_lambda 는 0 과 1 사이여야 합니다.")
+    return value
+
+def _ranking(value) -> Optional[memory_ranking.Ranking]:
+    """요청의 MemoryRanking 을 확인해 Ranking 으로 바꿉니다. 비어 있는 값은 RANK_* 기본값, 잘못된 값이면 ValueError."""
+    if value is None:
+        return None
+    return memory_ranking.Ranking(
+        similarity_weight=value.similarity_weight,
+        recency_weight=RANK_RECENCY_WEIGHT if value.recency_weight is None else value.recency_weight,
+        half_life_hours=RANK_HALF_LIFE_HOURS if value.half_life_hours is None else value.half_life_hours,
+        salience_weight=RANK_SALIENCE_WEIGHT if value.salience_weight is None else value.salience_weight,
+        emotion_weights=value.emotion_weights, now=value.now,
+    )
+
+def _memory_filter_sql(filters, schema_names) -> Optional[str]:
+    """MemoryFilters 를 LanceDB SQL where 절로 바꿉니다. 테이블에 없는 컬럼으로 거르려 하면 ValueError."""
+    if filters is None:
+        return None
+    clauses = []
+    if filters.id_min is not None: clauses.append(f"id >= {int(filters.id_min)}")
+    if filters.id_max is not None: clauses.append(f"id <= {int(filters.id_max)}")
+    if filters.ids: clauses.append(f"id IN ({', '.join(str(int(i)) for i in filters.ids)})")
+    if filters.timestamp_from is not None or filters.timestamp_to is not None:
+        if "timestamp" not in schema_names:
+            raise ValueError("이 테이블에는 아직 timestamp 컬럼이 저장되어 있지 않습니다.")
+        if filters.timestamp_from is not None: clauses.append(f"timestamp >= {float(filters.timestamp_from)}")
+        if filters.timestamp_to is not None: clauses.append(f"timestamp <= {float(filters.timestamp_to)}")
+    if filters.emotion_tags:
+        if "emotion_tag" not in schema_names:
+            raise ValueError("이 테이블에는 아직 emotion_tag 컬럼이 저장되어 있지 않습니다.")
+        clauses.append(f"emotion_tag IN ({', '.join(_sql_quote(t) for t in filters.emotion_tags)})")
+    return " AND ".join(clauses) or None
+
+def _distance_to_score(distance: float) -> float:
+    # 정규화된 벡터에서 L2 거리 제곱 d 와 코사인 유사도의 관계: cos = 1 - d / 2
+    return 1.0 - float(distance) / 2.0
+
+def _search_memory_hits(tbl, vector, limit: int, where: Optional[str] = None, min_score: Optional[float] = None,
+                        nprobes: Optional[int] = None, refine_factor: Optional[int] = None) -> List[Dict[str, Any]]:
+    """id / text 만 읽어오는 벡터 검색 (vector 컬럼과 DataFrame 변환 없이)."""
+    query = _vector_query(tbl, vector, limit, nprobes, refine_factor).select(["id", "text"])
+    if where:
+        query = query.where(where, prefilter=True)
+    arrow = query.to_arrow()
+    hits = [
+        {"id": id_, "text": text, "score": _distance_to_score(dist)}
+        for id_, text, dist in zip(arrow.column("id").to_pylist(), arrow.column("text").to_pylist(), arrow.column("_distance").to_pylist())
+    ]
+    if min_score is not None:
+        hits = [hit for hit in hits if hit["score"] >= min_score]
+    return hits
+
+def _code_pages(tbl, column: str, where: Optional[str]):
+    """id / 코드 컬럼을 VECTOR_CODES_SCAN_PAGE_SIZE 행씩 (ids, codes) 로 읽습니다. (코드 컬럼만 읽으므로 float32 벡터는 건드리지 않음)"""
+    query = tbl.search().select(["id", column]).limit(None)
+    if where:
+        query = query.where(where)
+    for batch in query.to_batches(VECTOR_CODES_SCAN_PAGE_SIZE):
+        yield batch.column(0).to_numpy(), vector_codes.from_arrow(batch.column(1))
+
+def _search_memory_codes(tbl, vector, limit: int, min_score: Optional[float], kind: str, column: str) -> List[Dict[str, Any]]:
+    """
+    압축 코드 컬럼만 훑어 후보를 고른 뒤, 후보의 원래 벡터만 읽어 정확한 점수로 다시 순위를 매깁니다.
+    중복 정리(mark)로 숨긴 기억은 두 단계 모두에서 빠집니다.
+    """
+    visible = _visible_filter_sql(tbl)
+    candidate_ids = vector_codes.scan(kind, _code_pages(tbl, column, visible), vector, limit * VECTOR_CODES_RESCORE)
+    if candidate_ids.shape[0] == 0:
+        return []
+    where = _and_where(f"id IN ({', '.join(map(str, candidate_ids.tolist()))})", visible)
+    arrow = (tbl.search().where(where)
+             .select(["id", "text", "vector"]).limit(len(candidate_ids) * 2).to_arrow())
+    if arrow.num_rows == 0:
+        return []
+    query = np.asarray(vector, dtype=np.float32).reshape(-1)
+    # LanceDB 벡터 검색과 같은 점수: 1 - (L2 거리 제곱) / 2
+    distances = ((_vector_column_to_numpy(arrow.column("vector")) - query) ** 2).sum(axis=1)
+    best: Dict[int, Dict[str, Any]] = {}
+    for id_, text, dist in zip(arrow.column("id").to_pylist(), arrow.column("text").to_pylist(), distances):
+        score = _distance_to_score(dist)
+        if id_ not in best or score > best[id_]["score"]:
+            best[id_] = {"id": id_, "text": text, "score": score}
+    hits = sorted(best.values(), key=lambda hit: hit["score"], reverse=True)[:limit]
+    if min_score is not None:
+        hits = [hit for hit in hits if hit["score"] >= min_score]
+    return hits
+
+async def _run_search(fn, tbl, *args):
+    """
+    fn(테이블, *args) 형태의 읽기 전용 검색을 실행합니다.
+    워커 프로세스가 있으면 그쪽에서 (이 프로세스가 보고 있는 테이블 버전 이상의 스냅샷으로) 실행하고,
+    없으면 스레드 풀에서 실행합니다. fn 은 pickle 할 수 있는 모듈 최상위 함수여야 합니다.
+    """
+    with stage_timing.stage("search"):
+        pool = process_pool
+        if pool is not None:
+            try:
+                return await asyncio.wrap_future(pool.read(fn, tbl.name, tbl.version, *args))
+            except worker_pool.BrokenProcessPool as e:
+                _disable_process_pool(e)
+        return await asyncio.to_thread(fn, tbl, *args)
+
+def _search_chunk_hits(tbl, vector, limit: int, nprobes: Optional[int] = None,
+                       refine_factor: Optional[int] = None) -> List[Dict[str, Any]]:
+    arrow = _vector_query(tbl, vector, limit, nprobes, refine_factor).select(["id", "chunk_index"]).to_arrow()
+    return [
+        {"id": id_, "chunk_index": chunk_index, "score": _distance_to_score(dist)}
+        for id_, chunk_index, dist in zip(arrow.column("id").to_pylist(), arrow.column("chunk_index").to_pylist(),
+                                          arrow.column("_distance").to_pylist())
+    ]
+
+def _collapse_chunk_hits(tbl, hits: List[Dict[str, Any]], chunk_hits: List[Dict[str, Any]], limit: int,
+                         where: Optional[str] = None, min_score: Optional[float] = None) -> List[Dict[str, Any]]:
+    """청크 검색 결과를 부모 기억으로 합칩니다. 같은 기억은 (기억 벡터, 청크 벡터들) 중 가장 높은 점수를 씁니다."""
+    best = {hit["id"]: dict(hit) for hit in hits}
+    for chunk in chunk_hits:
+        current = best.get(chunk["id"])
+        if current is None or chunk["score"] > current["score"]:
+            best[chunk["id"]] = {"id": chunk["id"], "text": current["text"] if current else None, "score": chunk["score"]}
+    missing = [id_ for id_, hit in best.items() if hit["text"] is None]
+    if missing:
+        # 청크로만 찾은 기억은 본문을 읽어 오고, 필터가 있으면 같이 적용합니다. (부모가 지워진 청크도 여기서 빠짐)
+        clause = f"id IN ({', '.join(str(int(i)) for i in missing)})" + (f" AND ({where})" if where else "")
+        arrow = tbl.search().where(clause).select(["id", "text"]).limit(len(missing) * 2).to_arrow()
+        texts = dict(zip(arrow.column("id").to_pylist(), arrow.column("text").to_pylist()))
+        for id_ in missing:
+            if id_ in texts:
+                best[id_]["text"] = texts[id_]
+            else:
+                del best[id_]
+    ranked = sorted(best.values(), key=lambda hit: hit["score"], reverse=True)[:limit]
+    if min_score is not None:
+        ranked = [hit for hit in ranked if hit["score"] >= min_score]
+    return ranked
+
+def _diversify_hits(tbl, hits: List[Dict[str, Any]], limit: int, mmr_lambda: float) -> List[Dict[str, Any]]:
+    """후보의 벡터를 읽어 MMR 로 limit 개를 다시 고릅니다. 관련도는 후보의 코사인 유사도(score) 그대로입니다."""
+    ids = [hit["id"] for hit in hits]
+    arrow = tbl.search().where(f"id IN ({', '.join(str(int(i)) for i in ids)})").select(["id", "vector"]).limit(len(ids) * 2).to_arrow()
+    rows: Dict[int, int] = {}
+    for row, id_ in enumerate(arrow.column("id").to_pylist()):
+        rows.setdefault(id_, row)
+    hits = [hit for hit in hits if hit["id"] in rows]
+    if len(hits) <= limit:
+        return hits
+    vectors = _vector_column_to_numpy(arrow.column("vector"))[[rows[hit["id"]] for hit in hits]]
+    picked = memory_consolidation.mmr(vectors, [hit["score"] for hit in hits], limit, mmr_lambda)
+    return [hits[i] for i in picked]
+
+def _rank_hits(tbl, hits: List[Dict[str, Any]], ranking: memory_ranking.Ranking) -> List[Dict[str, Any]]:
+    """후보의 timestamp / emotion_tag / sentiment_score 를 읽어 붙이고 ranking 점수 순으로 정렬합니다."""
+    if not hits:
+        return []
+    columns = [name for name in MEMORY_METADATA_COLUMNS if name in tbl.schema.names]
+    ids = [hit["id"] for hit in hits]
+    arrow = tbl.search().where(f"id IN ({', '.join(str(int(i)) for i in ids)})").select(["id", *columns]).limit(len(ids) * 2).to_arrow()
+    metadata: Dict[int, Dict[str, Any]] = {}
+    for row in arrow.to_pylist():
+        metadata.setdefault(row.pop("id"), row)
+    return ranking.score([{**hit, **metadata.get(hit["id"], {})} for hit in hits])
+
+async def _memory_hits(tbl, vector, limit: int, where: Optional[str] = None, min_score: Optional[float] = None,
+                       nprobes: Optional[int] = None, refine_factor: Optional[int] = None,
+                       include_duplicates: bool = False, mmr_lambda: Optional[float] = None,
+                       ranking: Optional[memory_ranking.Ranking] = None) -> List[Dict[str, Any]]:
+    """
+    기억 벡터 검색. 압축 코드가 이 테이블 기준으로 준비되어 있고 필터가 없으면 2단계 검색을,
+    아니면 LanceDB 벡터 검색(필터는 prefilter)을 씁니다. memory_chunks 가 있으면 청크 결과도 부모 기억으로 합칩니다.
+    중복 정리(mark)로 숨긴 기억은 include_duplicates 가 아니면 빠지고, mmr_lambda 가 있으면
+    limit x MMR_CANDIDATE_FACTOR 개 후보에서 MMR 로 limit 개를 고릅니다.
+    ranking 이 있으면 유사도 + 최신성 + 감정 강도 점수로 순위를 매깁니다. (score 는 합친 점수, similarity 는 코사인 유사도)
+    """
+    if limit < 1:
+        return []
+    hidden = None if include_duplicates else _visible_filter_sql(tbl)
+    full_where = _and_where(where, hidden)
+    wanted = limit * MMR_CANDIDATE_FACTOR if mmr_lambda is not None else limit
+    # 압축 코드 검색은 보이는 기억만 돌려주므로, 숨긴 기억까지 찾아야 할 때는 LanceDB 검색을 씁니다.
+    use_codes = not where and (hidden is not None or CANONICAL_COLUMN not in tbl.schema.names)
+
+    async def memory_side(fetch: int):
+        column = _code_column(tbl) if use_codes and code_table_ready == tbl.name else None
+        if column is not None:
+            return await _run_search(_search_memory_codes, tbl, vector, fetch, min_score, VECTOR_CODES, column)
+        return await _run_search(_search_memory_hits, tbl, vector, fetch, full_where, min_score, nprobes, refine_factor)
+
+    async def similar(fetch: int):
+        chunks_tbl = memory_chunks_table
+        if chunks_tbl is None:
+            return await memory_side(fetch)
+        hits, chunk_hits = await asyncio.gather(
+            memory_side(fetch),
+            _run_search(_search_chunk_hits, chunks_tbl, vector, fetch * CHUNK_SEARCH_FACTOR, nprobes, refine_factor),
+        )
+        with stage_timing.stage("search"):
+            return await asyncio.to_thread(_collapse_chunk_hits, tbl, hits, chunk_hits, fetch, full_where, min_score)
+
+    if ranking is None:
+        hits = await similar(wanted)
+    else:
+        # 유사도 순 후보에 점수를 매기고, 아직 보지 않은 기억(유사도가 마지막 후보 이하)이 최대 가산점을 받아도
+        # 현재 wanted 번째 점수를 넘을 수 없으면 멈춥니다. 아니면 후보를 두 배로 늘려 다시 봅니다.
+        fetch = max(wanted, min(wanted * RANK_INITIAL_FACTOR, RANK_MAX_CANDIDATES))
+        while True:
+            candidates = await similar(fetch)
+            with stage_timing.stage("search"):
+                ranked = await asyncio.to_thread(_rank_hits, tbl, candidates, ranking)
+            if (not ranked or len(candidates) < fetch or fetch >= RANK_MAX_CANDIDATES
+                    or ranking.settled(ranked, wanted, min(hit["similarity"] for hit in ranked))):
+                break
+            fetch = min(fetch * 2, RANK_MAX_CANDIDATES)
+        hits = ranked[:wanted]
+    if mmr_lambda is not None and len(hits) > limit:
+        with stage_timing.stage("search"):
+            hits = await asyncio.to_thread(_diversify_hits, tbl, hits, limit, mmr_lambda)
+    return hits
+
+def _reciprocal_rank_fusion(ranked_lists: List[List[Dict[str, Any]]], k: int = 60, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """여러 순위 목록을 RRF (sum 1 / (k + rank)) 로 합칩니다. 같은 id 는 한 번만 나옵니다."""
+    scores: Dict[int, float] = {}
+    texts: Dict[int, str] = {}
+    for hits in ranked_lists:
+        for rank, hit in enumerate(hits, start=1):
+            scores[hit["id"]] = scores.get(hit["id"], 0.0) + 1.0 / (k + rank)
+            texts.setdefault(hit["id"], hit["text"])
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    if limit is not None:
+        fused = fused[:limit]
+    return [{"id": id_, "text": texts[id_], "score": score} for id_, score in fused]
+
+def _fuse_hybrid(vector_hits: List[Dict[str, Any]], lexical_hits: List[Dict[str, Any]], fusion: str,
+                 vector_weight: float, rrf_k: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    벡터 / BM25 결과를 합칩니다.
+    - rrf: 순위만 사용 (점수 척도가 달라도 안정적)
+    - weighted: 벡터는 코사인 유사도, BM25 는 후보 중 최댓값으로 나눈 값을 vector_weight 비율로 더함
+    """
+    vector_scores = {hit["id"]: hit["score"] for hit in vector_hits}
+    lexical_scores = {hit["id"]: hit["score"] for hit in lexical_hits}
+    if fusion == "weighted":
+        top_lexical = max(lexical_scores.values(), default=0.0)
+        texts = {hit["id"]: hit["text"] for hit in lexical_hits + vector_hits}
+        fused = {
+            id_: vector_weight * max(0.0, vector_scores.get(id_, 0.0))
+            + (1.0 - vector_weight) * (lexical_scores.get(id_, 0.0) / top_lexical if top_lexical > 0 else 0.0)
+            for id_ in texts
+        }
+        ranked = [{"id": id_, "text": texts[id_], "score": score}
+                  for id_, score in sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]]
+    else:
+        ranked = _reciprocal_rank_fusion([vector_hits, lexical_hits], k=rrf_k, limit=limit)
+    for hit in ranked:
+        hit["vector_score"] = vector_scores.get(hit["id"])
+        hit["lexical_score"] = lexical_scores.get(hit["id"])
+    return ranked
+
+def _filter_memory_ids(tbl, ids: List[int], where: str) -> set:
+    """BM25 후보 중 필터(where) 조건을 만족하는 id 만 남깁니다. (전문 인덱스에는 timestamp 등이 없으므로)"""
+    if not ids:
+        return set()
+    clause = f"id IN ({', '.join(str(int(i)) for i in ids)}) AND ({where})"
+    arrow = tbl.search().where(clause).select(["id"]).limit(len(ids)).to_arrow()
+    return set(arrow.column("id").to_pylist())
+
+def _lexical_memory_hits(tbl, query: str, limit: int, where: Optional[str]) -> List[Dict[str, Any]]:
+    with stage_timing.stage("lexical"):
+        hits = text_index.search(query, limit)
+    if where and hits:
+        allowed = _filter_memory_ids(tbl, [hit["id"] for hit in hits], where)
+        hits = [hit for hit in hits if hit["id"] in allowed]
+    return hits
+
+def _sync_text_index(tbl) -> int:
+    """전문 인덱스를 현재 테이블 내용으로 다시 채웁니다. (인덱스를 처음 만들었거나 행 수가 어긋났을 때)"""
+    arrow = tbl.search().select(["id", "text"]).limit(max(1, tbl.count_rows())).to_arrow()
+    return text_index.replace_all(zip(arrow.column("id").to_pylist(), arrow.column("text").to_pylist()))
+
+def _index_text_safely(upserts=(), deletes=()):
+    # 전문 인덱스 갱신이 실패해도 벡터 쓰기는 이미 끝났으므로 요청은 성공시키고, 다음 시작 때 재동기화됩니다.
+    if text_index is None:
+        return
+    try:
+        text_index.delete(deletes)
+        text_index.upsert(upserts)
+    except Exception as e:
+        log("WARN", f"(FTS) 전문 인덱스 갱신 실패: {e}")
+
+async def _open_text_index(tbl):
+    global text_index
+    try:
+        text_index = await asyncio.to_thread(MemoryTextIndex, MEMORY_FTS_PATH)
+        rows, indexed = await asyncio.to_thread(tbl.count_rows), await asyncio.to_thread(text_index.count)
+        if rows != indexed:
+            synced = await asyncio.to_thread(_sync_text_index, tbl)
+            print(f"INFO: (FTS) 전문 인덱스를 다시 채웠습니다. ({indexed} -> {synced}개)")
+    except Exception as e:
+        print(f"WARN: (FTS) 전문 인덱스를 열 수 없어 하이브리드 검색은 벡터만 사용합니다: {e}")
+        text_index = None
+
+# --- 압축 벡터 코드 컬럼 관리 ---
+def _fill_code_page(tbl, column: str, kind: str) -> int:
+    """코드가 비어 있는 행을 한 페이지 읽어 코드를 채웁니다. 채운 행 수를 돌려줍니다."""
+    page = (tbl.search().where(f"{column} IS NULL").select(["id", "vector"])
+            .limit(VECTOR_CODES_BUILD_PAGE_SIZE).to_arrow())
+    if page.num_rows == 0:
+        return 0
+    tbl.merge_insert("id").when_matched_update_all().execute(pa.table({
+        "id": page.column("id"),
+        column: vector_codes.to_arrow(kind, _vector_column_to_numpy(page.column("vector"))),
+    }))
+    return page.num_rows
+
+def _code_column_stats(tbl) -> Dict[str, Any]:
+    """행당 저장 바이트 (LanceDB 에 실제로 저장되는 컬럼 기준)."""
+    dim = tbl.schema.field("vector").type.list_size
+    vector_bytes = dim * (2 if vector_codes.kind_of(tbl.schema.field("vector").type) == "float16" else 4)
+    column = _code_column(tbl)
+    code_bytes = vector_codes.bytes_per_row(VECTOR_CODES, dim) if column == CODE_COLUMN else 0
+    return {
+        "kind": VECTOR_CODES or None, "table": tbl.name, "column": column, "ready": code_table_ready == tbl.name,
+        "vector_dtype": str(tbl.schema.field("vector").type.value_type), "dim": dim,
+        "vector_bytes_per_row": vector_bytes, "code_bytes_per_row": code_bytes,
+        "stored_bytes_per_row": vector_bytes + code_bytes, "float32_bytes_per_row": dim * 4,
+    }
+
+async def _prepare_code_column(tbl):
+    """
+    VECTOR_CODES 형식의 코드 컬럼을 준비합니다. 없거나 형식이 다르면 컬럼을 (다시) 만들고, 비어 있는 행을 페이지 단위로 채웁니다.
+    채우는 동안 쓰기는 _table_write_lock 으로 잠깐씩 막아서, 방금 바뀐 벡터의 코드를 옛 벡터로 덮어쓰지 않게 합니다.
+    """
+    global code_table_ready
+    try:
+        if VECTOR_CODES_COMPACT and vector_codes.kind_of(tbl.schema.field("vector").type) != "float16":
+            print("INFO: (Codes) VECTOR_CODES_COMPACT 는 새로 만드는 테이블에만 적용됩니다. 지금 테이블은 /rebuild_db 로 다시 만들면 float16 으로 바뀝니다.")
+        column = _code_column(tbl)
+        if column is None:
+            dim = tbl.schema.field("vector").type.list_size
+            async with _table_write_lock:
+                if CODE_COLUMN in tbl.schema.names:
+                    await asyncio.to_thread(tbl.drop_columns, [CODE_COLUMN])
+                await asyncio.to_thread(tbl.add_columns, pa.field(CODE_COLUMN, vector_codes.arrow_type(VECTOR_CODES, dim)))
+            print(f"INFO: (Schema) '{CODE_COLUMN}' ({VECTOR_CODES}) 컬럼을 추가했습니다.")
+            column = CODE_COLUMN
+        started, filled = time.perf_counter(), 0
+        while True:
+            async with _table_write_lock:
+                if table is not tbl:
+                    return  # 재구축으로 테이블이 바뀌었으면 새 테이블은 이미 코드가 채워져 있습니다.
+                count = await asyncio.to_thread(_fill_code_page, tbl, column, VECTOR_CODES)
+            if count == 0:
+                break
+            filled += count
+        if filled:
+            print(f"INFO: (Codes) 압축 코드 {filled}행을 채웠습니다. ({time.perf_counter() - started:.1f}초)")
+        code_table_ready = tbl.name
+        print(f"INFO: (Codes) 2단계 검색 사용: {_code_column_stats(tbl)}")
+    except Exception as e:
+        print(f"WARN: (Codes) 압축 코드 컬럼을 준비할 수 없어 LanceDB 벡터 검색만 사용합니다: {e}")
+
+# --- 중복에 가까운 기억 정리 ---
+CANONICAL_COLUMN = "canonical_id" # mark 로 숨긴 기억에만 대표 기억 id 가 들어 있습니다. (재구축은 내용이 같은 기억의 표시를 이어받음)
+_consolidation_state = {
+    "running": False, "last_run": None, "last_run_sec": None, "last_mode": None,
+    "last_scanned": 0, "last_groups": 0, "last_duplicates": 0, "last_error": None,
+}
+_consolidation_lock = asyncio.Lock()
+
+def _near_duplicate_pairs(tbl, threshold: float, neighbors: int) -> tuple:
+    """
+    보이는 기억을 페이지 단위로 읽어, CONSOLIDATION_QUERY_BATCH 개씩 다중 벡터 검색으로 이웃 neighbors 개를 찾습니다.
+    ({(작은 id, 큰 id): 점수}, 훑은 행 수) 를 돌려줍니다. 점수는 ANN 거리 기준이라 PQ 인덱스에서는 근사값입니다.
+    """
+    visible = _visible_filter_sql(tbl)
+    pairs: Dict[tuple, float] = {}
+    scanned = 0
+    for page in _iter_vector_pages(tbl, where=visible):
+        ids = page.column("id").to_pylist()
+        matrix = _vector_column_to_numpy(page.column("vector"))
+        scanned += len(ids)
+        for start in range(0, len(ids), CONSOLIDATION_QUERY_BATCH):
+            batch = matrix[start:start + CONSOLIDATION_QUERY_BATCH]
+            query = _vector_query(tbl, batch.tolist(), neighbors + 1).select(["id"])
+            if visible:
+                query = query.where(visible, prefilter=True)
+            arrow = query.to_arrow()
+            # 질의가 하나뿐이면 query_index 컬럼이 없을 수 있습니다.
+            owners = arrow.column("query_index").to_pylist() if "query_index" in arrow.column_names else [0] * arrow.num_rows
+            for owner, other, dist in zip(owners, arrow.column("id").to_pylist(), arrow.column("_distance").to_pylist()):
+                own = ids[start + owner]
+                score = _distance_to_score(dist)
+                if other == own or score < threshold:
+                    continue
+                key = (min(own, other), max(own, other))
+                pairs[key] = max(score, pairs.get(key, score))
+    return pairs, scanned
+
+def _read_memories(tbl, ids: List[int]) -> tuple:
+    """ids 의 ({id: text}, {id: 벡터}). 같은 id 가 여러 행이면 처음 읽은 행을 씁니다."""
+    texts, vectors = {}, {}
+    for start in range(0, len(ids), 1000):
+        part = ids[start:start + 1000]
+        arrow = (tbl.search().where(f"id IN ({', '.join(str(int(i)) for i in part)})")
+                 .select(["id", "text", "vector"]).limit(len(part) * 2).to_arrow())
+        matrix = _vector_column_to_numpy(arrow.column("vector"))
+        for row, (id_, text) in enumerate(zip(arrow.column("id").to_pylist(), arrow.column("text").to_pylist())):
+            if id_ not in texts:
+                texts[id_], vectors[id_] = text, matrix[row]
+    return texts, vectors
+
+def _mark_duplicates(tbl, mapping: Dict[int, int]):
+    if CANONICAL_COLUMN not in tbl.schema.names:
+        tbl.add_columns({CANONICAL_COLUMN: "CAST(NULL AS BIGINT)"})
+        print(f"INFO: (Schema) '{CANONICAL_COLUMN}' 컬럼을 추가했습니다.")
+    # 그룹마다 update 하면 버전이 그룹 수만큼 쌓이므로, (id, 대표 id) 를 한 번의 merge_insert 로 씁니다.
+    marks = pa.table({
+        "id": pa.array(list(mapping), type=pa.int64()),
+        CANONICAL_COLUMN: pa.array(list(mapping.values()), type=pa.int64()),
+    })
+    tbl.merge_insert("id").when_matched_update_all().execute(marks)
+
+def _consolidate(tbl, mode: str, threshold: float, neighbors: int, canonical: str) -> Dict[str, Any]:
+    started = time.perf_counter()
+    pairs, scanned = _near_duplicate_pairs(tbl, threshold, neighbors)
+    ids = sorted({id_ for pair in pairs for id_ in pair})
+    texts, vectors = _read_memories(tbl, ids) if ids else ({}, {})
+    key = memory_consolidation.canonical_key(canonical, texts)
+    groups = memory_consolidation.group_pairs(
+        ((a, b, score) for (a, b), score in pairs.items() if a in vectors and b in vectors), vectors, threshold, key
+    )
+    mapping = memory_consolidation.mapping(groups)
+    if mapping and mode in ("mark", "merge"):
+        duplicate_ids = list(mapping)
+        if mode == "mark":
+            _mark_duplicates(tbl, mapping)
+        else:
+            tbl.delete(f"id IN ({', '.join(str(int(i)) for i in duplicate_ids)})")
+            _delete_memory_chunks(duplicate_ids)
+            _index_text_safely(deletes=duplicate_ids)
+    return {
+        "mode": mode, "threshold": threshold, "scanned": scanned, "pairs": len(pairs),
+        "groups": groups, "mapping": mapping, "elapsed_sec": round(time.perf_counter() - started, 3),
+    }
+
+async def consolidate_memories(mode: str = "mark", threshold: Optional[float] = None, neighbors: Optional[int] = None,
+                               canonical: str = "oldest", force: bool = False) -> Dict[str, Any]:
+    """
+    중복에 가까운 기억을 찾아 mode 대로 처리합니다. (dry_run: 찾기만 / mark: 숨김 표시 / merge: 삭제)
+    다른 정리 작업이나 재구축 중이면 {"action": "skipped"}, 최근 STORAGE_IDLE_SEC 안에 검색 / 쓰기가 있었으면
+    (force 가 아닐 때) {"action": "busy"} 를 돌려줍니다.
+    """
+    tbl = table
+    if tbl is None or _consolidation_lock.locked() or _rebuild_lock.locked():
+        return {"action": "skipped"}
+    if not force and time.monotonic() - _last_table_activity < STORAGE_IDLE_SEC:
+        return {"action": "busy"}
+    threshold = CONSOLIDATION_THRESHOLD if threshold is None else threshold
+    neighbors = neighbors or CONSOLIDATION_NEIGHBORS
+    async with _consolidation_lock:
+        _consolidation_state["running"] = True
+        try:
+            result = await asyncio.to_thread(_consolidate, tbl, mode, threshold, neighbors, canonical)
+            _consolidation_state.update(last_run=time.time(), last_run_sec=result["elapsed_sec"], last_mode=mode,
+                                        last_scanned=result["scanned"], last_groups=len(result["groups"]),
+                                        last_duplicates=len(result["mapping"]), last_error=None)
+            print(f"INFO: (Consolidate) {mode}: {result['scanned']}개 중 중복 {len(result['mapping'])}개 "
+                  f"(그룹 {len(result['groups'])}개, 쌍 {result['pairs']}개, {result['elapsed_sec']}초)")
+            if table is not tbl:
+                print("WARN: (Consolidate) 정리 도중 재구축으로 테이블이 교체되어, 결과는 옛 테이블에만 반영되었습니다.")
+            return {"action": mode, **result}
+        except Exception as e:
+            _consolidation_state["last_error"] = str(e)
+            print(f"ERROR: (Consolidate) 중복 기억 정리 중 오류: {e}")
+            return {"action": "error", "error": str(e)}
+        finally:
+            _consolidation_state["running"] = False
+
+async def _consolidation_loop():
+    while True:
+        await asyncio.sleep(CONSOLIDATION_INTERVAL_SEC)
+        await consolidate_memories(CONSOLIDATION_MODE)
+
+def _cache_model_key() -> str:
+    # 백엔드마다 벡터가 조금씩 다르므로, torch 가 아니면 캐시 키에 백엔드 이름을 붙입니다. (행 키에 들어가므로 다른 키의 디스크 캐시는 지워지지 않습니다)
+    # ONNX 는 모델 파일(fp32 / 양자화 변형)마다, 최대 길이를 바꾸면 긴 텍스트의 잘리는 위치마다 벡터가 달라지므로 키에 넣습니다.
+    key = MODEL_NAME if EMBEDDING_BACKEND == "torch" else f"{MODEL_NAME}:{EMBEDDING_BACKEND}"
+    if EMBEDDING_BACKEND == "onnx" and ENCODER_ONNX_FILE:
+        key += f":{ENCODER_ONNX_FILE}"
+    if ENCODER_MAX_SEQ_LENGTH:
+        key += f":max{ENCODER_MAX_SEQ_LENGTH}"
+    return key
+
+# --- 시작 / 준비 상태 ---
+# 서버는 라이브러리 import 직후 바로 요청을 받고, 모델 로드와 테이블 열기는 백그라운드에서 진행됩니다.
+# /health/live 는 프로세스가 살아 있는지만, /health/ready 는 구성 요소별 준비 상태를 알려줍니다.
+_components: Dict[str, Dict[str, Any]] = {
+    "model": {"status": "pending", "error": None},
+    "table": {"status": "pending", "error": None},
+}
+_startup_timings: Dict[str, float] = {}
+_model_settled = asyncio.Event() # 모델 로드가 (성공이든 실패든) 끝나면 set
+
+def _mark_timing(name: str, started: float):
+    _startup_timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+def _pick_device() -> str:
+    if EMBEDDING_BACKEND == "stub":  # 해싱 인코더는 torch 없이 CPU 에서만 동작합니다.
+        return 'cpu'
+    import torch
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+def _load_model_backend():
+    device = _pick_device()
     print(f"INFO: 사용하는 장치: {device}")
+    print(f"INFO: '{MODEL_NAME}' 모델을 '{EMBEDDING_BACKEND}' 백엔드로 로드하는 중...")
+    return encoder_backends.load_backend(EMBEDDING_BACKEND, MODEL_NAME, device=device,
+                                         num_threads=ENCODER_NUM_THREADS, max_seq_length=ENCODER_MAX_SEQ_LENGTH,
+                                         onnx_file=ENCODER_ONNX_FILE)
+
+def _open_embedding_cache() -> EmbeddingCache:
     try:
-        print(f"INFO: '{MODEL_NAME}' 모델을 로드하는 중...")
-        model = SentenceTransformer(MODEL_NAME, device=device)
-        print("INFO: 모델 로드가 완료되었습니다.")
+        return EmbeddingCache(_cache_model_key(), max_memory_bytes=EMBEDDING_CACHE_MAX_BYTES,
+                              disk_path=EMBEDDING_CACHE_PATH or None, max_disk_rows=EMBEDDING_CACHE_MAX_DISK_ROWS)
+    except Exception as e:
+        # 디스크 캐시를 열 수 없어도 서버는 메모리 캐시만으로 동작합니다.
+        print(f"WARN: 임베딩 디스크 캐시를 열 수 없어 메모리 캐시만 사용합니다: {e}")
+        return EmbeddingCache(_cache_model_key(), max_memory_bytes=EMBEDDING_CACHE_MAX_BYTES)
+
+def _start_process_pool(backend):
+    """fork-after-load 워커 풀을 띄웁니다. 쓸 수 없는 환경이면 None (이 프로세스 안에서 처리)."""
+    if not worker_pool.fork_supported():
+        print(f"WARN: (Workers) 이 플랫폼은 fork 를 지원하지 않아 SERVER_WORKERS={SERVER_WORKERS} 를 무시하고 단일 프로세스로 실행합니다.")
+        return None
+    if backend.device != 'cpu':
+        print(f"WARN: (Workers) '{backend.device}' 장치에서는 워커 프로세스를 쓰지 않습니다. (GPU 는 한 프로세스에서 배치로 처리)")
+        return None
+    pool = worker_pool.WorkerPool(backend, SERVER_WORKERS, db_path, threads_per_worker=ENCODER_NUM_THREADS or None,
+                                  backend_loader=_load_model_backend)
+    pool.start()
+    print(f"INFO: (Workers) 워커 프로세스 {pool.workers}개 준비 완료. {pool.describe()}")
+    return pool
+
+def _disable_process_pool(error: Exception):
+    # 자식이 죽어 풀이 깨지면 다시 fork 하지 않고 (부모는 이미 LanceDB 를 쓰고 있음) 이 프로세스 안에서 처리합니다.
+    global process_pool
+    if process_pool is None:
+        return
+    print(f"ERROR: (Workers) 워커 프로세스 풀이 중단되어 단일 프로세스로 전환합니다: {error}")
+    process_pool = None
+    _components["workers"].update(status="failed", error=str(error))
+
+def _encode_batch(backend, texts: List[str]) -> np.ndarray:
+    pool = process_pool
+    if pool is not None:
+        try:
+            return pool.encode(texts).result()
+        except worker_pool.BrokenProcessPool as e:
+            _disable_process_pool(e)
+    return backend.encode(texts, batch_size=len(texts))
+
+async def _start_model():
+    global model, encoder, process_pool
+    _components["model"]["status"] = "loading"
+    started = time.perf_counter()
+    try:
+        backend = await asyncio.to_thread(_load_model_backend)
+        _mark_timing("model_load_ms", started)
+        print(f"INFO: 모델 로드가 완료되었습니다. {backend.describe()}")
+
+        if SERVER_WORKERS > 1:
+            # 테이블을 열기 전에 (LanceDB 런타임이 뜨기 전에) fork 합니다. 워밍업은 각 워커에서 합니다.
+            _components["workers"] = {"status": "loading", "error": None}
+            warmup_started = time.perf_counter()
+            try:
+                process_pool = await asyncio.to_thread(_start_process_pool, backend)
+                _components["workers"].update(status="ready" if process_pool else "disabled",
+                                              **(process_pool.describe() if process_pool else {}))
+            except Exception as e:
+                print(f"ERROR: (Workers) 워커 프로세스 시작 실패, 단일 프로세스로 실행합니다: {e}")
+                _components["workers"].update(status="failed", error=str(e))
+            _mark_timing("workers_start_ms", warmup_started)
+
+        if process_pool is None:
+            # 첫 forward pass 는 메모리 할당 등으로 느리므로 미리 한 번 돌려둡니다. (캐시에는 넣지 않음)
+            warmup_started = time.perf_counter()
+            await asyncio.to_thread(backend.encode, ["warmup"])
+            _mark_timing("model_warmup_ms", warmup_started)
+
+        cache = await asyncio.to_thread(_open_embedding_cache)
+        service = EncoderService(
+            lambda texts: _encode_batch(backend, texts),
+            max_batch_size=ENCODER_MAX_BATCH_SIZE,
+            max_wait_ms=ENCODER_MAX_WAIT_MS,
+            cache=cache,
+            max_inflight_batches=process_pool.workers if process_pool is not None else 1,
+        )
+        service.start()
+        # encoder 를 먼저 채워야 "model 이 있으면 encoder 도 있다" 가 항상 성립합니다.
+        encoder, model = service, backend
+        _components["model"].update(status="ready", backend=backend.describe())
+        print(f"INFO: 인코더 서비스 시작 (최대 배치 {ENCODER_MAX_BATCH_SIZE}, 최대 대기 {ENCODER_MAX_WAIT_MS}ms)")
     except Exception as e:
         print(f"ERROR: 모델 로드 중 오류 발생: {e}")
-        model = None
+        _components["model"].update(status="failed", error=str(e))
+    finally:
+        _model_settled.set()
 
-    # LanceDB 테이블 열기 또는 생성
-    table_name = "memories"
+def _try_open_table(table_name: str):
+    # 1. 일단 테이블을 열려고 시도합니다. 없으면 (None, 오류) 를 돌려줍니다.
     try:
-        # 1. 일단 테이블을 열려고 시도합니다.
-        table = db.open_table(table_name)
-        print(f"INFO: LanceDB 테이블 '{table_name}'을 성공적으로 열었습니다.")
+        tbl = _get_db().open_table(table_name)
     except Exception as e:
-        # 2. 어떤 종류의 오류든 발생하면 (즉, 테이블이 없으면), 새로 생성합니다.
-        print(f"INFO: LanceDB 테이블 '{table_name}'을 찾을 수 없어 새로 생성합니다. (오류: {e})")
-        if model:
-            try:
-                # 테이블을 생성하기 위한 초기 데이터 (스키마 정의용)
-                initial_vector = model.encode("init").tolist()
-                schema_data = [{"vector": initial_vector, "id": 0, "text": "initial_record"}]
-                
-                # 기존에 같은 이름의 테이블이 남아있을 경우를 대비해, 덮어쓰기 모드(overwrite)로 안전하게 생성
-                table = db.create_table(table_name, data=schema_data, mode="overwrite")
-                print(f"INFO: LanceDB 테이블 '{table_name}' 생성을 완료했습니다.")
-            except Exception as create_e:
-                print(f"ERROR: LanceDB 테이블 생성 중 심각한 오류 발생: {create_e}")
+        return None, e
+    _ensure_memory_columns(tbl)
+    return tbl, None
+
+def _create_table(table_name: str):
+    # 테이블을 생성하기 위한 초기 데이터 (스키마 정의용)
+    initial_vector = model.encode("init").tolist()
+    schema = _memory_schema(len(initial_vector))
+    schema_data = pa.Table.from_pylist(_with_codes(schema, [_memory_row(0, "initial_record", initial_vector)]), schema=schema)
+    # 기존에 같은 이름의 테이블이 남아있을 경우를 대비해, 덮어쓰기 모드(overwrite)로 안전하게 생성
+    return _get_db().create_table(table_name, data=schema_data, mode="overwrite")
+
+async def _start_table():
+    global table
+    _components["table"]["status"] = "loading"
+    started = time.perf_counter()
+    table_name = _active_table_name()
+    try:
+        if SERVER_WORKERS > 1:
+            # 워커 프로세스는 LanceDB 를 건드리기 전에 fork 해야 하므로 모델 / 워커 준비를 먼저 기다립니다.
+            await _model_settled.wait()
+        tbl, open_error = await asyncio.to_thread(_try_open_table, table_name)
+        if tbl is not None:
+            print(f"INFO: LanceDB 테이블 '{table_name}'을 성공적으로 열었습니다.")
         else:
-            print("ERROR: 모델 로드 실패로 LanceDB 테이블을 생성할 수 없습니다.")
+            # 2. 테이블이 없으면, 초기 벡터를 만들 수 있도록 모델 로드를 기다렸다가 새로 생성합니다.
+            print(f"INFO: LanceDB 테이블 '{table_name}'을 찾을 수 없어 새로 생성합니다. (오류: {open_error})")
+            await _model_settled.wait()
+            if model is None:
+                raise RuntimeError("모델 로드 실패로 LanceDB 테이블을 생성할 수 없습니다.")
+            tbl = await asyncio.to_thread(_create_table, table_name)
+            print(f"INFO: LanceDB 테이블 '{table_name}' 생성을 완료했습니다.")
+        table = tbl
+        _components["table"].update(status="ready", name=table_name)
+        _mark_timing("table_open_ms", started)
+    except Exception as e:
+        print(f"ERROR: LanceDB 테이블 준비 중 심각한 오류 발생: {e}")
+        _components["table"].update(status="failed", error=str(e))
+
+# 백그라운드에서 실행되는 초기화: 모델 로드와 테이블 열기를 동시에 진행합니다.
+def _migrate_sqlite():
+    try:
+        applied = db_access.migrate_all()
+        if any(applied.values()):
+            print(f"INFO: (DB) SQLite 마이그레이션 적용: {applied}")
+    except Exception as e:
+        print(f"ERROR: (DB) SQLite 마이그레이션 실패: {e}")
+
+async def startup_event():
+    await asyncio.gather(_start_model(), _start_table(), asyncio.to_thread(_migrate_sqlite))
+    _mark_timing("ready_ms", _PROCESS_STARTED)
+    print(f"INFO: 서버 준비 완료. 시작 시간 분석(ms): {_startup_timings}")
+    if table is not None:
+        _start_background(_index_maintenance_loop())
+        _start_background(_storage_maintenance_loop())
+        if CONSOLIDATION_INTERVAL_SEC > 0:
+            if CONSOLIDATION_MODE in ("mark", "merge"):
+                _start_background(_consolidation_loop())
+            else:
+                print(f"WARN: (Consolidate) CONSOLIDATION_MODE='{CONSOLIDATION_MODE}' 는 mark / merge 가 아니어서 주기 정리를 하지 않습니다.")
+        _start_background(_open_text_index(table))
+        _start_background(asyncio.to_thread(_get_memory_chunks_table))  # 예전에 저장한 청크가 있으면 검색에 포함
+        if VECTOR_CODES:
+            _start_background(_prepare_code_column(table))
 
 # --- [2. 새로운 lifespan 핸들러를 추가합니다] ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("📦 [Lifespan] 서버 시작 프로세스를 시작합니다...")
-    await startup_event()  # 위에서 만든 초기화 함수를 호출합니다.
+    _mark_timing("imports_ms", _PROCESS_STARTED)
+    download_jobs.start()
+    _start_background(startup_event())  # 모델/테이블 준비를 기다리지 않고 바로 요청을 받습니다.
+    _mark_timing("accepting_ms", _PROCESS_STARTED)
     yield
     print("🧹 [Lifespan] 서버 종료 프로세스를 시작합니다...")
+    for task in list(_background_tasks):
+        task.cancel()
+    await download_jobs.stop()
+    if encoder is not None:
+        await encoder.stop()
+    if process_pool is not None:
+        await asyncio.to_thread(process_pool.shutdown)
+    db_access.pool.close_all()
+    if text_index is not None:
+        text_index.close()
 
 # --- 3. API 데이터 형식 정의 ---
 class EmbeddingRequest(BaseModel):
     text: str
+    chunking: Optional[str] = None # none / pooled / chunks (기본 CHUNK_DEFAULT_MODE)
+class EmbeddingChunk(BaseModel):
+    text: str
+    embedding: List[float]
 class EmbeddingResponse(BaseModel):
     embedding: List[float]
+    chunks: Optional[List[EmbeddingChunk]] = None # chunking=chunks 이고 모델 길이를 넘었을 때만
 
 class AddMemoryRequest(BaseModel):
     id: int
     text: str
+    chunking: Optional[str] = None # none / pooled / chunks (/rebuild_db 는 항상 pooled)
+    timestamp: Optional[Union[float, str]] = None # epoch 초 또는 ISO 8601. /add 에서 비우면 지금 시각
+    emotion_tag: Optional[str] = None
+    sentiment_score: Optional[float] = None       # -1 (부정) ~ 1 (긍정). 절댓값이 감정 강도로 쓰입니다.
 class AddMemoryResponse(BaseModel):
     message: str
 
+class AddBatchRecordStatus(BaseModel):
+    index: int
+    id: Optional[int] = None
+    status: str # inserted / updated / duplicate / error
+    detail: Optional[str] = None
+class AddBatchResponse(BaseModel):
+    message: str
+    inserted: int
+    updated: int
+    failed: int
+    results: List[AddBatchRecordStatus]
+
+# 검색 순위: score = similarity_weight * 유사도 + recency_weight * 0.5^(경과 시간 / half_life) + salience_weight * 감정 강도
+class MemoryRanking(BaseModel):
+    similarity_weight: float = 1.0
+    recency_weight: Optional[float] = None    # 기본 RANK_RECENCY_WEIGHT
+    half_life_hours: Optional[float] = None   # 기본 RANK_HALF_LIFE_HOURS
+    salience_weight: Optional[float] = None   # 기본 RANK_SALIENCE_WEIGHT
+    emotion_weights: Optional[Dict[str, float]] = None # emotion_tag 별 감정 강도 가산 (0~1). 예: {"기쁨": 0.3}
+    now: Optional[float] = None               # 경과 시간의 기준 시각 (epoch 초, 기본 지금)
+
 class SearchMemoryRequest(BaseModel):
     text: str
     limit: int = 5
+    nprobes: Optional[int] = None       # 살펴볼 IVF 파티션 수 (클수록 정확, 느림)
+    refine_factor: Optional[int] = None # limit * refine_factor 개를 원본 벡터로 재정렬
+    include_duplicates: bool = False    # True 면 중복 정리(mark)로 숨긴 기억도 포함
+    mmr_lambda: Optional[float] = None  # 0~1. 주면 MMR 로 서로 덜 겹치는 결과를 고름 (1 = 관련도 순서 그대로)
+    ranking: Optional[MemoryRanking] = None # 주면 유사도에 최신성 / 감정 강도를 더한 점수로 순위를 매김
 class SearchMemoryResponse(BaseModel):
     results: List[str]
 
+# v2 검색: id / 점수까지 돌려주고, 필터는 LanceDB 에서 미리 적용(prefilter)합니다.
+class MemoryFilters(BaseModel):
+    id_min: Optional[int] = None
+    id_max: Optional[int] = None
+    ids: Optional[List[int]] = None
+    timestamp_from: Optional[float] = None # epoch 초. timestamp 컬럼이 저장된 테이블에서만 사용 가능
+    timestamp_to: Optional[float] = None
+    emotion_tags: Optional[List[str]] = None # emotion_tag 컬럼이 저장된 테이블에서만 사용 가능
+class SearchV2Request(BaseModel):
+    text: str
+    limit: int = 5
+    min_score: Optional[float] = None # 코사인 유사도 하한. 이보다 낮은 기억은 프롬프트로 보내지 않습니다.
+    filters: Optional[MemoryFilters] = None
+    nprobes: Optional[int] = None
+    refine_factor: Optional[int] = None
+    include_duplicates: bool = False
+    mmr_lambda: Optional[float] = None
+    ranking: Optional[MemoryRanking] = None
+class MemoryHit(BaseModel):
+    id: int
+    text: str
+    score: float
+    # ranking 을 준 검색에서만 채워집니다. (score 는 합친 점수, similarity 는 코사인 유사도)
+    similarity: Optional[float] = None
+    timestamp: Optional[float] = None
+    emotion_tag: Optional[str] = None
+    sentiment_score: Optional[float] = None
+class SearchV2Response(BaseModel):
+    results: List[MemoryHit]
+
+# 다중 질의 검색: 한 번의 요청으로 N 개의 질의를 처리합니다.
+class SearchBatchRequest(BaseModel):
+    queries: List[str]
+    limit: int = 5
+    min_score: Optional[float] = None
+    filters: Optional[MemoryFilters] = None
+    nprobes: Optional[int] = None
+    refine_factor: Optional[int] = None
+    include_duplicates: bool = False
+    mmr_lambda: Optional[float] = None # 질의별 결과에 각각 적용
+    ranking: Optional[MemoryRanking] = None
+    fuse: bool = False # True 면 Reciprocal Rank Fusion 으로 합친 목록도 함께 돌려줍니다.
+    rrf_k: int = 60
+class SearchBatchResponse(BaseModel):
+    results: List[List[MemoryHit]]
+    fused: Optional[List[MemoryHit]] = None # score 는 RRF 점수
+
+class HybridSearchRequest(BaseModel):
+    text: str
+    limit: int = 5
+    fusion: str = "rrf"          # rrf / weighted
+    vector_weight: float = 0.5   # weighted 일 때 벡터 점수 비중 (0~1)
+    rrf_k: int = 60
+    candidates: Optional[int] = None # 각 검색에서 가져올 후보 수 (기본 limit * HYBRID_CANDIDATE_FACTOR)
+    filters: Optional[MemoryFilters] = None
+    nprobes: Optional[int] = None
+    refine_factor: Optional[int] = None
+    include_duplicates: bool = False
+class HybridHit(BaseModel):
+    id: int
+    text: str
+    score: float                 # 합친 점수 (rrf 또는 weighted)
+    vector_score: Optional[float] = None  # 코사인 유사도 (벡터 후보에 없으면 null)
+    lexical_score: Optional[float] = None # BM25 (전문 후보에 없으면 null)
+class HybridSearchResponse(BaseModel):
+    results: List[HybridHit]
+    lexical: bool                # 전문 인덱스를 사용했는지 (없으면 벡터 결과만)
+
 class ClusteringRequest(BaseModel):
     vectors: List[List[float]]
     num_clusters: int = 5
 class ClusteringResponse(BaseModel):
     labels: List[int]
 
+# 서버에 저장된 벡터를 직접 군집화합니다. (벡터를 주고받는 왕복이 없음)
+class ClusterMemoriesRequest(BaseModel):
+    num_clusters: int = 5
+    mode: str = "full"          # full: 전체 재학습 / incremental: 지난 실행 이후 추가된 벡터만 반영
+    auto_k: bool = False        # True 면 silhouette 점수로 k 를 고릅니다 (full 모드)
+    k_min: int = 2
+    k_max: int = 12
+    sample_size: int = 2000     # auto_k 에 사용할 표본 크기
+    include_centroids: bool = True
+    include_duplicates: bool = False # True 면 중복 정리(mark)로 숨긴 기억도 군집화
+class ClusterMemoriesResponse(BaseModel):
+    mode: str
+    k: int
+    labels: Dict[int, int]      # {기억 id: 클러스터 번호}
+    centroids: Optional[List[List[float]]] = None
+    new_assigned: int = 0
+    silhouette: Optional[Dict[int, float]] = None
+
+class EncoderParityRequest(BaseModel):
+    texts: Optional[List[str]] = None  # 비어 있으면 현재 기억 테이블에서 PARITY_SAMPLE_SIZE 개를 뽑아 비교
+    reference: str = "torch"
+    candidate: Optional[str] = None    # 비어 있으면 현재 사용 중인 백엔드
+    top_k: int = 5
+
 class YouTubeTranscriptRequest(BaseModel):
     url: str
+    languages: str = "ko,en" # 우선순위 순서
+    refresh: bool = False    # True 면 캐시를 무시하고 다시 가져옵니다.
 
 class YouTubeTranscriptResponse(BaseModel):
     transcript: str
@@ -118,88 +1488,528 @@ class TranscriptResponse(BaseModel):
     video_id: str
     segments: List[TranscriptSegment]
 
-class YouTubeTranscriptRequest(BaseModel):
-    url: str
-
 class SearchSegmentsRequest(BaseModel):
     query: str
-    segments: List[Dict[str, Any]]
+    video_id: Optional[str] = None # 서버에 등록된 세그먼트 행렬로 검색 (권장)
+    segments: Optional[List[Dict[str, Any]]] = None # (예전 방식) 세그먼트를 직접 전송. vector 가 없으면 서버에서 임베딩
+    top_k: int = 5
+    min_score: float = 0.3 # 관련 없는 결과 필터링
+
+class IndexSegmentsRequest(BaseModel):
+    video_id: str
+    segments: List[TranscriptSegment]
 
 class SearchResultItem(BaseModel):
     index: int
     text: str
     start: float
+    end: Optional[float] = None
     score: float
 
 class SearchSegmentsResponse(BaseModel):
     results: List[SearchResultItem]
 
-class MediaDownloadRequest(BaseModel):
-    url: str
-    format: str = "mp4"
-    output_path: str
-
-class MediaDownloadResponse(BaseModel):
-    message: str
-    file_path: str
-
 class FileContent(BaseModel):
     filename: str
     extension: str
     content: str    
+    index: bool = True # 내용을 청크로 나눠 file_chunks 테이블에 임베딩할지 여부
+
+class FileSearchRequest(BaseModel):
+    query: str
+    limit: int = 5
+    file_ids: Optional[List[int]] = None # 특정 파일 안에서만 검색
+    min_score: Optional[float] = None
+class FileChunkHit(BaseModel):
+    file_id: int
+    filename: str
+    chunk_index: int
+    text: str
+    score: float
+class FileSearchResponse(BaseModel):
+    results: List[FileChunkHit]
 
 # -----------------------------
 # 2. FastAPI 인스턴스 생성
 # -----------------------------    
 app = FastAPI(title="Local AI Server", version="5.1.0", lifespan=lifespan)    
 
+# --- 메트릭 / 요청 추적 ---
+# /metrics 는 Prometheus text 형식입니다. 단계별 시간은 stage_timing 구간이 끝날 때마다 히스토그램에 쌓입니다.
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000")) # 이보다 느린 요청은 요청 ID 와 단계별 시간을 로그로 남깁니다.
+registry = metrics.Registry()
+http_requests_total = registry.counter("luna_http_requests_total", "경로/상태 코드별 요청 수", ("method", "route", "status"))
+http_request_seconds = registry.histogram("luna_http_request_duration_seconds", "경로별 요청 처리 시간", ("method", "route"))
+http_in_progress = registry.gauge("luna_http_requests_in_progress", "처리 중인 요청 수")
+stage_seconds = registry.histogram("luna_stage_duration_seconds",
+                                   "단계별 소요 시간 (encode, model_encode, search, lexical, db_write, sqlite_write, cluster, subprocess, download)",
+                                   ("stage",))
+stage_timing.add_observer(lambda name, ms: stage_seconds.observe(ms / 1000.0, name))
+
+# 테이블 통계는 디스크를 읽으므로 /metrics 요청 때만 갱신합니다.
+table_rows = registry.gauge("luna_memory_table_rows", "memories 테이블 행 수")
+table_fragments = registry.gauge("luna_memory_table_fragments", "memories 테이블 fragment 수 (작은 fragment 가 많으면 검색이 느려짐)")
+table_small_fragments = registry.gauge("luna_memory_table_small_fragments", "memories 테이블의 작은 fragment 수")
+table_bytes = registry.gauge("luna_memory_table_bytes", "memories 테이블 디스크 크기")
+
+def _embedding_cache_stats() -> Optional[Dict[str, Any]]:
+    return encoder.cache.stats() if encoder is not None and encoder.cache is not None else None
+
+registry.gauge("luna_embedding_cache_entries", "임베딩 캐시 항목 수", ("tier",), callback=lambda: (
+    {"memory": s["memory_entries"], "disk": s["disk_rows"]} if (s := _embedding_cache_stats()) else None))
+registry.gauge("luna_embedding_cache_bytes", "임베딩 메모리 캐시 크기", callback=lambda: (
+    s["memory_bytes"] if (s := _embedding_cache_stats()) else None))
+registry.gauge("luna_segment_cache_videos", "세그먼트 행렬 캐시에 등록된 영상 수", callback=lambda: segment_store.stats()["videos"])
+registry.gauge("luna_segment_cache_bytes", "세그먼트 행렬 캐시 크기", callback=lambda: segment_store.stats()["bytes"])
+registry.gauge("luna_encoder_queue_depth", "인코더 배치 큐에 대기 중인 문장 수", callback=lambda: encoder.queue_depth if encoder is not None else None)
+registry.gauge("luna_download_queue_depth", "대기 중인 다운로드 작업 수", callback=lambda: download_jobs.stats()["queue_depth"])
+registry.gauge("luna_download_jobs", "상태별 다운로드 작업 수 (running = 실행 중인 yt-dlp 프로세스)", ("status",),
+               callback=lambda: download_jobs.stats()["jobs"])
+registry.gauge("luna_transcript_fetches_running", "실행 중인 자막 yt-dlp 프로세스 수", callback=lambda: transcript_service.running)
+
+def _refresh_table_gauges():
+    if table is None:
+        return
+    stats = table.stats()
+    fragments = stats.get("fragment_stats") or {}
+    table_rows.set(stats.get("num_rows", 0))
+    table_fragments.set(fragments.get("num_fragments", 0))
+    table_small_fragments.set(fragments.get("num_small_fragments", 0))
+    table_bytes.set(stats.get("total_bytes", 0))
+
+def _route_label(request: Request) -> str:
+    # 경로 매개변수가 들어간 실제 URL 대신 라우트 템플릿(/jobs/{job_id})을 써서 라벨 수가 늘어나지 않게 합니다.
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+# 요청별 단계 시간(encode / search / db_write ...)을 Server-Timing 헤더로 내보냅니다. (benchmarks/ 가 사용)
+# X-Request-ID 를 받으면 그대로 쓰고(Node 에서 전달), 없으면 새로 만들어 응답 헤더로 돌려줍니다.
+@app.middleware("http")
+async def request_tracing_middleware(request: Request, call_next):
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    stages, token = stage_timing.begin(request_id)
+    started = time.perf_counter()
+    status = 500
+    http_in_progress.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        stage_timing.end(token)
+        http_in_progress.dec()
+        elapsed = time.perf_counter() - started
+        route = _route_label(request)
+        http_requests_total.inc(request.method, route, status)
+        http_request_seconds.observe(elapsed, request.method, route)
+        if elapsed * 1000 >= SLOW_REQUEST_MS:
+            breakdown = ", ".join(f"{name}={ms:.1f}ms" for name, ms in stages.items())
+            print(f"WARN: [{request_id}] 느린 요청 {request.method} {request.url.path} {elapsed * 1000:.0f}ms ({breakdown or '단계 기록 없음'})")
+    response.headers["Server-Timing"] = stage_timing.server_timing_header(stages, elapsed * 1000)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    try:
+        await asyncio.to_thread(_refresh_table_gauges)
+    except Exception as e:
+        log("WARN", f"(metrics) 테이블 통계 수집 실패: {e}")
+    return Response(content=await asyncio.to_thread(registry.render), media_type=metrics.CONTENT_TYPE)
+
 # --- 4. API 엔드포인트 생성 ---
 @app.post("/add", response_model=AddMemoryResponse)
 async def add_memory(request: AddMemoryRequest):
     if model is None or table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
     try:
-        vector = model.encode(request.text).tolist()
-        table.add([{"vector": vector, "id": request.id, "text": request.text}])
+        mode = _chunk_mode(request.chunking)
+        metadata = _memory_metadata(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if metadata["timestamp"] is None:
+        metadata["timestamp"] = time.time()
+    try:
+        vectors, chunk_lists = await _encode_long([request.text], mode)
+        vector = vectors[0].tolist()
+        async with _table_write_lock:
+            with stage_timing.stage("db_write"):
+                table.add(_with_codes(table.schema, [_memory_row(request.id, request.text, vector, **metadata)]))
+            _note_rebuild_writes([request.id])
+        await asyncio.to_thread(_store_memory_chunks, [request.id], chunk_lists if mode == "chunks" else [[]])
+        await asyncio.to_thread(_index_text_safely, [(request.id, request.text)])
         return {"message": f"기억 ID {request.id}가 성공적으로 추가되었습니다."}
     except Exception as e:
-        print(f"ERROR: 기억 추가 중 오류: {e}")
+        log("ERROR", f"기억 추가 중 오류: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- 대량 적재: JSON 배열 또는 NDJSON 스트림 ---
+async def _iter_batch_records(request: Request):
+    """요청 본문에서 (순번, 레코드 dict 또는 오류 메시지) 를 하나씩 꺼냅니다."""
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        # NDJSON 은 본문 전체를 메모리에 올리지 않고 줄 단위로 스트리밍 파싱합니다.
+        index, buffer = 0, b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if not line.strip(): continue
+                try: yield index, json.loads(line)
+                except Exception as e: yield index, f"JSON 파싱 실패: {e}"
+                index += 1
+        if buffer.strip():
+            try: yield index, json.loads(buffer)
+            except Exception as e: yield index, f"JSON 파싱 실패: {e}"
+        return
+
+    try:
+        payload = json.loads(await request.body())
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"JSON 파싱 실패: {e}")
+    if isinstance(payload, dict): payload = payload.get("data", [])  # /rebuild_db 와 같은 {"data": [...]} 형식도 허용
+    if not isinstance(payload, list):
+        raise HTTPException(status_code=400, detail="JSON 배열 또는 NDJSON 본문이 필요합니다.")
+    for index, record in enumerate(payload):
+        yield index, record
+
+def _upsert_memories(rows: List[Dict[str, Any]]) -> tuple:
+    """
+    id 기준 merge/upsert. (이미 있던 id 집합, 새로 생기거나 내용이 바뀐 id 집합) 을 돌려줍니다.
+    앞의 것은 inserted/updated 구분용, 뒤의 것은 저장된 청크를 바꿔야 하는지 판단하기 위한 것입니다.
+    레코드에 없는 메타데이터(timestamp 등)는 기존 값을 유지하고, 새 기억의 timestamp 는 지금 시각으로 채웁니다.
+    """
+    ids = [row["id"] for row in rows]
+    schema_names = table.schema.names
+    marked = CANONICAL_COLUMN in schema_names
+    columns = ["id", "content_hash", *(name for name in MEMORY_METADATA_COLUMNS if name in schema_names)]
+    if marked:
+        columns.append(CANONICAL_COLUMN)
+    with stage_timing.stage("db_write"):
+        existing = table.search().where(f"id IN ({', '.join(map(str, ids))})").select(columns).limit(len(ids) + 1).to_arrow()
+        previous = {row["id"]: row for row in existing.to_pylist()}
+        now = time.time()
+        merged, changed = [], set()
+        for row in rows:
+            old = previous.get(row["id"])
+            row = dict(row)
+            if old is None or old["content_hash"] != row["content_hash"]:
+                changed.add(row["id"])
+            for name in MEMORY_METADATA_COLUMNS:
+                if row.get(name) is None:
+                    row[name] = old.get(name) if old is not None else (now if name == "timestamp" else None)
+            if marked:
+                # 같은 내용을 다시 보낸 기억은 중복 정리의 숨김 표시를 유지하고, 내용이 바뀐 기억은 표시를 지웁니다. (다음 정리 때 다시 판단)
+                same = old is not None and old["content_hash"] == row["content_hash"]
+                row[CANONICAL_COLUMN] = old[CANONICAL_COLUMN] if same else None
+            merged.append(row)
+        (table.merge_insert("id")
+            .when_matched_update_all()
+            .when_not_matched_insert_all()
+            .execute(_with_codes(table.schema, merged)))
+    return set(previous), changed
+
+@app.post("/add_batch", response_model=AddBatchResponse)
+async def add_memory_batch(request: Request):
+    """
+    {id, text} 레코드들을 JSON 배열 또는 NDJSON 스트림으로 받아 한꺼번에 적재합니다.
+    id 기준 upsert 이므로, 같은 요청을 재시도해도 벡터가 중복 저장되지 않습니다.
+    """
+    if encoder is None or table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
+
+    results: Dict[int, Dict[str, Any]] = {}
+    to_encode: List[tuple] = []           # (순번, AddMemoryRequest)
+    to_write: Dict[int, tuple] = {}       # id -> (순번, row). 같은 요청 안의 중복 id 는 마지막 것이 이깁니다.
+    chunk_rows: Dict[int, Optional[list]] = {}  # id -> [(청크 텍스트, 벡터), ...] (chunking=chunks 가 아니면 None)
+
+    async def encode_pending():
+        if not to_encode: return
+        modes = [_chunk_mode(item.chunking) for _, item in to_encode]
+        vectors, chunk_lists = await _encode_long([item.text for _, item in to_encode], modes)
+        for (index, item), vec, mode, chunks in zip(to_encode, vectors, modes, chunk_lists):
+            if item.id in to_write:
+                prev_index, _ = to_write[item.id]
+                results[prev_index] = {"index": prev_index, "id": item.id, "status": "duplicate", "detail": f"같은 요청의 {index}번 레코드로 대체됨"}
+            to_write[item.id] = (index, _memory_row(item.id, item.text, vec.tolist(), **_memory_metadata(item)))
+            chunk_rows[item.id] = chunks if mode == "chunks" else None
+        to_encode.clear()
+
+    async def flush_writes():
+        if not to_write: return
+        pending = list(to_write.values())
+        pending_chunks = [chunk_rows.pop(row["id"], None) for _, row in pending]
+        to_write.clear()
+        try:
+            async with _table_write_lock:
+                existing_ids, changed_ids = await asyncio.to_thread(_upsert_memories, [row for _, row in pending])
+                _note_rebuild_writes(row["id"] for _, row in pending)
+            # 청크는 chunking=chunks 로 보냈거나 내용이 바뀐 기억만 바꿉니다.
+            # (메타데이터만 다시 보낸 기억은 저장된 청크 벡터를 그대로 둡니다)
+            replace = [(row["id"], chunks or []) for (_, row), chunks in zip(pending, pending_chunks)
+                       if chunks is not None or row["id"] in changed_ids]
+            if replace:
+                await asyncio.to_thread(_store_memory_chunks, [id_ for id_, _ in replace], [chunks for _, chunks in replace])
+            await asyncio.to_thread(_index_text_safely, [(row["id"], row["text"]) for _, row in pending])
+            for index, row in pending:
+                results[index] = {"index": index, "id": row["id"], "status": "updated" if row["id"] in existing_ids else "inserted"}
+        except Exception as e:
+            log("ERROR", f"(Add Batch) LanceDB 쓰기 실패: {e}")
+            for index, row in pending:
+                results[index] = {"index": index, "id": row["id"], "status": "error", "detail": str(e)}
+
+    async for index, record in _iter_batch_records(request):
+        try:
+            if isinstance(record, str): raise ValueError(record)
+            item = AddMemoryRequest(**record)
+            _chunk_mode(item.chunking)
+            _memory_metadata(item)
+        except Exception as e:
+            results[index] = {"index": index, "id": record.get("id") if isinstance(record, dict) else None, "status": "error", "detail": str(e)}
+            continue
+        to_encode.append((index, item))
+        if len(to_encode) >= ADD_BATCH_ENCODE_CHUNK:
+            await encode_pending()
+        if len(to_write) >= ADD_BATCH_WRITE_SIZE:
+            await flush_writes()
+
+    try:
+        await encode_pending()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"임베딩 중 오류: {e}")
+    await flush_writes()
+
+    ordered = [results[i] for i in sorted(results)]
+    counts = {status: sum(1 for r in ordered if r["status"] == status) for status in ("inserted", "updated", "error")}
+    log("INFO", f"(Add Batch) 삽입 {counts['inserted']}개, 갱신 {counts['updated']}개, 실패 {counts['error']}개")
+    return {
+        "message": f"{len(ordered)}개의 레코드를 처리했습니다.",
+        "inserted": counts["inserted"], "updated": counts["updated"], "failed": counts["error"],
+        "results": ordered,
+    }
+
 @app.post("/search", response_model=SearchMemoryResponse)
 async def search_memory(request: SearchMemoryRequest):
     if model is None or table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
     try:
-        query_vector = model.encode(request.text)
-        results = table.search(query_vector).limit(request.limit).to_df()
-        # 결과 DataFrame에서 'text' 컬럼만 리스트로 변환하여 반환
-        return {"results": results['text'].tolist()}
+        mmr_lambda = _mmr_lambda(request.mmr_lambda)
+        ranking = _ranking(request.ranking)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        query_vector = await encoder.encode(request.text)
+        # 결과에서 'text' 컬럼만 리스트로 변환하여 반환
+        hits = await _memory_hits(table, query_vector, request.limit, nprobes=request.nprobes, refine_factor=request.refine_factor,
+                                  include_duplicates=request.include_duplicates, mmr_lambda=mmr_lambda, ranking=ranking)
+        return {"results": [hit["text"] for hit in hits]}
     except Exception as e:
-        print(f"ERROR: 기억 검색 중 오류: {e}")
+        log("ERROR", f"기억 검색 중 오류: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/search_v2", response_model=SearchV2Response)
+async def search_memory_v2(request: SearchV2Request):
+    """
+    {id, text, score} 를 돌려주는 검색. 필요한 컬럼만 읽고, 필터는 벡터 검색 전에 LanceDB 에서 적용합니다.
+    score 는 코사인 유사도(1 에 가까울수록 유사)이며, min_score 미만은 제외됩니다.
+    """
+    if encoder is None or table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
+    tbl = table
+    try:
+        where = _memory_filter_sql(request.filters, tbl.schema.names)
+        mmr_lambda = _mmr_lambda(request.mmr_lambda)
+        ranking = _ranking(request.ranking)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        query_vector = await encoder.encode(request.text)
+        hits = await _memory_hits(
+            tbl, query_vector, request.limit, where, request.min_score, request.nprobes, request.refine_factor,
+            request.include_duplicates, mmr_lambda, ranking,
+        )
+        return {"results": hits}
+    except Exception as e:
+        log("ERROR", f"기억 검색(v2) 중 오류: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/search_batch", response_model=SearchBatchResponse)
+async def search_memory_batch(request: SearchBatchRequest):
+    """
+    N 개의 질의를 한 번의 forward pass 로 인코딩하고, N 개의 벡터 검색을 동시에 실행합니다.
+    (사용자 메시지 / 재구성된 질의 / 주제 키워드를 한 번의 왕복으로 처리)
+    """
+    if encoder is None or table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
+    if not request.queries: raise HTTPException(status_code=400, detail="질의가 필요합니다.")
+    tbl = table
+    try:
+        where = _memory_filter_sql(request.filters, tbl.schema.names)
+        mmr_lambda = _mmr_lambda(request.mmr_lambda)
+        ranking = _ranking(request.ranking)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        query_vectors = await encoder.encode_many(request.queries)
+        results = await asyncio.gather(*[
+            _memory_hits(tbl, vec, request.limit, where, request.min_score, request.nprobes, request.refine_factor,
+                         request.include_duplicates, mmr_lambda, ranking)
+            for vec in query_vectors
+        ])
+        fused = _reciprocal_rank_fusion(results, k=request.rrf_k, limit=request.limit) if request.fuse else None
+        return {"results": results, "fused": fused}
+    except Exception as e:
+        log("ERROR", f"다중 질의 검색 중 오류: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/search_hybrid", response_model=HybridSearchResponse)
+async def search_memory_hybrid(request: HybridSearchRequest):
+    """
+    BM25(전문) 검색과 벡터 검색을 동시에 실행해 하나의 순위로 합칩니다.
+    정확한 이름 / 날짜 / 드문 단어는 BM25 가, 표현이 다른 같은 의미는 벡터 검색이 찾아냅니다.
+    """
+    if encoder is None or table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
+    if request.fusion not in ("rrf", "weighted"):
+        raise HTTPException(status_code=400, detail="fusion 은 'rrf' 또는 'weighted' 이어야 합니다.")
+    if not 0.0 <= request.vector_weight <= 1.0:
+        raise HTTPException(status_code=400, detail="vector_weight 는 0 과 1 사이여야 합니다.")
+    tbl = table
+    try:
+        where = _memory_filter_sql(request.filters, tbl.schema.names)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    candidates = request.candidates or request.limit * HYBRID_CANDIDATE_FACTOR
+
+    async def vector_side():
+        query_vector = await encoder.encode(request.text)
+        return await _memory_hits(tbl, query_vector, candidates, where, None,
+                                  request.nprobes, request.refine_factor, request.include_duplicates)
+
+    async def lexical_side():
+        if text_index is None:
+            return None
+        # 전문 인덱스에는 숨김 표시가 없으므로 숨긴 기억은 필터로 뺍니다.
+        lexical_where = where if request.include_duplicates else _and_where(where, _visible_filter_sql(tbl))
+        return await asyncio.to_thread(_lexical_memory_hits, tbl, request.text, candidates, lexical_where)
+
+    try:
+        # 인코딩 + ANN 과 BM25 질의를 동시에 진행합니다.
+        vector_hits, lexical_hits = await asyncio.gather(vector_side(), lexical_side())
+        fused = _fuse_hybrid(vector_hits, lexical_hits or [], request.fusion, request.vector_weight,
+                             request.rrf_k, request.limit)
+        return {"results": fused, "lexical": lexical_hits is not None}
+    except Exception as e:
+        log("ERROR", f"하이브리드 검색 중 오류: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _iter_vector_pages(tbl, offset: int = 0, limit: Optional[int] = None, page_size: int = VECTOR_EXPORT_PAGE_SIZE,
+                       where: Optional[str] = None, column: str = "vector"):
+    """id / 벡터(column) 컬럼을 page_size 행씩 Arrow 테이블로 읽어 냅니다. (전체를 한 번에 올리지 않음, offset 은 where 적용 후 기준)"""
+    end = offset + limit if limit is not None else None
+    position = offset
+    while end is None or position < end:
+        size = page_size if end is None else min(page_size, end - position)
+        query = tbl.search().select(["id", column])
+        if where:
+            query = query.where(where)
+        page = query.offset(position).limit(size).to_arrow()
+        if page.num_rows == 0:
+            break
+        yield page
+        position += page.num_rows
+        if page.num_rows < size:
+            break
+
+def _vector_export_type(dtype: str, dim: int) -> pa.DataType:
+    return pa.list_(pa.float32(), dim) if dtype == "float32" else vector_codes.arrow_type(dtype, dim)
+
+def _page_as(page, column: str, dtype: str, dim: int):
+    """(id, column) 페이지를 (id, vector) 로 바꿉니다. vector 는 dtype 형식이며, 저장 형식과 같으면 변환 없이 씁니다."""
+    values = page.column(column)
+    if values.type != _vector_export_type(dtype, dim):
+        vectors = _vector_column_to_numpy(values)
+        values = (pa.FixedSizeListArray.from_arrays(pa.array(vectors.ravel()), dim) if dtype == "float32"
+                  else vector_codes.to_arrow(dtype, vectors))
+    return pa.table({"id": page.column("id"), "vector": values})
+
+def _vector_page_body(page, media_type: str) -> bytes:
+    if media_type == vector_transport.OCTET_STREAM:
+        return vector_transport.pack_frame(vector_codes.from_arrow(page.column("vector")), page.column("id").to_numpy())
+    # NDJSON: 한 줄에 기억 하나
+    return "".join(
+        json.dumps({"id": id_, "vector": vec}) + "\n"
+        for id_, vec in zip(page.column("id").to_pylist(), page.column("vector").to_pylist())
+    ).encode("utf-8")
+
 @app.get("/get_all_vectors")
-async def get_all_vectors():
+async def get_all_vectors(request: Request, offset: int = 0, limit: Optional[int] = None, stream: bool = False,
+                          page_size: int = VECTOR_EXPORT_PAGE_SIZE, include_ids: bool = False,
+                          include_duplicates: bool = False, dtype: str = "float32"):
+    """
+    저장된 벡터를 내보냅니다. Accept 헤더로 형식을 고릅니다 (vector_transport 참고).
+    - offset / limit: 페이지 단위 조회
+    - stream=true: page_size 행씩 끊어서 스트리밍 (JSON 은 NDJSON, 바이너리는 프레임 연속, Arrow 는 IPC 스트림)
+    - include_duplicates=true: 중복 정리(mark)로 숨긴 기억도 포함
+    - dtype=float16 / binary: 압축 형식으로 내보냅니다. 같은 형식의 컬럼(코드 / COMPACT vector)이 있으면 그것만 읽습니다.
+    """
     if table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
+    if dtype not in ("float32", *vector_codes.KINDS):
+        raise HTTPException(status_code=400, detail=f"dtype 은 float32 / {' / '.join(vector_codes.KINDS)} 중 하나여야 합니다.")
+    tbl = table
+    media_type = vector_transport.negotiate(request.headers.get("accept"))
+    page_size = max(1, page_size)
+    where = None if include_duplicates else _visible_filter_sql(tbl)
+    column = _vector_source(tbl, dtype)
+    dim = tbl.schema.field("vector").type.list_size
+    schema = pa.schema([tbl.schema.field("id"), pa.field("vector", _vector_export_type(dtype, dim))])
     try:
-        # LanceDB의 모든 데이터를 가장 기본적인 딕셔너리 리스트 형태로 가져옵니다.
-        all_records = table.search().to_list()
-        
-        # 각 딕셔너리에서 'vector' 값만 추출하여 새로운 리스트를 만듭니다.
-        vectors_list = [record['vector'] for record in all_records]
-        
-        return {"vectors": vectors_list}
+        if stream:
+            pages = (_page_as(page, column, dtype, dim) for page in _iter_vector_pages(tbl, offset, limit, page_size, where, column))
+            if media_type == vector_transport.ARROW_STREAM:
+                body = vector_transport.arrow_ipc_stream(
+                    (batch for page in pages for batch in page.cast(schema).to_batches()), schema,
+                )
+                return StreamingResponse(body, media_type=media_type)
+            stream_type = media_type if media_type == vector_transport.OCTET_STREAM else "application/x-ndjson"
+            return StreamingResponse((_vector_page_body(page, stream_type) for page in pages), media_type=stream_type)
+
+        pages = await asyncio.to_thread(lambda: [
+            _page_as(page, column, dtype, dim) for page in _iter_vector_pages(tbl, offset, limit, page_size, where, column)])
+        data = pa.concat_tables(pages) if pages else None
+        if media_type == vector_transport.OCTET_STREAM:
+            if data is None:
+                return Response(b"", media_type=media_type)
+            return Response(_vector_page_body(data, media_type), media_type=media_type)
+        if media_type == vector_transport.ARROW_STREAM:
+            batches = data.cast(schema).to_batches() if data is not None else []
+            return Response(b"".join(vector_transport.arrow_ipc_stream(batches, schema)), media_type=media_type)
+
+        result = {"vectors": data.column("vector").to_pylist() if data is not None else []}
+        if include_ids:
+            result["ids"] = data.column("id").to_pylist() if data is not None else []
+        if limit is not None:
+            returned = data.num_rows if data is not None else 0
+            result["next_offset"] = offset + returned if returned == limit else None
+        return result
     except Exception as e:
-        print(f"ERROR: 모든 벡터 조회 중 오류: {e}")
+        log("ERROR", f"모든 벡터 조회 중 오류: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- 4. API 엔드포인트 생성 ---
 @app.post("/embedding", response_model=EmbeddingResponse)
-async def create_embedding(request: EmbeddingRequest):
+async def create_embedding(request: EmbeddingRequest, http_request: Request):
     if model is None: raise HTTPException(status_code=503, detail="모델 로드 실패")
     if not request.text or not request.text.strip(): raise HTTPException(status_code=400, detail="텍스트 필요")
     try:
-        embedding = model.encode(request.text, convert_to_tensor=False).tolist()
-        return {"embedding": embedding}
+        mode = _chunk_mode(request.chunking)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        vectors, chunk_lists = await _encode_long([request.text], mode)
+        vector = vectors[0]
+        media_type = vector_transport.negotiate(http_request.headers.get("accept"))
+        if media_type == vector_transport.OCTET_STREAM:
+            return Response(vector_transport.pack_frame(vector), media_type=media_type)
+        if media_type == vector_transport.ARROW_STREAM:
+            vectors = pa.FixedSizeListArray.from_arrays(pa.array(vector.astype(np.float32)), vector.shape[0])
+            batch = pa.record_batch([vectors], names=["vector"])
+            return Response(b"".join(vector_transport.arrow_ipc_stream([batch], batch.schema)), media_type=media_type)
+        chunks = [{"text": chunk, "embedding": vec.tolist()} for chunk, vec in chunk_lists[0]] if mode == "chunks" else None
+        return {"embedding": vector.tolist(), "chunks": chunks or None}
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
 # ✨ 의미 클러스터링을 위한 새로운 API 엔드포인트
@@ -213,217 +2023,542 @@ async def run_clustering(request: ClusteringRequest):
     
     try:
         # K-Means 클러스터링 실행
+        from sklearn.cluster import KMeans
         kmeans = KMeans(n_clusters=request.num_clusters, random_state=0, n_init='auto')
-        kmeans.fit(np.array(request.vectors))
+        with stage_timing.stage("cluster"):
+            kmeans.fit(np.array(request.vectors))
         
         # 각 데이터가 속한 그룹 라벨을 리스트로 변환하여 반환
         return {"labels": kmeans.labels_.tolist()}
     except Exception as e:
-        print(f"ERROR: 클러스터링 중 오류: {e}")
+        log("ERROR", f"클러스터링 중 오류: {e}")
         raise HTTPException(status_code=500, detail=f"클러스터링 중 오류 발생: {str(e)}")
 
+CLUSTER_STATE_DIR = os.path.join(db_path, "cluster_state")
+_cluster_lock = asyncio.Lock()
+
+def _cluster_memories(tbl, request: ClusterMemoriesRequest) -> Dict[str, Any]:
+    # float16 컬럼(코드 또는 COMPACT vector)이 있으면 그것을 읽습니다. binary 코드는 부호 비트뿐이라 군집화에는 쓰지 않습니다.
+    ids, vectors = _load_ids_and_vectors(tbl, None if request.include_duplicates else _visible_filter_sql(tbl),
+                                         _vector_source(tbl, "float16"))
+    state = memory_clustering.ClusterState(CLUSTER_STATE_DIR)
+    mode = request.mode
+    if mode == "incremental":
+        loaded = state.load()
+        # 저장된 상태가 없거나 벡터 차원(모델)이 달라졌으면 전체 학습으로 대신합니다.
+        if not loaded or state.meta.get("dim") != vectors.shape[1]:
+            mode = "full"
+
+    new_assigned, silhouette = 0, None
+    if mode == "incremental":
+        new_assigned = memory_clustering.update_incremental(state, ids, vectors)
+    else:
+        k = request.num_clusters
+        if request.auto_k:
+            k, silhouette = memory_clustering.choose_k(vectors, request.k_min, request.k_max, request.sample_size)
+        if len(vectors) < k:
+            raise ValueError("데이터(벡터)의 개수는 클러스터의 개수보다 많거나 같아야 합니다.")
+        memory_clustering.fit_full(state, ids, vectors, k)
+        new_assigned = len(ids)
+    memory_clustering.stamp(state, mode, tbl.name, vectors.shape[1], {"rows": int(len(ids))})
+    state.save()
+    return {
+        "mode": mode, "k": int(state.centroids.shape[0]), "labels": state.labels,
+        "centroids": state.centroids.tolist() if request.include_centroids else None,
+        "new_assigned": new_assigned, "silhouette": silhouette,
+    }
+
+@app.post("/cluster_memories", response_model=ClusterMemoriesResponse)
+async def cluster_memories(request: ClusterMemoriesRequest):
+    """
+    LanceDB 의 vector 컬럼을 그대로 읽어 군집화하고 {id: label} 과 중심점을 돌려줍니다.
+    중심점은 디스크에 저장되어, incremental 모드에서는 새로 추가된 기억만 반영합니다.
+    """
+    if table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
+    if request.mode not in ("full", "incremental"):
+        raise HTTPException(status_code=400, detail="mode 는 'full' 또는 'incremental' 이어야 합니다.")
+    async with _cluster_lock:
+        try:
+            result = await asyncio.to_thread(_cluster_memories, table, request)
+            log("INFO", f"(Cluster) {result['mode']} 모드, k={result['k']}, 새로 배정 {result['new_assigned']}개")
+            return result
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            log("ERROR", f"기억 클러스터링 중 오류: {e}")
+            raise HTTPException(status_code=500, detail=f"클러스터링 중 오류 발생: {str(e)}")
+
 @app.get("/")
 def read_root():
     return {"status": "Local Embedding & Clustering Server is running", "model": MODEL_NAME if model else "Not loaded"}
 
+# 프로세스가 살아 있는지만 확인합니다. (모델/테이블 준비 여부와 무관하게 항상 200)
+@app.get("/health/live")
+def health_live():
+    return {"status": "alive", "uptime_sec": round(time.perf_counter() - _PROCESS_STARTED, 1)}
+
+def _index_component(tbl) -> Dict[str, Any]:
+    status = _index_status(tbl)
+    if status["building"]:
+        state = "building"
+    elif status["indexed"]:
+        state = "ready"
+    else:
+        # 행 수가 임계값보다 적으면 인덱스 없이 전체 탐색으로 충분합니다.
+        state = "brute_force" if status["rows"] < ANN_INDEX_MIN_ROWS else "pending"
+    return {"status": state, "rows": status["rows"], "index_type": status["index_type"],
+            "num_unindexed_rows": status["num_unindexed_rows"]}
+
+# 구성 요소별 준비 상태. 모델과 테이블이 모두 준비되어야 200, 아니면 503 (Node 는 이 값으로 ML 엔드포인트 라우팅을 결정)
+@app.get("/health/ready")
+async def health_ready():
+    if table is not None:
+        try:
+            index = await asyncio.to_thread(_index_component, table)
+        except Exception as e:
+            index = {"status": "unknown", "error": str(e)}
+    else:
+        index = {"status": "pending"}
+    ready = model is not None and table is not None
+    body = {
+        "ready": ready,
+        "components": {**{name: dict(info) for name, info in _components.items()}, "index": index},
+        "startup_ms": _startup_timings,
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+# 인코더 배치 크기 / 큐 대기 시간 히스토그램 (처리량 vs p99 지연 튜닝용)
+@app.get("/encoder/stats")
+def encoder_stats():
+    if encoder is None: raise HTTPException(status_code=503, detail="인코더 서비스 준비 안됨")
+    pool = process_pool
+    return {**encoder.stats(), "backend": model.describe(), "workers": pool.describe() if pool is not None else None}
+
+def _backend_for(name: str):
+    """현재 백엔드면 그대로, 아니면 비교용으로 한 번 로드해 보관합니다."""
+    name = name.lower()
+    if name == EMBEDDING_BACKEND and model is not None:
+        return model
+    if name not in _parity_backends:
+        log("INFO", f"비교용 '{name}' 백엔드를 로드하는 중...")
+        _parity_backends[name] = encoder_backends.load_backend(
+            name, MODEL_NAME, device=model.device if model is not None else 'cpu',
+            num_threads=ENCODER_NUM_THREADS, max_seq_length=ENCODER_MAX_SEQ_LENGTH, onnx_file=ENCODER_ONNX_FILE)
+    return _parity_backends[name]
+
+def _parity_sample_texts(limit: int) -> List[str]:
+    if table is None:
+        return []
+    arrow = table.search().select(["text"]).limit(limit).to_arrow()
+    return [t for t in arrow.column("text").to_pylist() if t and t != "initial_record"]
+
+# 현재 백엔드와 기준 백엔드(기본 torch)의 코사인 오차 / 속도를 비교합니다.
+@app.post("/encoder/parity")
+async def encoder_parity(request: EncoderParityRequest):
+    if model is None: raise HTTPException(status_code=503, detail="모델 로드 실패")
+    for name in (request.reference, request.candidate):
+        if name and name.lower() not in encoder_backends.BACKENDS:
+            raise HTTPException(status_code=400, detail=f"알 수 없는 백엔드: {name} (사용 가능: {', '.join(encoder_backends.BACKENDS)})")
+    try:
+        texts = request.texts or await asyncio.to_thread(_parity_sample_texts, PARITY_SAMPLE_SIZE)
+        if not texts:
+            raise HTTPException(status_code=400, detail="비교할 문장이 없습니다. texts 를 직접 보내주세요.")
+        reference = await asyncio.to_thread(_backend_for, request.reference)
+        candidate = await asyncio.to_thread(_backend_for, request.candidate or EMBEDDING_BACKEND)
+        return await asyncio.to_thread(encoder_backends.parity_check, reference, candidate, texts,
+                                       ENCODER_MAX_BATCH_SIZE, request.top_k)
+    except HTTPException:
+        raise
+    except Exception as e:
+        log("ERROR", f"백엔드 비교 중 오류: {e}")
+        raise HTTPException(status_code=500, detail=f"백엔드 비교 중 오류 발생: {str(e)}")
+
 # // 유튜브 자막 추출을 위한 API 엔드포인트를 추가합니다.
+# 파싱된 세그먼트는 video_id + 언어별로 디스크에 캐시되고, 같은 영상에 대한 동시 요청은 yt-dlp 한 번을 공유합니다.
 @app.post("/youtube-transcript", response_model=TranscriptResponse)
-def get_youtube_transcript(request: YouTubeTranscriptRequest):
-    raw_url = request.url
-    
+async def get_youtube_transcript(request: YouTubeTranscriptRequest):
     # 1. URL 정규화
     try:
-        parsed_url = urlparse(raw_url)
-        video_id = None
-        if 'youtube.com' in parsed_url.netloc:
-            query_params = parse_qs(parsed_url.query)
-            if 'v' in query_params: video_id = query_params['v'][0]
-            elif parsed_url.path.startswith('/shorts/'): video_id = parsed_url.path.split('/shorts/')[1]
-        elif 'youtu.be' in parsed_url.netloc:
-            video_id = parsed_url.path.lstrip('/')
-        if not video_id: raise ValueError("URL에서 비디오 ID를 추출할 수 없습니다.")
-        clean_url = f"https://www.youtube.com/watch?v={video_id}"
-        print(f"INFO: (URL 정규화) 원본: {raw_url} -> 정제: {clean_url}")
+        video_id = extract_video_id(request.url)
+        log("INFO", f"(URL 정규화) 원본: {request.url} -> 비디오 ID: {video_id}")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"유효하지 않은 URL입니다: {str(e)}")
-    video_url = clean_url
-    
-    # 2. 임시 디렉토리에서 자막 추출
-    with tempfile.TemporaryDirectory() as temp_dir:
-        vtt_file_path = None
-        try:
-            print("INFO: (yt-dlp) 안정화 모드로 자막 추출을 시도합니다.")
-            
-            # ▼▼▼ [핵심 개선] 쿨다운 옵션을 추가하고, 플랜 A/B를 통합합니다. ▼▼▼
-            command = [
-                'yt-dlp',
-                '--restrict-filenames', # 파일명에 포함될 수 없는 특수문자, 이모지 등을 안전한 문자로 치환
-                '--write-sub', '--write-automatic-sub',
-                '--sub-lang', 'ko,en',
-                '--skip-download',
-                '--sub-format', 'vtt',
-                '--output', os.path.join(temp_dir, '%(id)s.%(ext)s'),
-                '--sleep-interval', '2',
-                '--max-sleep-interval', '5',
-                video_url
-            ]
-            
-            result = subprocess.run(command, capture_output=True, text=True, encoding='utf-8')
-
-            # ▼▼▼ [최종 개선] 상세 디버깅 로그 추가 ▼▼▼
-            if result.returncode != 0:
-                print(f"ERROR: (yt-dlp) 실행 실패. STDERR 전체:\n{result.stderr}")
-                raise subprocess.CalledProcessError(result.returncode, command, output=result.stdout, stderr=result.stderr)
-
-            downloaded_files = os.listdir(temp_dir)
-            print(f"DEBUG: (yt-dlp) 임시 폴더 내용: {downloaded_files}") # 생성된 파일 목록 확인
-
-            # ▼▼▼ [핵심 개선] "하나라도 성공하면 OK" 로직 ▼▼▼
-            downloaded_files = os.listdir(temp_dir)
-            found_subs = [f for f in downloaded_files if f.endswith('.vtt')]
-            
-            if not found_subs:
-                # 어떤 자막 파일도 생성되지 않았다면, 그때가 진짜 실패입니다.
-                raise FileNotFoundError("yt-dlp가 어떤 자막 파일도 생성하지 않았습니다.")
-            
-            # 한국어 자막(.ko.vtt)이 있으면 최우선으로 선택합니다.
-            korean_subs = [f for f in found_subs if '.ko.vtt' in f]
-            if korean_subs:
-                vtt_file_path = os.path.join(temp_dir, korean_subs[0])
-                print(f"INFO: (yt-dlp) 한국어 자막 '{korean_subs[0]}'을 선택했습니다.")
-            else:
-                # 한국어 자막이 없으면, 찾은 것 중 아무거나 첫 번째 것을 사용합니다.
-                vtt_file_path = os.path.join(temp_dir, found_subs[0])
-                print(f"WARN: (yt-dlp) 한국어 자막을 찾을 수 없어, 사용 가능한 자막 '{found_subs[0]}'을 대신 사용합니다.")
 
-        except (subprocess.CalledProcessError, FileNotFoundError) as e:
-            error_message = e.stderr if hasattr(e, 'stderr') else str(e)
-            raise HTTPException(status_code=404, detail=f"이 영상의 자막 데이터를 찾을 수 없습니다: {error_message}")
-        
-        # 3. VTT 파일 파싱
-        try:
-            with open(vtt_file_path, 'r', encoding='utf-8') as f: vtt_content = f.read()
-            vtt_content = re.sub(r'(WEBVTT\s*?\n)+', 'WEBVTT\n', vtt_content.strip())
-            try:
-                captions = webvtt.read_buffer(StringIO(vtt_content))
-            except Exception: # 더 넓은 범위의 파싱 에러를 잡습니다.
-                print("WARN: (VTT 파싱) 기본 파싱 실패, UTF-8-SIG 인코딩으로 재시도.")
-                captions = webvtt.read_buffer(StringIO(vtt_content.encode('utf-8-sig').decode('utf-8')))
-            segments = []
-            for caption in captions:
-                # `&gt;&gt;` 같은 HTML 엔티티를 실제 문자로 변환하고, 불필요한 공백을 정리합니다.
-                clean_text = caption.text.replace('&gt;&gt;', '').strip().replace('\n', ' ')
-                if clean_text: # 텍스트가 있는 경우에만 추가
-                    segments.append({ "start": caption.start_in_seconds, "end": caption.end_in_seconds, "text": clean_text })
-            print(f"INFO: (yt-dlp) 자막 파싱 성공! {len(segments)}개의 세그먼트를 추출했습니다.")
-            return { "video_id": video_id, "segments": segments }
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"추출된 자막 파일을 처리하는 중 오류: {str(e)}")
-
-# 강제 동기화를 위한 '데이터베이스 재건축' API
-@app.post("/rebuild_db")
-async def rebuild_db(request: dict):
-    global table
+    # 2. 캐시 또는 yt-dlp 로 자막 추출
     try:
-        # server.js로부터 받은 모든 기억 데이터 (예: [{'id': 1, 'text': '...'}, ...])
-        memories_to_add = request.get('data', [])
-        if not memories_to_add:
-            raise ValueError("재구축할 데이터가 없습니다.")
-        
-        # 1. 기존 테이블 삭제 (오류가 나도 무시)
-        db.drop_table("memories", ignore_missing=True)
-        print("INFO: (Rebuild) 기존 'memories' 테이블을 삭제했습니다.")
-        
-        # 2. 모든 기억 텍스트를 한 번에 벡터로 변환 (GPU를 활용하여 매우 빠름)
-        print(f"INFO: (Rebuild) {len(memories_to_add)}개의 기억을 임베딩하는 중...")
-        texts_to_embed = [item['text'] for item in memories_to_add]
-        vectors = model.encode(texts_to_embed).tolist()
-        
-        # 3. LanceDB에 저장할 최종 데이터 형식으로 재조립
-        data_for_lancedb = [
-            {"vector": vec, "id": mem['id'], "text": mem['text']}
-            for mem, vec in zip(memories_to_add, vectors)
-        ]
-
-        # 4. 새 테이블 생성
-        table = db.create_table("memories", data=data_for_lancedb, mode="overwrite")
-        print(f"INFO: (Rebuild) {len(data_for_lancedb)}개의 데이터로 'memories' 테이블을 새로 생성했습니다.")
-        
-        return {"message": "VectorDB 재구축 성공"}
+        segments = await transcript_service.get(video_id, request.languages, refresh=request.refresh)
+    except TranscriptNotFound as e:
+        raise HTTPException(status_code=404, detail=f"이 영상의 자막 데이터를 찾을 수 없습니다: {e}")
     except Exception as e:
-        print(f"ERROR: VectorDB 재구축 중 오류: {e}")
+        raise HTTPException(status_code=500, detail=f"추출된 자막 파일을 처리하는 중 오류: {str(e)}")
+    log("INFO", f"(자막) {len(segments)}개의 세그먼트를 반환합니다. ({video_id})")
+    return { "video_id": video_id, "segments": segments }
+
+@app.get("/youtube-transcript/stats")
+def youtube_transcript_stats():
+    return transcript_service.stats()
+
+async def _index_segments(video_id: Optional[str], segments: List[Dict[str, Any]]):
+    """세그먼트 텍스트를 임베딩(또는 전달받은 vector 사용)해 정규화된 행렬로 보관합니다."""
+    meta = [{"start": seg["start"], "end": seg.get("end"), "text": seg["text"]} for seg in segments]
+    if all("vector" in seg for seg in segments):
+        vectors = np.asarray([seg["vector"] for seg in segments], dtype=np.float32)
+    else:
+        vectors, _ = await _encode_long([seg["text"] for seg in meta], "pooled")
+    if video_id:
+        return segment_store.put(video_id, vectors, meta)
+    # video_id 가 없으면 캐시하지 않고 이번 요청에만 사용합니다.
+    return SegmentEntry("", normalize_rows(vectors), meta)
+
+@app.post("/segments/index")
+async def index_segments(request: IndexSegmentsRequest):
+    """자막 세그먼트를 서버에서 임베딩해 video_id 로 등록합니다. 이후 /search-segments 는 video_id 만 보내면 됩니다."""
+    if encoder is None: raise HTTPException(status_code=503, detail="모델이 로드되지 않았습니다.")
+    if not request.segments: raise HTTPException(status_code=400, detail="세그먼트가 필요합니다.")
+    try:
+        entry = await _index_segments(request.video_id, [seg.model_dump() for seg in request.segments])
+        log("INFO", f"(Segments) '{request.video_id}' 세그먼트 {len(entry.segments)}개를 등록했습니다.")
+        return {"video_id": request.video_id, "count": len(entry.segments), "cache": segment_store.stats()}
+    except Exception as e:
+        log("ERROR", f"세그먼트 등록 중 오류: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.delete("/segments/{video_id}")
+def remove_segments(video_id: str):
+    return {"video_id": video_id, "removed": segment_store.remove(video_id)}
+
 @app.post("/search-segments", response_model=SearchSegmentsResponse)
 async def search_segments_fastapi(request: SearchSegmentsRequest):
-    if model is None:
+    if encoder is None:
         raise HTTPException(status_code=503, detail="모델이 로드되지 않았습니다.")
+    if not request.query or not (request.video_id or request.segments):
+        raise HTTPException(status_code=400, detail="Query and video_id (or segments) are required")
     try:
-        query = request.query
-        segments_data = request.segments
-
-        if not query or not segments_data:
-            raise HTTPException(status_code=400, detail="Query and segments data are required")
-
-        query_vector = model.encode([query])
-        segment_vectors = np.array([seg['vector'] for seg in segments_data])
-
-        similarities = cosine_similarity(query_vector, segment_vectors)[0]
-
-        # 유사도가 높은 순으로 정렬된 인덱스 (상위 5개)
-        top_indices = np.argsort(similarities)[::-1][:5]
-        
+        entry = segment_store.get(request.video_id) if request.video_id else None
+        if entry is None:
+            if not request.segments:
+                raise HTTPException(status_code=404, detail=f"'{request.video_id}' 세그먼트가 등록되어 있지 않습니다. /segments/index 로 먼저 등록하세요.")
+            entry = await _index_segments(request.video_id, request.segments)
+
+        query_vector = await encoder.encode(request.query)
+        with stage_timing.stage("search"):
+            top = top_k_cosine(entry.matrix, query_vector, request.top_k, request.min_score)
         results = [{
-            "index": int(i),
-            "text": segments_data[i]["text"],
-            "start": segments_data[i]["start"],
-            "score": float(similarities[i])
-        } for i in top_indices if similarities[i] >= 0.3] # 관련 없는 결과 필터링
+            "index": i,
+            "text": entry.segments[i]["text"],
+            "start": entry.segments[i]["start"],
+            "end": entry.segments[i]["end"],
+            "score": score,
+        } for i, score in top]
 
         return {"results": results}
 
+    except HTTPException:
+        raise
+    except Exception as e:
+        log("ERROR", f"세그먼트 검색 중 오류: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ANN 인덱스 상태 (색인되지 않은 행 수 포함)
+@app.get("/index/status")
+async def index_status():
+    if table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
+    try:
+        return await asyncio.to_thread(_index_status, table)
     except Exception as e:
-        print(f"ERROR: 세그먼트 검색 중 오류: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# 임계값과 관계없이 인덱스를 지금 (재)학습합니다.
+@app.post("/index/build")
+async def index_build():
+    if table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
+    action = await maintain_vector_index(force=True)
+    if action == "skipped": raise HTTPException(status_code=409, detail="이미 인덱스 작업 또는 재구축이 진행 중입니다.")
+    if action == "error": raise HTTPException(status_code=500, detail=_index_state["last_error"])
+    return {"action": action, "status": await asyncio.to_thread(_index_status, table)}
+
+# fragment / 버전 / 디스크 사용량과 마지막 정리 결과
+@app.get("/storage/stats")
+async def storage_stats():
+    if table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
+    try:
+        stats = await asyncio.to_thread(_storage_stats, table)
+        db_bytes = await asyncio.to_thread(_dir_bytes, db_path)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        **stats, "db_disk_bytes": db_bytes, "pending_reasons": _storage_reasons(stats),
+        "idle_sec": round(time.monotonic() - _last_table_activity, 1),
+        "maintenance": _storage_state,
+        "vector_codes": _code_column_stats(table),
+        "thresholds": {
+            "small_fragments": STORAGE_COMPACT_MIN_SMALL_FRAGMENTS, "deleted_ratio": STORAGE_COMPACT_DELETED_RATIO,
+            "versions": STORAGE_CLEANUP_MIN_VERSIONS, "retention_hours": STORAGE_VERSION_RETENTION_HOURS,
+            "idle_sec": STORAGE_IDLE_SEC, "check_interval_sec": STORAGE_CHECK_INTERVAL_SEC,
+        },
+    }
+
+# 임계값 / 유휴 시간과 관계없이 지금 정리합니다.
+@app.post("/storage/maintain")
+async def storage_maintain():
+    if table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
+    action = await maintain_storage(force=True)
+    if action == "skipped": raise HTTPException(status_code=409, detail="이미 인덱스 / 저장소 작업 또는 재구축이 진행 중입니다.")
+    if action == "error": raise HTTPException(status_code=500, detail=_storage_state["last_error"])
+    return {"action": action, "stats": _storage_state["last_after"]}
+
+# 중복에 가까운 기억 정리. 주기 실행(CONSOLIDATION_INTERVAL_SEC)과 같은 작업을 지금 실행합니다.
+class ConsolidateRequest(BaseModel):
+    mode: str = "mark"                # dry_run: 찾기만 / mark: 숨김 표시 / merge: 중복 기억 삭제
+    threshold: Optional[float] = None # 코사인 유사도 하한 (기본 CONSOLIDATION_THRESHOLD)
+    neighbors: Optional[int] = None   # 기억마다 살펴볼 벡터 인덱스 이웃 수 (기본 CONSOLIDATION_NEIGHBORS)
+    canonical: str = "oldest"         # 대표 기억: oldest (가장 작은 id) / longest (가장 긴 본문)
+class DuplicateGroup(BaseModel):
+    canonical_id: int
+    duplicate_ids: List[int]
+    min_score: float                  # 대표와 중복 기억 사이의 가장 낮은 코사인 유사도
+class ConsolidateResponse(BaseModel):
+    mode: str
+    threshold: float
+    scanned: int
+    pairs: int
+    groups: List[DuplicateGroup]
+    mapping: Dict[int, int]           # {중복 기억 id: 대표 기억 id}
+    elapsed_sec: float
+
+@app.post("/memories/consolidate", response_model=ConsolidateResponse)
+async def memories_consolidate(request: ConsolidateRequest):
+    if table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
+    if request.mode not in ("dry_run", "mark", "merge"):
+        raise HTTPException(status_code=400, detail="mode 는 'dry_run', 'mark', 'merge' 중 하나여야 합니다.")
+    if request.canonical not in memory_consolidation.CANONICAL_RULES:
+        raise HTTPException(status_code=400, detail=f"canonical 은 {', '.join(memory_consolidation.CANONICAL_RULES)} 중 하나여야 합니다.")
+    if request.threshold is not None and not 0.0 < request.threshold <= 1.0:
+        raise HTTPException(status_code=400, detail="threshold 는 0 보다 크고 1 이하여야 합니다.")
+    if request.neighbors is not None and request.neighbors < 1:
+        raise HTTPException(status_code=400, detail="neighbors 는 1 이상이어야 합니다.")
+    result = await consolidate_memories(request.mode, request.threshold, request.neighbors, request.canonical, force=True)
+    if result["action"] == "skipped": raise HTTPException(status_code=409, detail="이미 중복 정리 또는 재구축이 진행 중입니다.")
+    if result["action"] == "error": raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
+@app.get("/memories/consolidate/status")
+async def memories_consolidate_status():
+    if table is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
+    tbl = table
+    visible = _visible_filter_sql(tbl)
+    try:
+        rows = await asyncio.to_thread(tbl.count_rows)
+        hidden = rows - await asyncio.to_thread(tbl.count_rows, visible) if visible else 0
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "rows": rows, "hidden_duplicates": hidden, "state": _consolidation_state,
+        "config": {
+            "threshold": CONSOLIDATION_THRESHOLD, "neighbors": CONSOLIDATION_NEIGHBORS,
+            "interval_sec": CONSOLIDATION_INTERVAL_SEC, "mode": CONSOLIDATION_MODE, "idle_sec": STORAGE_IDLE_SEC,
+        },
+    }
+
+# 강제 동기화를 위한 '데이터베이스 재건축' API
+# 기존 테이블을 지우지 않고, 그림자 테이블을 만든 뒤 포인터만 교체합니다.
+# 재구축이 끝날 때까지 검색은 계속 옛 테이블에서 처리됩니다.
+class RebuildRequest(BaseModel):
+    data: List[AddMemoryRequest]
+    mode: str = "incremental" # incremental: 바뀐 기억만 다시 임베딩 / full: 전부 다시 임베딩
+
+_rebuild_lock = asyncio.Lock()
+# 기억 테이블 쓰기(/add, /add_batch)와 재구축의 마지막 따라잡기 + 교체를 서로 막습니다.
+# 재구축 전체가 아니라 마지막 단계만 막으므로, 임베딩하는 동안에는 쓰기가 그대로 옛 테이블에 들어갑니다.
+_table_write_lock = asyncio.Lock()
+# 재구축이 진행되는 동안 /add, /add_batch 로 쓴 id. 스냅샷에 이미 있던 id 를 덮어쓴 경우도 교체 직전에 다시 옮겨 담기 위해 모읍니다.
+_rebuild_written_ids: Optional[set] = None
+
+def _note_rebuild_writes(ids):
+    """_table_write_lock 안에서 호출합니다. 재구축 중이 아니면 아무것도 하지 않습니다."""
+    if _rebuild_written_ids is not None:
+        _rebuild_written_ids.update(int(id_) for id_ in ids)
+
+def _snapshot_memories(tbl) -> Dict[int, tuple]:
+    """
+    현재 테이블의 id -> (content_hash, vector, 메타데이터 dict) 스냅샷. 해시가 없는 예전 행은 text 로 계산합니다.
+    메타데이터는 재구축 요청에 timestamp 등이 빠진 기억의 값과 중복 정리의 숨김 표시(canonical_id)를 이어받는 데 씁니다.
+    """
+    arrow = tbl.to_arrow()
+    if arrow.num_rows == 0:
+        return {}
+    ids = arrow.column("id").to_pylist()
+    texts = arrow.column("text").to_pylist()
+    hashes = arrow.column("content_hash").to_pylist() if "content_hash" in arrow.schema.names else [None] * len(ids)
+    metadata = {name: arrow.column(name).to_pylist() for name in (*MEMORY_METADATA_COLUMNS, CANONICAL_COLUMN)
+                if name in arrow.schema.names}
+    vectors = _vector_column_to_numpy(arrow.column("vector"))
+    return {
+        id_: (h or _content_hash(text or ""), vectors[i], {name: values[i] for name, values in metadata.items()})
+        for i, (id_, text, h) in enumerate(zip(ids, texts, hashes))
+    }
+
+def _rows_written_during_rebuild(tbl, known_ids: set, written_ids: set) -> List[Dict[str, Any]]:
+    """
+    재구축 도중 옛 테이블에 쓰인 행을 읽습니다: known_ids 에 없는 새 id + 재구축 중에 다시 쓴 id(written_ids).
+    id 컬럼으로 먼저 고른 뒤 그 행만 전부 읽고, 같은 id 가 여러 행이면 하나만 남깁니다.
+    """
+    ids = tbl.search().select(["id"]).limit(None).to_arrow().column("id").to_pylist()
+    wanted = sorted({id_ for id_ in ids if id_ not in known_ids or id_ in written_ids})
+    rows: Dict[int, Dict[str, Any]] = {}
+    for start in range(0, len(wanted), 1000):
+        part = wanted[start:start + 1000]
+        for row in tbl.search().where(f"id IN ({', '.join(map(str, part))})").limit(len(part) * 2).to_arrow().to_pylist():
+            rows[row["id"]] = row
+    return list(rows.values())
+
+async def _drop_table_later(name: str, delay: float):
+    await asyncio.sleep(delay)
+    try:
+        _get_db().drop_table(name)
+        log("INFO", f"(Rebuild) 교체된 옛 테이블 '{name}'을 삭제했습니다.")
+    except Exception as e:
+        log("WARN", f"(Rebuild) 옛 테이블 '{name}' 삭제 실패: {e}")
+
 @app.post("/rebuild_db")
-async def rebuild_db(request: dict):
+async def rebuild_db(request: RebuildRequest):
     """
-    Node.js 서버로부터 받은 모든 기억 데이터를 기반으로 VectorDB를 완전히 재구축합니다.
+    Node.js 서버로부터 받은 모든 기억 데이터를 기준으로 VectorDB 를 동기화합니다.
+    내용 해시가 같은 기억은 기존 벡터를 재사용하고, 새로 생기거나 바뀐 기억만 임베딩하며,
+    목록에 없는 id 는 새 테이블에서 빠집니다.
     """
-    global table
-    if model is None:
+    global table, code_table_ready, _rebuild_written_ids
+    if encoder is None:
         raise HTTPException(status_code=503, detail="모델이 로드되지 않았습니다.")
+    if not request.data:
+        raise HTTPException(status_code=400, detail="재구축할 데이터가 없습니다.")
+    if request.mode not in ("incremental", "full"):
+        raise HTTPException(status_code=400, detail="mode 는 'incremental' 또는 'full' 이어야 합니다.")
+    if _rebuild_lock.locked():
+        raise HTTPException(status_code=409, detail="이미 재구축이 진행 중입니다.")
+    # 같은 id 가 여러 번 오면 마지막 것을 사용합니다.
+    incoming = list({mem.id: mem for mem in request.data}.values())
     try:
-        memories_to_add = request.get('data', [])
-        if not memories_to_add:
-            raise HTTPException(status_code=400, detail="재구축할 데이터가 없습니다.")
-        
-        db_path = "./lancedb"
-        db_conn = lancedb.connect(db_path)
-        
-        table_name = "memories"
-        db_conn.drop_table(table_name, ignore_missing=True)
-        print(f"INFO: (Rebuild) 기존 '{table_name}' 테이블을 삭제했습니다.")
-        
-        print(f"INFO: (Rebuild) {len(memories_to_add)}개의 기억을 임베딩하는 중...")
-        texts_to_embed = [item['text'] for item in memories_to_add]
-        vectors = model.encode(texts_to_embed).tolist()
-        
-        data_for_lancedb = [
-            {"vector": vec, "id": mem['id'], "text": mem['text']}
-            for mem, vec in zip(memories_to_add, vectors)
-        ]
+        incoming_metadata = [_memory_metadata(mem) for mem in incoming]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 진행 중인 중복 정리가 옛 테이블에 쓴 숨김 표시가 사라지지 않도록 정리가 끝날 때까지 기다립니다.
+    async with _rebuild_lock, _consolidation_lock:
+        # 스냅샷을 읽기 전부터 쓰기를 기록해야, 스냅샷 뒤에 덮어쓴 기억을 놓치지 않습니다.
+        async with _table_write_lock:
+            _rebuild_written_ids = set()
+        try:
+            old_table = table
+            old_name = _active_table_name()
+            snapshot = await asyncio.to_thread(_snapshot_memories, old_table) if old_table is not None else {}
+
+            hashes = [_content_hash(mem.text) for mem in incoming]
+            reuse = {}
+            if request.mode == "incremental":
+                reuse = {
+                    i: snapshot[mem.id][1] for i, (mem, h) in enumerate(zip(incoming, hashes))
+                    if mem.id in snapshot and snapshot[mem.id][0] == h
+                }
+            to_embed = [i for i in range(len(incoming)) if i not in reuse]
+
+            log("INFO", f"(Rebuild) 전체 {len(incoming)}개 중 {len(to_embed)}개를 임베딩합니다. (재사용 {len(reuse)}개)")
+            # /add 와 같은 기본 방식으로 인코딩해야 재구축한 벡터와 평소 쓴 벡터가 섞이지 않습니다.
+            embedded = (await _encode_long([incoming[i].text for i in to_embed], CHUNK_DEFAULT_MODE))[0] if to_embed else None
+            dim = embedded.shape[1] if embedded is not None else next(iter(reuse.values())).shape[0]
+            vectors = np.empty((len(incoming), dim), dtype=np.float32)
+            for i, vec in reuse.items(): vectors[i] = vec
+            for row, i in enumerate(to_embed): vectors[i] = embedded[row]
+
+            # 요청에 없는 메타데이터는 옛 테이블 값을 이어받습니다. (Node 가 id / text 만 보내는 경우)
+            for mem, metadata in zip(incoming, incoming_metadata):
+                previous = snapshot[mem.id][2] if mem.id in snapshot else {}
+                for name in MEMORY_METADATA_COLUMNS:
+                    if metadata[name] is None:
+                        metadata[name] = previous.get(name)
+            # 중복 정리의 숨김 표시는 내용이 그대로이고 대표 기억도 남아 있는 기억만 이어받습니다.
+            # (재구축이 주기적으로 돌 때마다 숨긴 중복이 다시 나타나지 않도록)
+            keep_marks = old_table is not None and CANONICAL_COLUMN in old_table.schema.names
+            incoming_ids = {mem.id for mem in incoming}
+            canonical_ids = [
+                snapshot[mem.id][2].get(CANONICAL_COLUMN)
+                if mem.id in snapshot and snapshot[mem.id][0] == h and snapshot[mem.id][2].get(CANONICAL_COLUMN) in incoming_ids
+                else None
+                for mem, h in zip(incoming, hashes)
+            ] if keep_marks else []
+            # 새 테이블은 현재 설정(VECTOR_CODES / VECTOR_CODES_COMPACT)의 형식으로 만들고, 압축 코드도 이미 메모리에 있는 벡터로 함께 씁니다.
+            data = pa.table({
+                "vector": _vector_array(vectors),
+                "id": pa.array([mem.id for mem in incoming], type=pa.int64()),
+                "text": pa.array([mem.text for mem in incoming], type=pa.string()),
+                "content_hash": pa.array(hashes, type=pa.string()),
+                **{name: pa.array([metadata[name] for metadata in incoming_metadata], type=type_)
+                   for name, type_ in MEMORY_METADATA_COLUMNS.items()},
+                **({CANONICAL_COLUMN: pa.array(canonical_ids, type=pa.int64())} if keep_marks else {}),
+                **({CODE_COLUMN: vector_codes.to_arrow(VECTOR_CODES, vectors)} if _needs_code_column() else {}),
+            })
+            shadow_name = f"{MEMORY_TABLE}_{int(time.time() * 1000)}"
+            new_table = await asyncio.to_thread(_get_db().create_table, shadow_name, data=data, mode="overwrite")
+
+            # 재구축 도중 /add, /add_batch 로 쓴 기억(스냅샷에도 요청 목록에도 없는 새 id, 또는 재구축 중에 다시 쓴 id)은
+            # 옛 테이블의 최신 행으로 새 테이블에 옮겨 담습니다. (요청 목록보다 나중에 쓴 내용이 이깁니다)
+            # 따라잡기와 교체가 끝날 때까지 쓰기를 막아서, 진행 중이던 /add_batch 쓰기가 끝난 뒤에 읽고
+            # 그 사이에 옛 테이블로 새 쓰기가 들어가지 않게 합니다. (검색은 막지 않음)
+            known_ids = set(snapshot) | {mem.id for mem in incoming}
+            async with _table_write_lock:
+                late_rows = (await asyncio.to_thread(_rows_written_during_rebuild, old_table, known_ids, _rebuild_written_ids)
+                             if old_table is not None else [])
+                if late_rows:
+                    await asyncio.to_thread(
+                        new_table.merge_insert("id").when_matched_update_all().when_not_matched_insert_all().execute,
+                        _with_codes(new_table.schema, [
+                            {**_memory_row(row["id"], row["text"], row["vector"], *(row.get(name) for name in MEMORY_METADATA_COLUMNS)),
+                             **({CANONICAL_COLUMN: row.get(CANONICAL_COLUMN)} if keep_marks else {})}
+                            for row in late_rows
+                        ]),
+                    )
+
+                # 원자적 교체: 포인터 파일과 전역 테이블 참조를 바꿉니다.
+                _set_active_table_name(shadow_name)
+                table = new_table
+                code_table_ready = shadow_name if _code_column(new_table) is not None else None
+            if old_table is not None and old_name != shadow_name:
+                _start_background(_drop_table_later(old_name, REBUILD_DROP_DELAY_SEC))
+
+            late_ids = {row["id"] for row in late_rows}
+            removed_ids = set(snapshot) - {mem.id for mem in incoming} - late_ids
+            deleted = len(removed_ids)
+            # 전문 인덱스도 바뀐 것만 반영합니다: 새로 임베딩한 기억 + 재구축 중 추가된 기억은 upsert, 빠진 id 는 삭제
+            await asyncio.to_thread(
+                _index_text_safely,
+                [(incoming[i].id, incoming[i].text) for i in to_embed] + [(row["id"], row["text"]) for row in late_rows],
+                removed_ids,
+            )
+            # 빠졌거나 내용이 바뀐 기억의 청크는 더 이상 맞지 않으므로 지웁니다. (내용이 같은 기억의 청크는 유지)
+            # 재구축 중에 다시 쓴 기억의 청크는 그 쓰기가 이미 맞춰 두었으므로 건드리지 않습니다.
+            changed_ids = {incoming[i].id for i in to_embed if snapshot.get(incoming[i].id, (None,))[0] != hashes[i]} - late_ids
+            await asyncio.to_thread(_delete_memory_chunks, removed_ids | changed_ids)
+            log("INFO", f"(Rebuild) '{shadow_name}' 테이블로 교체 완료. (임베딩 {len(to_embed)}, 재사용 {len(reuse)}, 삭제 {deleted}, 재구축 중 추가 {len(late_rows)})")
+            return {
+                "message": f"VectorDB 재구축 성공. {len(incoming)}개의 기억 처리됨.",
+                "mode": request.mode,
+                "total": len(incoming) + len(late_ids - {mem.id for mem in incoming}),
+                "embedded": len(to_embed),
+                "reused": len(reuse),
+                "deleted": deleted,
+                "added_during_rebuild": len(late_rows),
+            }
+        except HTTPException:
+            raise
+        except Exception as e:
+            log("ERROR", f"VectorDB 재구축 중 오류: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            _rebuild_written_ids = None
 
-        table = db_conn.create_table(table_name, data=data_for_lancedb, mode="overwrite")
-        print(f"INFO: (Rebuild) {len(data_for_lancedb)}개의 데이터로 '{table_name}' 테이블을 새로 생성했습니다.")
-        
-        return {"message": f"VectorDB 재구축 성공. {len(data_for_lancedb)}개의 기억 처리됨."}
-    except Exception as e:
-        print(f"ERROR: VectorDB 재구축 중 오류: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    
 # 만능 미디어 다운로더 
+# 다운로드는 작업(job)으로 처리됩니다. POST /jobs/download 는 작업 ID 를 바로 돌려주고,
+# 진행률은 GET /jobs/{job_id} (폴링) 또는 GET /jobs/{job_id}/events (SSE) 로 확인합니다.
 
 class MediaDownloadRequest(BaseModel):
     url: str
@@ -434,91 +2569,60 @@ class MediaDownloadResponse(BaseModel):
     message: str
     file_path: str
 
-@app.post("/download-media", response_model=MediaDownloadResponse)
-def download_media(request: MediaDownloadRequest):
-    video_url = request.url.strip()
-    output_format = request.format.lower()
-    output_path = request.output_path
-
-    print(f"INFO: (yt-dlp) 다운로드 요청 수신 — URL: {video_url}, 포맷: {output_format}")
-    os.makedirs(output_path, exist_ok=True)
-
-    output_template = os.path.join(output_path, "%(id)s.%(ext)s")
-
-    command = [
-        "yt-dlp",
-        "--restrict-filenames",
-        "--no-overwrites",
-        "--prefer-ffmpeg",
-        "-o", output_template,
-    ]
-
-    if output_format == "mp3":
-        command.extend([
-            "-x",
-            "--audio-format", "mp3",
-            "--audio-quality", "0",
-            "--prefer-ffmpeg",
-            # ▼▼▼ [핵심 수정] "ffmpeg:" 접두사를 제거하여 올바른 문법으로 수정합니다. ▼▼▼
-            "--postprocessor-args", "-af loudnorm,aresample=44100,aformat=channel_layouts=stereo"
-        ])
-    else:
-        command.extend([
-            "-f", "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best",
-            "--merge-output-format", "mp4"
-        ])
-
-    command.append(video_url)
-
-    try:
-        print(f"INFO: (yt-dlp) 실행 명령어: {' '.join(command)}")
-        # ✅ stderr도 포함해서 모두 UTF-8로 시도, 실패 시 CP949로 fallback
-        try:
-            result = subprocess.run(
-                command, check=True, capture_output=True, text=True, encoding="utf-8"
-            )
-            combined_output = (result.stdout or "") + (result.stderr or "")
-        except UnicodeDecodeError:
-            result = subprocess.run(
-                command, check=True, capture_output=True, text=True, encoding="cp949"
-            )
-            combined_output = (result.stdout or "") + (result.stderr or "")
-
-        # ✅ stdout+stderr 전체를 라인 단위로 분리
-        output_lines = combined_output.splitlines()
-        file_path = None
-
-        for line in output_lines:
-            if any(key in line for key in ["Destination:", "Downloading", "Merging formats into"]):
-                match = re.search(r'([A-Za-z]:[\\/].*?\.(mp4|mp3|m4a|webm))', line)
-                if match:
-                    file_path = match.group(1)
-                    break
-
-        if not file_path:
-            # 마지막 수단으로 디렉터리 직접 스캔
-            possible = [
-                os.path.join(output_path, f)
-                for f in os.listdir(output_path)
-                if f.endswith(f".{output_format}")
-            ]
-            if possible:
-                file_path = max(possible, key=os.path.getctime)
-            else:
-                raise FileNotFoundError("다운로드된 파일의 최종 경로를 로그에서 찾을 수 없습니다.")
-
-        file_path = os.path.abspath(file_path)
-        print(f"✅ (yt-dlp) 다운로드 완료: {file_path}")
-
-        return {
-            "message": f"{output_format.upper()} 다운로드 성공",
-            "file_path": file_path.replace("\\", "/"),
-        }
-
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(status_code=500, detail=f"yt-dlp 오류: {e.stderr}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"서버 내부 오류: {str(e)}")
+@app.post("/jobs/download", status_code=202)
+async def submit_download_job(request: MediaDownloadRequest):
+    job, deduplicated = download_jobs.submit(request.url, request.format, request.output_path)
+    log("INFO", f"(yt-dlp) 다운로드 작업 {'재사용' if deduplicated else '등록'} — {job.id} ({job.url}, {job.format})")
+    return {**job.to_dict(), "deduplicated": deduplicated}
+
+@app.get("/jobs")
+def list_download_jobs():
+    return {"stats": download_jobs.stats(), "jobs": [job.to_dict() for job in download_jobs.jobs.values()]}
+
+@app.get("/jobs/{job_id}")
+async def get_download_job(job_id: str, wait_version: Optional[int] = None, timeout: float = 25.0):
+    """작업 상태 조회. wait_version 을 주면 그 버전에서 상태가 바뀔 때까지(최대 timeout 초) 기다립니다 (롱폴링)."""
+    job = download_jobs.get(job_id)
+    if job is None: raise HTTPException(status_code=404, detail="작업을 찾을 수 없습니다.")
+    if wait_version is not None and not job.done:
+        await job.wait_for_change(wait_version, min(timeout, 60.0))
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def stream_download_job(job_id: str):
+    """작업 진행 상황을 Server-Sent Events 로 내보냅니다. 작업이 끝나면 스트림도 닫힙니다."""
+    job = download_jobs.get(job_id)
+    if job is None: raise HTTPException(status_code=404, detail="작업을 찾을 수 없습니다.")
+
+    async def events():
+        version = -1
+        while True:
+            if job.version != version:
+                version = job.version
+                yield f"event: {job.status}\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+                if job.done:
+                    return
+            elif not await job.wait_for_change(version, 15.0):
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/download-media", response_model=MediaDownloadResponse, deprecated=True)
+async def download_media(request: MediaDownloadRequest):
+    """
+    (사용 중단 예정) 작업을 등록하고 끝날 때까지 기다린 뒤 최종 파일 경로를 돌려줍니다.
+    다운로드가 끝날 때까지 응답이 몇 분씩 걸리므로 POST /jobs/download 를 쓰세요.
+    """
+    log("WARN", f"(yt-dlp) 사용 중단 예정인 /download-media 호출 — POST /jobs/download 를 쓰세요. URL: {request.url}, 포맷: {request.format}")
+    job, _ = download_jobs.submit(request.url, request.format, request.output_path)
+    while not job.done:
+        await job.wait_for_change(job.version, 60.0)
+    if job.status != "completed":
+        raise HTTPException(status_code=500, detail=job.error or "다운로드 실패")
+    return {
+        "message": f"{job.format.upper()} 다운로드 성공",
+        "file_path": job.file_path,
+    }
 
 # ==========================================================
 # 🎯 오래된 다운로드 파일 자동 정리 스케줄러
@@ -568,92 +2672,192 @@ def start_cleanup_scheduler(path="public/downloads", max_age_hours=24, interval_
     threading.Thread(target=loop, daemon=True).start()
 
 # [새로운 기능] 확장형 파일 리더 엔진 
-@app.post("/read-file")
-def read_file(file: FileContent):
-    ext = file.extension.lower()
-    name = file.filename
-    text = file.content
-    
-    # DB 저장을 위한 변수 초기화
-    final_text_for_ai = ""
-    result_dict = {}
-
+# --- 파일 분석 / 청크 인덱싱 ---
+def _insert_file_record(name: str, ext: str, size_bytes: Optional[int]) -> Optional[int]:
+    """files.db 에 행을 먼저 만들어 청크가 연결될 files.id 를 받습니다. 실패해도 분석 기능은 계속 동작합니다."""
     try:
-        if ext in ["py", "js", "txt", "md"]:
-            final_text_for_ai = text
-            result_dict = { "filename": name, "type": "code", "text": final_text_for_ai }
-
-        elif ext == "json":
+        cursor = db_access.execute(
+            "files", "INSERT INTO files (filename, extension, file_size_kb, summary) VALUES (?, ?, ?, ?)",
+            (name, ext, round(size_bytes / 1024, 2) if size_bytes is not None else None, ""))
+        return cursor.lastrowid
+    except Exception as db_e:
+        log("ERROR", f"(DB) files.db 저장 실패: {db_e}")
+        return None
+
+def _update_file_summary(file_id: int, summary: str):
+    db_access.execute("files", "UPDATE files SET summary = ? WHERE id = ?", (summary, file_id))
+
+def _delete_file_record(file_id: int):
+    db_access.execute("files", "DELETE FROM files WHERE id = ?", (file_id,))
+
+def _get_file_chunks_table(create_rows: Optional[List[Dict[str, Any]]] = None):
+    """file_chunks 테이블을 엽니다. 없으면 create_rows 로 생성하고, create_rows 도 없으면 None."""
+    global file_chunks_table
+    with _file_chunks_lock:
+        if file_chunks_table is None:
             try:
-                parsed = json.loads(text)
-                final_text_for_ai = json.dumps(parsed, indent=2, ensure_ascii=False)
-                result_dict = {
-                    "filename": name, "type": "json",
-                    "keys": list(parsed.keys()) if isinstance(parsed, dict) else None,
-                    "text": final_text_for_ai[:4000]
-                }
-            except Exception:
-                raise HTTPException(status_code=400, detail="JSON 파싱 실패")
-
-        elif ext == "ipynb":
-            try:
-                data = json.loads(text)
-                cells = data.get("cells", [])
-                code_cells = [c for c in cells if c.get("cell_type") == "code"]
-                full_code = "\n".join(["".join(c.get("source", [])) for c in code_cells])
-                final_text_for_ai = f"# 주피터 노트북 '{name}'의 코드 내용\n\n{full_code}"
-                result_dict = {
-                    "filename": name, "type": "notebook",
-                    "code_cells_count": len(code_cells),
-                    "text": final_text_for_ai[:4000]
-                }
+                file_chunks_table = _get_db().open_table(FILE_CHUNK_TABLE)
             except Exception:
-                raise HTTPException(status_code=400, detail="Jupyter Notebook 파싱 실패")
-
-        elif ext == "csv":
-            reader = csv.reader(io.StringIO(text))
-            rows = list(reader)
-            header = rows[0] if rows else []
-            sample_rows = rows[1:6]
-            
-            csv_preview = "| " + " | ".join(header) + " |\n"
-            csv_preview += "| " + " | ".join(["---"] * len(header)) + " |\n"
-            for row in sample_rows:
-                csv_preview += "| " + " | ".join(row) + " |\n"
-            final_text_for_ai = f"### CSV 파일 '{name}' 분석\n**총 {len(rows)}개 행**, 헤더: {', '.join(header)}\n\n**샘플 데이터:**\n{csv_preview}"
-            
-            result_dict = { "filename": name, "type": "csv", "text": final_text_for_ai }
-
+                if create_rows is None:
+                    return None
+                file_chunks_table = _get_db().create_table(FILE_CHUNK_TABLE, data=create_rows)
+                return file_chunks_table
+        if create_rows:
+            file_chunks_table.add(create_rows)
+        return file_chunks_table
+
+def _delete_file_chunks(file_id: int) -> bool:
+    tbl = _get_file_chunks_table()
+    if tbl is None:
+        return False
+    tbl.delete(f"file_id = {int(file_id)}")
+    return True
+
+def _take(iterator, n: int) -> List[str]:
+    # 스레드에서 파싱 + 청크 분할을 n 개만큼 진행합니다. (파일 읽기가 이벤트 루프를 막지 않도록)
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) >= n:
+            break
+    return batch
+
+def _drain(iterator) -> int:
+    return sum(1 for _ in iterator)
+
+async def _ingest_file(name: str, ext: str, fp, size_bytes: Optional[int], index: bool) -> Dict[str, Any]:
+    """
+    파일 객체를 한 번 훑으면서 요약 정보(행 수, 샘플, 미리보기)를 만들고,
+    index 가 켜져 있으면 겹치는 청크를 배치로 임베딩해 file_chunks 테이블에 files.id 와 함께 저장합니다.
+    """
+    ext = ext.lower()
+    info, units = file_ingest.parse_file(name, ext, fp, FILE_TEXT_MAX_CHARS)
+    file_id = await asyncio.to_thread(_insert_file_record, name, ext, size_bytes)
+    chunks = file_ingest.chunk_units(units, FILE_CHUNK_CHARS, FILE_CHUNK_OVERLAP)
+    indexing = index and file_id is not None and encoder is not None
+    chunk_count, pending = 0, []
+    try:
+        if indexing:
+            while True:
+                batch = await asyncio.to_thread(_take, chunks, ADD_BATCH_ENCODE_CHUNK)
+                if not batch:
+                    break
+                vectors, _ = await _encode_long(batch, "pooled")  # 글자 수로 자른 청크도 모델 길이를 넘을 수 있음
+                pending.extend(
+                    {"vector": vector.tolist(), "file_id": file_id, "chunk_index": chunk_count + i, "filename": name, "text": text}
+                    for i, (text, vector) in enumerate(zip(batch, vectors)))
+                chunk_count += len(batch)
+                if len(pending) >= ADD_BATCH_WRITE_SIZE:
+                    await asyncio.to_thread(_get_file_chunks_table, pending)
+                    pending = []
+            if pending:
+                await asyncio.to_thread(_get_file_chunks_table, pending)
         else:
-            raise HTTPException(status_code=415, detail=f"지원하지 않는 파일 형식: {ext}")
+            chunk_count = await asyncio.to_thread(_drain, chunks)
+    except Exception:
+        # 파싱 도중 실패하면 먼저 만들어 둔 files 행과 이미 저장한 청크를 지웁니다.
+        if file_id is not None:
+            await asyncio.to_thread(_delete_file_record, file_id)
+            if indexing:
+                await asyncio.to_thread(_delete_file_chunks, file_id)
+        raise
+
+    result = file_ingest.build_result(info)
+    if file_id is not None:
+        # summary 컬럼에는 기존과 같이 AI 에게 전달할 텍스트의 요약본(최대 500자)을 저장합니다.
+        await asyncio.to_thread(_update_file_summary, file_id, result["text"][:500])
+        log("INFO", f"(DB) 파일 분석 결과를 files.db에 저장했습니다: {name} (청크 {chunk_count}개, 인덱싱 {'O' if indexing else 'X'})")
+    result.update(file_id=file_id, chunks=chunk_count, indexed=indexing)
+    return result
+
+def _ingest_error(e: Exception) -> HTTPException:
+    if isinstance(e, file_ingest.UnsupportedFileType):
+        return HTTPException(status_code=415, detail=str(e))
+    if isinstance(e, file_ingest.FileParseError):
+        return HTTPException(status_code=400, detail=str(e))
+    return HTTPException(status_code=500, detail=f"파일 처리 중 오류 발생: {str(e)}")
 
-        # ▼▼▼ [핵심 추가] 모든 분석이 끝난 후, 최종적으로 DB에 저장합니다. ▼▼▼
-        if final_text_for_ai:
-            try:
-                # 데이터베이스 파일의 정확한 경로를 지정합니다.
-                db_path = os.path.join(os.path.dirname(__file__), 'database', 'files.db')
-                conn = sqlite3.connect(db_path)
-                cursor = conn.cursor()
-                # summary 컬럼에 AI에게 전달할 텍스트의 요약본(최대 500자)을 저장합니다.
-                cursor.execute(
-                    "INSERT INTO files (filename, extension, summary) VALUES (?, ?, ?)",
-                    (name, ext, final_text_for_ai[:500])
-                )
-                conn.commit()
-                conn.close()
-                print(f"INFO: (DB) 파일 분석 결과를 files.db에 저장했습니다: {name}")
-            except Exception as db_e:
-                # DB 저장에 실패하더라도, 기능 자체는 작동하도록 오류만 출력합니다.
-                print(f"ERROR: (DB) files.db 저장 실패: {db_e}")
-        # ▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲▲
-
-        return result_dict # 최종적으로 프론트엔드에 분석 결과를 반환합니다.
+@app.post("/read-file")
+async def read_file(file: FileContent):
+    """(기존 호환) 파일 내용을 JSON 문자열로 받습니다. 큰 파일은 /files/upload 로 스트리밍하세요."""
+    try:
+        return await _ingest_file(file.filename, file.extension, io.StringIO(file.content),
+                                  len(file.content.encode("utf-8")), file.index)
+    except Exception as e:
+        raise _ingest_error(e)
+
+# 요청 본문(파일 원본 바이트)을 스트리밍으로 받아 임시 파일에 쓰고, 줄 단위로 파싱합니다.
+@app.post("/files/upload")
+async def upload_file(request: Request, filename: str, extension: Optional[str] = None, index: bool = True):
+    ext = (extension or os.path.splitext(filename)[1].lstrip(".")).lower()
+    if ext not in file_ingest.SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=415, detail=f"지원하지 않는 파일 형식: {ext}")
+    # 본문은 임시 파일에 받아 둡니다. 디스크 쓰기가 이벤트 루프를 막지 않도록 1MB 씩 모아 스레드에서 씁니다.
+    with tempfile.TemporaryFile() as spool:
+        size = 0
+        buffered: List[bytes] = []
+        buffered_bytes = 0
+        async for piece in request.stream():
+            size += len(piece)
+            if size > FILE_UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"파일이 너무 큽니다. (최대 {FILE_UPLOAD_MAX_BYTES} 바이트)")
+            buffered.append(piece)
+            buffered_bytes += len(piece)
+            if buffered_bytes >= FILE_UPLOAD_WRITE_BYTES:
+                await asyncio.to_thread(spool.write, b"".join(buffered))
+                buffered, buffered_bytes = [], 0
+        if buffered:
+            await asyncio.to_thread(spool.write, b"".join(buffered))
+        spool.seek(0)
+        # CSV 는 따옴표 안의 줄바꿈을 csv 모듈이 처리하도록 newline="" 로 엽니다.
+        text_fp = io.TextIOWrapper(spool, encoding="utf-8-sig", errors="replace", newline="" if ext == "csv" else None)
+        try:
+            return await _ingest_file(filename, ext, text_fp, size, index)
+        except Exception as e:
+            raise _ingest_error(e)
+        finally:
+            text_fp.detach()
+
+@app.post("/files/search", response_model=FileSearchResponse)
+async def search_files(request: FileSearchRequest):
+    if encoder is None: raise HTTPException(status_code=503, detail="서버 준비 안됨")
+    if not request.query or not request.query.strip(): raise HTTPException(status_code=400, detail="검색어 필요")
+    try:
+        tbl = await asyncio.to_thread(_get_file_chunks_table)
+        if tbl is None:
+            return {"results": []}
+        query_vector = await encoder.encode(request.query)
+        where = f"file_id IN ({', '.join(str(int(i)) for i in request.file_ids)})" if request.file_ids else None
+
+        def run():
+            query = tbl.search(query_vector).select(["file_id", "filename", "chunk_index", "text"]).limit(request.limit)
+            if where:
+                query = query.where(where, prefilter=True)
+            return query.to_arrow().to_pylist()
+
+        hits = [
+            {"file_id": row["file_id"], "filename": row["filename"], "chunk_index": row["chunk_index"],
+             "text": row["text"], "score": _distance_to_score(row["_distance"])}
+            for row in await asyncio.to_thread(run)
+        ]
+        if request.min_score is not None:
+            hits = [hit for hit in hits if hit["score"] >= request.min_score]
+        return {"results": hits}
+    except Exception as e:
+        log("ERROR", f"파일 검색 중 오류: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
+@app.delete("/files/{file_id}/chunks")
+async def delete_file_chunks(file_id: int):
+    try:
+        removed = await asyncio.to_thread(_delete_file_chunks, file_id)
+        return {"file_id": file_id, "deleted": removed}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"파일 처리 중 오류 발생: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 # --- 5. 서버 실행 ---
 if __name__ == "__main__":
     # 서버 실행 전 정리 루프 시작
     start_cleanup_scheduler(path="public/downloads", max_age_hours=24, interval_minutes=60)
+    # 여러 코어를 쓰려면 uvicorn workers 대신 SERVER_WORKERS 를 늘리세요. (LanceDB 쓰기 주체를 하나로 유지)
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
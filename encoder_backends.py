@@ -0,0 +1,256 @@
+# --- 임베딩 백엔드 ---
+# model.encode 뒤에 교체 가능한 백엔드를 둡니다. (EMBEDDING_BACKEND 환경 변수로 선택)
+# - torch: 기존 SentenceTransformer + PyTorch 경로 (기준 백엔드)
+# - onnx : SentenceTransformer(backend="onnx") 로 ONNX Runtime 에서 실행 (optimum[onnxruntime] 필요)
+# - int8 : PyTorch 모델의 Linear 층을 동적 int8 양자화 (CPU 전용)
+# - stub : 모델 가중치 없이 토큰 해싱으로 벡터를 만드는 가짜 인코더 (벤치마크 / 테스트용, 의미 검색 품질은 없음)
+# 모든 백엔드는 intra-op 스레드 수와 최대 시퀀스 길이를 설정할 수 있고,
+# parity_check 로 기준 백엔드 대비 코사인 오차를 측정할 수 있습니다.
+import hashlib
+import os
+import re
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+BACKENDS = ("torch", "onnx", "int8", "stub")
+DEFAULT_MAX_SEQ_LENGTH = 256  # 모델이 길이를 알려주지 않을 때 (MiniLM 과 같은 값)
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+class EmbeddingBackend:
+    """문장 목록을 (n, dim) float32 행렬로 바꾸는 공통 인터페이스."""
+
+    name = "base"
+    fork_safe = True  # 로드 후 fork 한 자식 프로세스에서 그대로 써도 되는지 (worker_pool)
+
+    def __init__(self, model_name: str, device: str = "cpu", num_threads: Optional[int] = None,
+                 max_seq_length: Optional[int] = None):
+        self.model_name = model_name
+        self.device = device
+        self.num_threads = num_threads or None
+        self.max_seq_length = max_seq_length or None
+        self.model = None
+
+    def load(self) -> "EmbeddingBackend":
+        raise NotImplementedError
+
+    def set_num_threads(self, num_threads: int):
+        """intra-op 스레드 수를 바꿉니다. (fork 한 워커마다 코어를 나눠 쓸 때)"""
+        self.num_threads = num_threads
+
+    def _apply_max_seq_length(self):
+        if self.max_seq_length:
+            self.model.max_seq_length = self.max_seq_length
+
+    def encode(self, texts, batch_size: Optional[int] = None, **kwargs) -> np.ndarray:
+        """SentenceTransformer.encode 와 같은 모양으로 호출할 수 있습니다. (문자열 하나면 1차원 벡터)"""
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        vectors = self.model.encode(batch, batch_size=batch_size or max(1, len(batch)), convert_to_numpy=True)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors[0] if single else vectors
+
+    def dimension(self) -> Optional[int]:
+        return self.model.get_sentence_embedding_dimension() if self.model is not None else None
+
+    def token_limit(self) -> int:
+        """한 번에 인코딩되는 본문 토큰 수. 이보다 긴 텍스트는 모델이 뒷부분을 잘라 냅니다. ([CLS] / [SEP] 제외)"""
+        length = getattr(self.model, "max_seq_length", None) or self.max_seq_length or DEFAULT_MAX_SEQ_LENGTH
+        return max(8, int(length) - 2)
+
+    def token_offsets(self, texts: Sequence[str]) -> List[List[Tuple[int, int]]]:
+        """텍스트마다 토큰의 (시작, 끝) 글자 위치. fast 토크나이저가 없으면 단어 단위로 근사합니다."""
+        tokenizer = getattr(self.model, "tokenizer", None)
+        if tokenizer is not None and getattr(tokenizer, "is_fast", False):
+            encoded = tokenizer(list(texts), add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+            return [[(int(a), int(b)) for a, b in spans] for spans in encoded["offset_mapping"]]
+        return [[m.span() for m in _WORD.finditer(text)] for text in texts]
+
+    def describe(self) -> dict:
+        return {
+            "backend": self.name, "model": self.model_name, "device": self.device,
+            "num_threads": self.num_threads, "max_seq_length": getattr(self.model, "max_seq_length", self.max_seq_length),
+            "dimension": self.dimension(),
+        }
+
+
+class TorchBackend(EmbeddingBackend):
+    name = "torch"
+
+    def set_num_threads(self, num_threads: int):
+        import torch
+
+        torch.set_num_threads(num_threads)
+        self.num_threads = num_threads
+
+    def load(self):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        self.model = SentenceTransformer(self.model_name, device=self.device)
+        self._apply_max_seq_length()
+        return self
+
+
+class Int8Backend(TorchBackend):
+    """torch.quantization.quantize_dynamic 으로 Linear 층 가중치를 int8 로 바꾼 CPU 경로."""
+
+    name = "int8"
+
+    def load(self):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        self.device = "cpu"  # 동적 양자화 커널은 CPU 에서만 동작합니다.
+        model = SentenceTransformer(self.model_name, device="cpu")
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self._apply_max_seq_length()
+        return self
+
+
+class OnnxBackend(EmbeddingBackend):
+    """sentence-transformers 의 ONNX 백엔드 (ONNX Runtime). 모델 파일이 없으면 처음 로드할 때 변환합니다."""
+
+    name = "onnx"
+    fork_safe = False  # ONNX Runtime 세션의 스레드 풀은 fork 를 넘어가지 못하므로 워커마다 새로 로드합니다.
+
+    def __init__(self, *args, onnx_file: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.onnx_file = onnx_file or None  # 예: onnx/model_qint8_avx512.onnx (미리 양자화된 파일)
+
+    def load(self):
+        import onnxruntime as ort
+        from sentence_transformers import SentenceTransformer
+
+        session_options = ort.SessionOptions()
+        if self.num_threads:
+            session_options.intra_op_num_threads = self.num_threads
+        model_kwargs = {"provider": "CPUExecutionProvider", "session_options": session_options}
+        if self.onnx_file:
+            model_kwargs["file_name"] = self.onnx_file
+        self.device = "cpu"
+        self.model = SentenceTransformer(self.model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+        self._apply_max_seq_length()
+        return self
+
+    def describe(self) -> dict:
+        return {**super().describe(), "onnx_file": self.onnx_file}
+
+
+class StubBackend(EmbeddingBackend):
+    """
+    같은 단어가 많이 겹치는 문장끼리 가깝게 나오는 정도의 해싱 벡터 (feature hashing + L2 정규화).
+    다운로드가 필요 없어서 벤치마크에서 인코더를 뺀 나머지 경로(검색, 직렬화, DB 쓰기)를 잴 때 씁니다.
+    """
+
+    name = "stub"
+    _TOKEN = _WORD
+
+    def __init__(self, *args, dim: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dim = dim or int(os.getenv("EMBEDDING_STUB_DIM", "384"))
+
+    def load(self):
+        self.device = "cpu"
+        return self
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        tokens = self._TOKEN.findall(text.lower())[: self.token_limit()] or [text]
+        for token in tokens:
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def encode(self, texts, batch_size: Optional[int] = None, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        vectors = np.zeros((len(batch), self.dim), dtype=np.float32)
+        for i, text in enumerate(batch):
+            vectors[i] = self._vector(text)
+        return vectors[0] if single else vectors
+
+    def dimension(self) -> Optional[int]:
+        return self.dim
+
+    def token_limit(self) -> int:
+        return self.max_seq_length or DEFAULT_MAX_SEQ_LENGTH  # 단어 단위 해싱이라 특수 토큰이 없습니다.
+
+    def describe(self) -> dict:
+        return {**super().describe(), "max_seq_length": self.max_seq_length}
+
+
+def load_backend(name: str, model_name: str, device: str = "cpu", num_threads: Optional[int] = None,
+                 max_seq_length: Optional[int] = None, onnx_file: Optional[str] = None) -> EmbeddingBackend:
+    name = (name or "torch").lower()
+    if name == "torch":
+        backend = TorchBackend(model_name, device, num_threads, max_seq_length)
+    elif name == "int8":
+        backend = Int8Backend(model_name, device, num_threads, max_seq_length)
+    elif name == "onnx":
+        backend = OnnxBackend(model_name, device, num_threads, max_seq_length, onnx_file=onnx_file)
+    elif name == "stub":
+        backend = StubBackend(model_name, device, num_threads, max_seq_length)
+    else:
+        raise ValueError(f"알 수 없는 임베딩 백엔드입니다: {name} (사용 가능: {', '.join(BACKENDS)})")
+    return backend.load()
+
+
+def _timed_encode(backend: EmbeddingBackend, texts: List[str], batch_size: int) -> tuple:
+    start = time.perf_counter()
+    vectors = backend.encode(texts, batch_size=batch_size)
+    return vectors, (time.perf_counter() - start) * 1000
+
+
+def parity_check(reference: EmbeddingBackend, candidate: EmbeddingBackend, texts: Sequence[str],
+                 batch_size: int = 32, top_k: int = 5) -> Dict:
+    """
+    같은 문장들을 두 백엔드로 인코딩해 행별 코사인 유사도(기준 대비 오차)를 비교합니다.
+    top_k 겹침률은 문장끼리의 최근접 이웃 순위가 얼마나 유지되는지를 나타냅니다.
+    """
+    texts = [t for t in texts if t and t.strip()]
+    if not texts:
+        raise ValueError("비교할 문장이 없습니다.")
+    ref, ref_ms = _timed_encode(reference, texts, batch_size)
+    cand, cand_ms = _timed_encode(candidate, texts, batch_size)
+    if ref.shape != cand.shape:
+        raise ValueError(f"두 백엔드의 출력 차원이 다릅니다: {ref.shape} vs {cand.shape}")
+
+    ref_n = ref / np.clip(np.linalg.norm(ref, axis=1, keepdims=True), 1e-12, None)
+    cand_n = cand / np.clip(np.linalg.norm(cand, axis=1, keepdims=True), 1e-12, None)
+    cosine = (ref_n * cand_n).sum(axis=1)
+
+    overlap = None
+    k = min(top_k, len(texts) - 1)
+    if k > 0:
+        def neighbours(m):
+            sims = m @ m.T
+            np.fill_diagonal(sims, -np.inf)
+            return np.argsort(-sims, axis=1)[:, :k]
+        ref_nb, cand_nb = neighbours(ref_n), neighbours(cand_n)
+        overlap = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_nb.tolist(), cand_nb.tolist())]))
+
+    return {
+        "reference": reference.describe(),
+        "candidate": candidate.describe(),
+        "num_texts": len(texts),
+        "cosine": {
+            "mean": float(cosine.mean()),
+            "min": float(cosine.min()),
+            "p05": float(np.percentile(cosine, 5)),
+        },
+        "max_drift": float(1.0 - cosine.min()),  # 1 - cos, 0 이면 완전히 동일
+        "top_k": k,
+        "top_k_overlap": overlap,
+        "reference_ms": round(ref_ms, 2),
+        "candidate_ms": round(cand_ms, 2),
+        "speedup": round(ref_ms / cand_ms, 2) if cand_ms > 0 else None,
+    }
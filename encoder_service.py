@@ -0,0 +1,227 @@
+# --- 마이크로 배칭 인코더 서비스 ---
+# 여러 요청에서 동시에 들어오는 문장들을 하나의 배치로 묶어
+# SentenceTransformer.encode 를 한 번만 호출하고, 각 호출자의 future 를 채워줍니다.
+# 무거운 forward pass 는 이벤트 루프가 아닌 스레드 풀에서 실행됩니다.
+# 임베딩 캐시(EmbeddingCache)가 주어지면 캐시에 없는 문장만 모델로 보냅니다.
+import asyncio
+import bisect
+import time
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+import stage_timing
+
+
+class Histogram:
+    """고정 버킷 기반의 간단한 히스토그램 (배치 크기, 대기 시간 튜닝용)."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 마지막 칸은 +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """버킷 상한값으로 근사한 분위수를 돌려줍니다."""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        running = 0
+        for i, c in enumerate(self.counts):
+            running += c
+            if running >= target:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        cumulative, running = {}, 0
+        for bound, c in zip(self.buckets + [float("inf")], self.counts):
+            running += c
+            cumulative["+Inf" if bound == float("inf") else str(bound)] = running
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "avg": round(self.sum / self.count, 3) if self.count else None,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": cumulative,
+        }
+
+
+class _PendingItem:
+    __slots__ = ("text", "future", "enqueued_at")
+
+    def __init__(self, text: str, future: asyncio.Future):
+        self.text = text
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class EncoderService:
+    """
+    동시 요청을 모아 배치 단위로 인코딩하는 공유 워커.
+    encode_fn 은 문자열 리스트를 받아 (N, dim) 형태의 numpy 배열을 돌려줘야 합니다.
+    cache 는 get_memory / get_many / put_many 를 제공하는 임베딩 캐시입니다 (선택).
+    """
+
+    BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+    QUEUE_WAIT_BUCKETS_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000]
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch_size: int = 32, max_wait_ms: float = 5.0, cache=None,
+                 max_inflight_batches: int = 1):
+        self.encode_fn = encode_fn
+        self.cache = cache
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self.max_inflight_batches = max(1, int(max_inflight_batches))  # 여러 워커 프로세스로 인코딩할 때 > 1
+        self.batch_size_hist = Histogram(self.BATCH_SIZE_BUCKETS)
+        self.queue_wait_hist = Histogram(self.QUEUE_WAIT_BUCKETS_MS)
+        self.encode_time_hist = Histogram(self.QUEUE_WAIT_BUCKETS_MS)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    # --- 수명 주기 ---
+    def start(self):
+        """실행 중인 이벤트 루프 안에서 호출해야 합니다 (lifespan)."""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        # 남아 있는 호출자들이 영원히 기다리지 않도록 정리합니다.
+        while self._queue is not None and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if not item.future.done():
+                item.future.set_exception(RuntimeError("인코더 서비스가 종료되었습니다."))
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    # --- 공개 API ---
+    async def encode(self, text: str) -> np.ndarray:
+        """문장 하나를 인코딩합니다. 다른 요청들과 같은 배치로 묶일 수 있습니다."""
+        return (await self.encode_many([text]))[0]
+
+    async def encode_many(self, texts: List[str]) -> np.ndarray:
+        """여러 문장을 큐에 넣고, 모든 결과가 모이면 (N, dim) 배열로 돌려줍니다."""
+        if self._queue is None:
+            raise RuntimeError("인코더 서비스가 시작되지 않았습니다.")
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        with stage_timing.stage("encode"):
+            loop = asyncio.get_running_loop()
+            futures = []
+            for text in texts:
+                # 메모리 캐시에 있는 문장은 큐를 거치지 않고 바로 돌려줍니다.
+                cached = self.cache.get_memory(text) if self.cache is not None else None
+                if cached is not None:
+                    futures.append(cached)
+                    continue
+                future = loop.create_future()
+                self._queue.put_nowait(_PendingItem(text, future))
+                futures.append(future)
+            pending = [f for f in futures if isinstance(f, asyncio.Future)]
+            if pending:
+                await asyncio.gather(*pending)
+            return np.stack([f.result() if isinstance(f, asyncio.Future) else f for f in futures])
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "max_inflight_batches": self.max_inflight_batches,
+            "queue_depth": self.queue_depth,
+            "batch_size": self.batch_size_hist.snapshot(),
+            "queue_wait_ms": self.queue_wait_hist.snapshot(),
+            "encode_ms": self.encode_time_hist.snapshot(),
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+    def _encode_with_cache(self, texts: List[str]) -> np.ndarray:
+        """스레드 풀에서 실행: 디스크 캐시까지 확인한 뒤, 없는 문장만 모델로 인코딩하고 캐시에 저장합니다."""
+        if self.cache is None:
+            with stage_timing.stage("model_encode"):
+                return self.encode_fn(texts)
+        cached = self.cache.get_many(texts)
+        missing = [i for i, vec in enumerate(cached) if vec is None]
+        if missing:
+            with stage_timing.stage("model_encode"):
+                fresh = self.encode_fn([texts[i] for i in missing])
+            self.cache.put_many([texts[i] for i in missing], fresh)
+            for i, vec in zip(missing, fresh):
+                cached[i] = vec
+        return np.stack(cached)
+
+    # --- 워커 루프 ---
+    async def _collect_batch(self) -> List[_PendingItem]:
+        # 첫 항목이 올 때까지 기다린 뒤, max_wait_ms 안에 들어오는 항목들을 최대 배치 크기까지 모읍니다.
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            # 이미 큐에 쌓여 있는 항목은 기다리지 않고 바로 가져옵니다.
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        # 동시에 처리 중인 배치 수를 max_inflight_batches 로 제한합니다. (1 이면 한 배치씩 순서대로)
+        slots = asyncio.Semaphore(self.max_inflight_batches)
+        inflight = set()
+        try:
+            while True:
+                await slots.acquire()
+                batch = await self._collect_batch()
+                # 이미 취소된 호출자는 배치에서 제외합니다.
+                batch = [item for item in batch if not item.future.done()]
+                if not batch:
+                    slots.release()
+                    continue
+                task = asyncio.get_running_loop().create_task(self._process(batch))
+                inflight.add(task)
+                task.add_done_callback(lambda t: (inflight.discard(t), slots.release()))
+        finally:
+            for task in inflight:
+                task.cancel()
+
+    async def _process(self, batch: List[_PendingItem]):
+        started = time.perf_counter()
+        self.batch_size_hist.observe(len(batch))
+        for item in batch:
+            self.queue_wait_hist.observe((started - item.enqueued_at) * 1000.0)
+
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(None, self._encode_with_cache, [item.text for item in batch])
+        except Exception as e:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        finally:
+            self.encode_time_hist.observe((time.perf_counter() - started) * 1000.0)
+
+        for item, vector in zip(batch, vectors):
+            if not item.future.done():
+                item.future.set_result(vector)
@@ -0,0 +1,220 @@
+# --- 파일 분석 / 청크 분할 ---
+# 파일 전체를 문자열이나 행 목록으로 만들지 않고, 파일 객체를 한 줄(한 행, 한 셀)씩 읽어가며
+#   1) 행 수 / 헤더 / 샘플 같은 요약 정보를 모으고
+#   2) 의미 검색용으로 겹치는(overlap) 텍스트 청크를 만들어 냅니다.
+# JSON / 노트북은 ijson 이 설치되어 있으면 스트리밍으로 파싱하고, 없으면 json.load 로 읽습니다.
+# (어느 쪽이든 json.dumps(indent=2) 로 문서 전체를 다시 문자열로 만들지는 않습니다.)
+import csv
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+TEXT_EXTENSIONS = ("py", "js", "txt", "md")
+SUPPORTED_EXTENSIONS = TEXT_EXTENSIONS + ("json", "ipynb", "csv")
+PREVIEW_CHARS = 4000     # JSON / 노트북 미리보기 길이 (기존 응답과 동일)
+CSV_SAMPLE_ROWS = 5
+
+
+class UnsupportedFileType(ValueError):
+    """지원하지 않는 확장자."""
+
+
+class FileParseError(ValueError):
+    """파일 내용을 해당 형식으로 파싱할 수 없을 때."""
+
+
+class _Capture:
+    """앞부분 최대 limit 글자만 모아 둡니다. (전체 텍스트를 들고 있지 않기 위해)"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.parts: List[str] = []
+        self.size = 0
+        self.truncated = False
+
+    def add(self, text: str):
+        if self.size >= self.limit:
+            self.truncated = True
+            return
+        piece = text[:self.limit - self.size]
+        self.truncated = self.truncated or len(piece) < len(text)
+        self.parts.append(piece)
+        self.size += len(piece)
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+def _flatten_json(value: Any, path: str = "") -> Iterator[str]:
+    """json.load 로 읽은 값을 'a.b[0].c: 값' 형식의 줄로 펼칩니다."""
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from _flatten_json(child, f"{path}.{key}" if path else str(key))
+    elif isinstance(value, list):
+        for i, child in enumerate(value):
+            yield from _flatten_json(child, f"{path}[{i}]")
+    else:
+        yield f"{path or '$'}: {json.dumps(value, ensure_ascii=False)}"
+
+
+def _binary(fp):
+    # ijson 은 바이트 스트림을 받는 쪽이 빠릅니다. (TextIOWrapper 면 아래 바이너리 파일을 넘김)
+    return getattr(fp, "buffer", fp)
+
+
+def _stream_json_lines(fp, info: Dict[str, Any]) -> Iterator[str]:
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+    try:
+        if ijson is None:
+            parsed = json.load(fp)
+            info["keys"] = list(parsed.keys()) if isinstance(parsed, dict) else None
+            yield from _flatten_json(parsed)
+            return
+        keys: Optional[List[str]] = None
+        for prefix, event, value in ijson.parse(_binary(fp)):
+            if prefix == "" and event == "start_map":
+                keys = []
+            elif prefix == "" and event == "map_key":
+                keys.append(value)
+            elif event not in ("start_map", "end_map", "start_array", "end_array", "map_key"):
+                yield f"{prefix.replace('.item', '[]') or '$'}: {json.dumps(value, ensure_ascii=False, default=str)}"
+        info["keys"] = keys
+    except (ValueError, UnicodeDecodeError) as e:  # ijson.JSONError 도 ValueError 의 하위 클래스입니다.
+        raise FileParseError(f"JSON 파싱 실패: {e}")
+
+
+def _stream_notebook_cells(fp) -> Iterator[Dict[str, Any]]:
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+    try:
+        if ijson is None:
+            yield from json.load(fp).get("cells", [])
+        else:
+            yield from ijson.items(_binary(fp), "cells.item")
+    except (ValueError, UnicodeDecodeError, AttributeError) as e:
+        raise FileParseError(f"Jupyter Notebook 파싱 실패: {e}")
+
+
+def parse_file(name: str, ext: str, fp: TextIO, max_text_chars: int) -> Tuple[Dict[str, Any], Iterator[str]]:
+    """
+    (info, units) 를 돌려줍니다. units 는 청크로 묶을 텍스트 조각(줄, CSV 행, 노트북 셀)의 지연 iterator 이고,
+    info 는 units 를 끝까지 소비한 뒤에 완성됩니다. 마지막에 build_result(info) 로 응답 dict 를 만드세요.
+    """
+    ext = ext.lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise UnsupportedFileType(f"지원하지 않는 파일 형식: {ext}")
+    info: Dict[str, Any] = {"filename": name, "extension": ext}
+
+    if ext in TEXT_EXTENSIONS:
+        capture = _Capture(max_text_chars)
+        info.update(type="code", capture=capture, line_count=0)
+
+        def units():
+            for line in fp:
+                capture.add(line)
+                info["line_count"] += 1
+                yield line.rstrip("\n")
+        return info, units()
+
+    if ext == "csv":
+        info.update(type="csv", header=[], sample_rows=[], row_count=0)
+
+        def units():
+            reader = csv.reader(fp)
+            for row in reader:
+                info["row_count"] += 1  # 기존과 같이 헤더를 포함한 행 수
+                if info["row_count"] == 1:
+                    info["header"] = row
+                    continue
+                if len(info["sample_rows"]) < CSV_SAMPLE_ROWS:
+                    info["sample_rows"].append(row)
+                header = info["header"]
+                # 청크만 보고도 어떤 열의 값인지 알 수 있도록 "열: 값" 형식으로 만듭니다.
+                yield " | ".join(f"{header[i] if i < len(header) else i}: {v}" for i, v in enumerate(row))
+        return info, units()
+
+    if ext == "json":
+        capture = _Capture(PREVIEW_CHARS)
+        info.update(type="json", capture=capture, keys=None)
+
+        def units():
+            for line in _stream_json_lines(fp, info):
+                capture.add(line + "\n")
+                yield line
+        return info, units()
+
+    # ipynb
+    capture = _Capture(PREVIEW_CHARS)
+    info.update(type="notebook", capture=capture, code_cells_count=0)
+    capture.add(f"# 주피터 노트북 '{name}'의 코드 내용\n\n")
+
+    def units():
+        for cell in _stream_notebook_cells(fp):
+            source = cell.get("source", [])
+            source = "".join(source) if isinstance(source, list) else str(source)
+            cell_type = cell.get("cell_type")
+            if cell_type == "code":
+                if info["code_cells_count"]:
+                    capture.add("\n")
+                info["code_cells_count"] += 1
+                capture.add(source)
+            if source.strip() and cell_type in ("code", "markdown"):
+                yield f"[{cell_type}]\n{source}"
+    return info, units()
+
+
+def build_result(info: Dict[str, Any]) -> Dict[str, Any]:
+    """parse_file 의 info 로 /read-file 응답(기존 형식)을 만듭니다."""
+    name, kind = info["filename"], info["type"]
+    if kind == "code":
+        capture = info["capture"]
+        return {"filename": name, "type": "code", "text": capture.text(),
+                "line_count": info["line_count"], "truncated": capture.truncated}
+    if kind == "json":
+        return {"filename": name, "type": "json", "keys": info["keys"], "text": info["capture"].text()}
+    if kind == "notebook":
+        return {"filename": name, "type": "notebook", "code_cells_count": info["code_cells_count"],
+                "text": info["capture"].text()}
+    header, sample_rows = info["header"], info["sample_rows"]
+    csv_preview = "| " + " | ".join(header) + " |\n"
+    csv_preview += "| " + " | ".join(["---"] * len(header)) + " |\n"
+    for row in sample_rows:
+        csv_preview += "| " + " | ".join(row) + " |\n"
+    text = f"### CSV 파일 '{name}' 분석\n**총 {info['row_count']}개 행**, 헤더: {', '.join(header)}\n\n**샘플 데이터:**\n{csv_preview}"
+    return {"filename": name, "type": "csv", "text": text, "row_count": info["row_count"]}
+
+
+def chunk_units(units: Iterable[str], max_chars: int, overlap_chars: int) -> Iterator[str]:
+    """
+    텍스트 조각들을 최대 max_chars 글자의 청크로 묶습니다.
+    다음 청크는 이전 청크의 마지막 overlap_chars 글자로 시작하므로, 경계에 걸친 문장도 검색됩니다.
+    """
+    max_chars = max(1, max_chars)
+    overlap_chars = max(0, min(overlap_chars, max_chars // 2))
+    buffer = ""
+    fresh = False  # 마지막으로 내보낸 뒤 새 내용이 추가되었는지
+    for unit in units:
+        if not unit.strip():
+            continue
+        candidate = f"{buffer}\n{unit}" if buffer else unit
+        if len(candidate) <= max_chars:
+            buffer, fresh = candidate, True
+            continue
+        if fresh:
+            yield buffer
+            buffer = buffer[-overlap_chars:] if overlap_chars else ""
+        candidate = f"{buffer}\n{unit}" if buffer else unit
+        # 한 조각이 청크보다 길면 글자 단위로 잘라 냅니다.
+        sliced = False
+        while len(candidate) > max_chars:
+            yield candidate[:max_chars]
+            candidate = candidate[max_chars - overlap_chars:]
+            sliced = True
+        # 잘라 낸 뒤 남은 부분이 겹침 구간뿐이면 이미 내보낸 내용입니다.
+        buffer, fresh = candidate, not sliced or len(candidate) > overlap_chars
+    if fresh and buffer.strip():
+        yield buffer
@@ -0,0 +1,281 @@
+# --- 미디어 다운로드 작업 큐 ---
+# POST 는 작업 ID 를 바로 돌려주고, 실제 yt-dlp 다운로드 + ffmpeg 변환은 제한된 워커 풀에서 실행됩니다.
+# - 호스트별 동시 실행 수 제한 (같은 사이트에 한꺼번에 몰리지 않도록)
+#   대기열은 호스트마다 따로 두고, 빈 워커 자리가 생기면 한도에 여유가 있는 호스트의 작업을 돌아가며 꺼냅니다.
+#   (한도가 찬 호스트의 작업이 워커를 붙잡고 기다리는 동안 다른 호스트 작업이 밀리지 않도록)
+# - --progress-template / --print after_move:filepath 출력을 파싱해 진행률과 최종 경로를 얻습니다.
+# - (video_id, format, 저장 경로) 가 같은 완료 작업이 있으면 결과 파일을 바로 돌려줍니다.
+import asyncio
+import os
+import subprocess
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+from urllib.parse import urlparse
+
+import stage_timing
+
+PROGRESS_PREFIX = "PROGRESS"
+FILEPATH_PREFIX = "FILEPATH"
+TERMINAL_STATES = ("completed", "failed")
+
+
+def build_download_command(url: str, output_format: str, output_path: str) -> List[str]:
+    output_template = os.path.join(output_path, "%(id)s.%(ext)s")
+    command = [
+        "yt-dlp",
+        "--restrict-filenames",
+        "--no-overwrites",
+        "--prefer-ffmpeg",
+        "--newline", "--progress",
+        "--progress-template",
+        f"download:{PROGRESS_PREFIX} %(progress.downloaded_bytes)s %(progress.total_bytes)s "
+        "%(progress.total_bytes_estimate)s %(progress.eta)s %(progress.speed)s",
+        # 후처리(병합/변환)까지 끝난 최종 파일 경로를 한 줄로 출력합니다.
+        "--print", f"after_move:{FILEPATH_PREFIX} %(filepath)s",
+        "-o", output_template,
+    ]
+    if output_format == "mp3":
+        command.extend([
+            "-x",
+            "--audio-format", "mp3",
+            "--audio-quality", "0",
+            "--postprocessor-args", "-af loudnorm,aresample=44100,aformat=channel_layouts=stereo"
+        ])
+    else:
+        command.extend([
+            "-f", "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best",
+            "--merge-output-format", "mp4"
+        ])
+    command.append(url)
+    return command
+
+
+def _number(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None  # yt-dlp 는 모르는 값을 'NA' 로 출력합니다.
+
+
+def parse_progress_line(line: str) -> Optional[Dict[str, Any]]:
+    """'PROGRESS <받은 바이트> <전체> <추정 전체> <ETA> <속도>' 한 줄을 진행률 dict 로 바꿉니다."""
+    parts = line.strip().split()
+    if len(parts) < 6 or parts[0] != PROGRESS_PREFIX:
+        return None
+    downloaded, total, estimate, eta, speed = (_number(p) for p in parts[1:6])
+    total = total or estimate
+    return {
+        "downloaded_bytes": int(downloaded) if downloaded is not None else None,
+        "total_bytes": int(total) if total else None,
+        "percent": round(downloaded / total * 100, 1) if downloaded is not None and total else None,
+        "eta_seconds": int(eta) if eta is not None else None,
+        "speed_bps": int(speed) if speed is not None else None,
+    }
+
+
+class DownloadJob:
+    def __init__(self, url: str, output_format: str, output_path: str, dedupe_key: tuple, host: str):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.format = output_format
+        self.output_path = output_path
+        self.dedupe_key = dedupe_key
+        self.host = host
+        self.status = "queued"
+        self.progress: Dict[str, Any] = {}
+        self.file_path: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.version = 0  # 상태가 바뀔 때마다 증가 (SSE / 롱폴링용)
+        self._changed = asyncio.Event()
+
+    def touch(self):
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_change(self, since_version: int, timeout: float) -> bool:
+        if self.version != since_version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATES
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id, "url": self.url, "format": self.format, "host": self.host,
+            "status": self.status, "progress": self.progress,
+            "file_path": self.file_path, "error": self.error,
+            "created_at": self.created_at, "started_at": self.started_at, "finished_at": self.finished_at,
+            "version": self.version,
+        }
+
+
+def run_download(job: DownloadJob, on_line: Callable[[str], None]) -> int:
+    """
+    스레드에서 yt-dlp 를 실행하고 출력 줄을 하나씩 on_line 으로 넘깁니다.
+    (Windows 이벤트 루프에서도 동작하도록 asyncio subprocess 대신 Popen 을 사용합니다.)
+    """
+    os.makedirs(job.output_path, exist_ok=True)
+    command = build_download_command(job.url, job.format, job.output_path)
+    print(f"INFO: (yt-dlp) 실행 명령어: {' '.join(command)}")
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            text=True, encoding="utf-8", errors="replace", bufsize=1)
+    for line in proc.stdout:
+        on_line(line.rstrip("\n"))
+    return proc.wait()
+
+
+class DownloadJobManager:
+    def __init__(self, max_workers: int = 2, per_host_limit: int = 1, max_history: int = 200,
+                 runner: Callable[[DownloadJob, Callable[[str], None]], int] = run_download,
+                 key_fn: Optional[Callable[[str], str]] = None):
+        self.max_workers = max(1, int(max_workers))
+        self.per_host_limit = max(1, int(per_host_limit))
+        self.max_history = max_history
+        self.runner = runner
+        self.key_fn = key_fn or (lambda url: url)
+        self.jobs: Dict[str, DownloadJob] = {}
+        self._by_key: Dict[tuple, DownloadJob] = {}
+        self._pending: "OrderedDict[str, Deque[DownloadJob]]" = OrderedDict()  # 호스트 -> 대기 작업
+        self._running: Dict[str, int] = {}  # 호스트 -> 실행 중인 작업 수
+        self._tasks: Set[asyncio.Task] = set()
+        self._started = False
+
+    # --- 수명 주기 ---
+    def start(self):
+        self._started = True
+
+    async def stop(self):
+        self._started = False
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    # --- 공개 API ---
+    def submit(self, url: str, output_format: str, output_path: str) -> tuple:
+        """작업을 등록합니다. (job, 중복 여부) 를 돌려줍니다. 이벤트 루프 안에서 호출해야 합니다."""
+        if not self._started:
+            raise RuntimeError("다운로드 작업 큐가 시작되지 않았습니다.")
+        url = url.strip()
+        output_format = output_format.lower()
+        # 저장 경로가 다르면 다른 작업입니다. (다른 폴더를 요청했는데 엉뚱한 곳의 파일을 돌려주지 않도록)
+        dedupe_key = (self.key_fn(url), output_format, os.path.normcase(os.path.abspath(output_path)))
+        existing = self._by_key.get(dedupe_key)
+        if existing is not None:
+            # 진행 중인 작업이거나, 파일이 아직 남아 있는 완료 작업이면 그대로 재사용합니다.
+            if not existing.done or (existing.status == "completed" and existing.file_path and os.path.exists(existing.file_path)):
+                return existing, True
+
+        job = DownloadJob(url, output_format, output_path, dedupe_key, urlparse(url).netloc or "unknown")
+        self.jobs[job.id] = job
+        self._by_key[dedupe_key] = job
+        self._pending.setdefault(job.host, deque()).append(job)
+        self._trim_history()
+        self._dispatch()
+        return job, False
+
+    def get(self, job_id: str) -> Optional[DownloadJob]:
+        return self.jobs.get(job_id)
+
+    def stats(self) -> dict:
+        counts: Dict[str, int] = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "max_workers": self.max_workers, "per_host_limit": self.per_host_limit,
+            "queue_depth": sum(len(jobs) for jobs in self._pending.values()),
+            "jobs": counts,
+        }
+
+    # --- 내부 ---
+    def _trim_history(self):
+        finished = [job for job in self.jobs.values() if job.done]
+        overflow = len(self.jobs) - self.max_history
+        for job in sorted(finished, key=lambda j: j.finished_at or 0)[:max(0, overflow)]:
+            self.jobs.pop(job.id, None)
+            if self._by_key.get(job.dedupe_key) is job:
+                self._by_key.pop(job.dedupe_key, None)
+
+    def _dispatch(self):
+        """빈 워커 자리마다 호스트 한도에 여유가 있는 대기 작업을 꺼내 실행합니다. 호스트는 돌아가며 고릅니다."""
+        while len(self._tasks) < self.max_workers:
+            host = next((h for h, jobs in self._pending.items()
+                         if jobs and self._running.get(h, 0) < self.per_host_limit), None)
+            if host is None:
+                return
+            job = self._pending[host].popleft()
+            if self._pending[host]:
+                self._pending.move_to_end(host)
+            else:
+                del self._pending[host]
+            self._running[host] = self._running.get(host, 0) + 1
+            task = asyncio.get_running_loop().create_task(self._run_slot(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_slot(self, job: DownloadJob):
+        try:
+            await self._run(job)
+        finally:
+            self._running[job.host] -= 1
+            if not self._running[job.host]:
+                del self._running[job.host]
+            self._tasks.discard(asyncio.current_task())
+            if self._started:
+                self._dispatch()
+
+    async def _run(self, job: DownloadJob):
+        loop = asyncio.get_running_loop()
+        job.status, job.started_at = "running", time.time()
+        job.touch()
+        tail: List[str] = []
+
+        def on_line(line: str):
+            # 워커 스레드에서 호출되므로, 상태 변경은 이벤트 루프로 넘겨서 처리합니다.
+            loop.call_soon_threadsafe(self._handle_line, job, line, tail)
+
+        try:
+            with stage_timing.stage("download"):
+                returncode = await asyncio.to_thread(self.runner, job, on_line)
+            await asyncio.sleep(0)  # call_soon_threadsafe 로 넘긴 마지막 줄들이 처리되도록 양보
+            if returncode != 0:
+                raise RuntimeError(f"yt-dlp 오류 (코드 {returncode}): " + "\n".join(tail[-20:]))
+            if not job.file_path:
+                raise FileNotFoundError("다운로드된 파일의 최종 경로를 출력에서 찾을 수 없습니다.")
+            job.file_path = os.path.abspath(job.file_path).replace("\\", "/")
+            job.status = "completed"
+            if job.progress.get("total_bytes"):
+                job.progress.update(percent=100.0, eta_seconds=0)
+            print(f"✅ (yt-dlp) 다운로드 완료: {job.file_path}")
+        except Exception as e:
+            job.status, job.error = "failed", str(e)
+            print(f"ERROR: (yt-dlp) 다운로드 실패 ({job.url}): {e}")
+        finally:
+            job.finished_at = time.time()
+            job.touch()
+
+    def _handle_line(self, job: DownloadJob, line: str, tail: List[str]):
+        if line.startswith(FILEPATH_PREFIX + " "):
+            job.file_path = line[len(FILEPATH_PREFIX) + 1:].strip()
+            job.touch()
+            return
+        progress = parse_progress_line(line)
+        if progress is not None:
+            job.progress = progress
+            job.touch()
+            return
+        tail.append(line)
+        del tail[:-50]  # 오류 메시지용으로 마지막 몇 줄만 보관
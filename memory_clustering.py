@@ -0,0 +1,130 @@
+# --- 기억 클러스터링 ---
+# LanceDB 의 vector 컬럼을 float32 행렬로 바로 읽어 군집화하고, 중심점(centroid)과 라벨을 디스크에 보관합니다.
+# - full: 전체 벡터로 KMeans 를 새로 학습
+# - incremental: 지난 실행 이후 추가된 벡터만 MiniBatchKMeans 갱신 규칙(누적 개수 가중 평균)으로 반영하고 라벨을 배정
+# - auto_k: 표본에 대한 silhouette 점수로 클러스터 개수를 고릅니다.
+import json
+import os
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class ClusterState:
+    """중심점과 {id: label} 매핑을 디렉터리에 저장/로드합니다."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.centroids: Optional[np.ndarray] = None
+        self.labels: Dict[int, int] = {}
+        self.meta: Dict = {}
+        self.minibatch_counts: Optional[np.ndarray] = None  # 미니배치 갱신을 이어가기 위한 클러스터별 누적 샘플 수
+
+    @property
+    def _centroids_path(self) -> str:
+        return os.path.join(self.directory, "centroids.npy")
+
+    @property
+    def _state_path(self) -> str:
+        return os.path.join(self.directory, "state.json")
+
+    def load(self) -> bool:
+        try:
+            self.centroids = np.load(self._centroids_path).astype(np.float32)
+            with open(self._state_path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (FileNotFoundError, ValueError, OSError):
+            return False
+        self.labels = {int(k): int(v) for k, v in payload.get("labels", {}).items()}
+        counts = payload.get("counts")
+        self.minibatch_counts = np.asarray(counts, dtype=np.float64) if counts is not None else None
+        self.meta = payload.get("meta", {})
+        return True
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        np.save(self._centroids_path, self.centroids)
+        tmp_path = self._state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "labels": {str(k): v for k, v in self.labels.items()},
+                "counts": self.minibatch_counts.tolist() if self.minibatch_counts is not None else None,
+                "meta": self.meta,
+            }, f)
+        os.replace(tmp_path, self._state_path)
+
+
+def choose_k(vectors: np.ndarray, k_min: int, k_max: int, sample_size: int, random_state: int = 0) -> tuple:
+    """표본에 대해 k 후보마다 MiniBatchKMeans 를 돌리고 silhouette 점수가 가장 높은 k 를 고릅니다."""
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.metrics import silhouette_score
+
+    rng = np.random.default_rng(random_state)
+    sample = vectors[rng.choice(len(vectors), size=min(sample_size, len(vectors)), replace=False)]
+    scores = {}
+    for k in range(max(2, k_min), min(k_max, len(sample) - 1) + 1):
+        labels = MiniBatchKMeans(n_clusters=k, random_state=random_state, n_init=3).fit_predict(sample)
+        if len(set(labels)) > 1:
+            scores[k] = float(silhouette_score(sample, labels, metric="cosine"))
+    if not scores:
+        return max(1, min(k_min, len(vectors))), {}
+    return max(scores, key=scores.get), scores
+
+
+def fit_full(state: ClusterState, ids: np.ndarray, vectors: np.ndarray, k: int, random_state: int = 0):
+    """전체 벡터로 새로 학습합니다. 데이터가 크면 MiniBatchKMeans, 작으면 KMeans 를 사용합니다."""
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+
+    if len(vectors) > 20000:
+        model = MiniBatchKMeans(n_clusters=k, random_state=random_state, n_init=3).fit(vectors)
+    else:
+        model = KMeans(n_clusters=k, random_state=random_state, n_init='auto').fit(vectors)
+    # 증분 갱신에 필요한 클러스터별 샘플 수는 최종 라벨에서 바로 셉니다.
+    counts = np.bincount(model.labels_, minlength=k).astype(np.float64)
+    state.centroids = model.cluster_centers_.astype(np.float32)
+    state.minibatch_counts = counts
+    state.labels = dict(zip(ids.tolist(), model.labels_.tolist()))
+
+
+def update_incremental(state: ClusterState, ids: np.ndarray, vectors: np.ndarray, update_centroids: bool = True) -> int:
+    """
+    지난 실행 이후 새로 생긴 id 만 처리합니다. 중심점을 이어서 갱신한 뒤 새 벡터에 라벨을 배정하고,
+    더 이상 없는 id 는 매핑에서 뺍니다. 새로 배정한 개수를 돌려줍니다.
+    """
+    present = set(ids.tolist())
+    state.labels = {id_: label for id_, label in state.labels.items() if id_ in present}
+    new_mask = np.fromiter((id_ not in state.labels for id_ in ids.tolist()), dtype=bool, count=len(ids))
+    if not new_mask.any():
+        return 0
+    new_ids, new_vectors = ids[new_mask], vectors[new_mask]
+
+    if update_centroids:
+        # sklearn 의 MiniBatchKMeans 갱신 규칙을 그대로 따릅니다: 중심점 c 는 새 샘플의 평균 쪽으로 n_new / (n_old + n_new) 만큼 이동
+        k = state.centroids.shape[0]
+        counts = state.minibatch_counts if state.minibatch_counts is not None and len(state.minibatch_counts) == k else np.ones(k)
+        assigned = _nearest(state.centroids, new_vectors)
+        for c in range(k):
+            members = new_vectors[assigned == c]
+            if len(members):
+                total = counts[c] + len(members)
+                state.centroids[c] = (state.centroids[c] * counts[c] + members.sum(axis=0)) / total
+                counts[c] = total
+        state.minibatch_counts = counts
+
+    for id_, label in zip(new_ids.tolist(), _nearest(state.centroids, new_vectors).tolist()):
+        state.labels[id_] = label
+    return int(new_mask.sum())
+
+
+def _nearest(centroids: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2 에서 |x|^2 는 모든 c 에 공통이므로 생략
+    distances = -2.0 * vectors @ centroids.T + (centroids ** 2).sum(axis=1)
+    return distances.argmin(axis=1)
+
+
+def stamp(state: ClusterState, mode: str, table_name: str, dim: int, extra: Optional[Dict] = None):
+    state.meta = {
+        "mode": mode, "table": table_name, "dim": dim,
+        "k": int(state.centroids.shape[0]), "last_run": time.time(), **(extra or {}),
+    }
@@ -0,0 +1,99 @@
+# --- 중복에 가까운 기억 묶기 / MMR 다양화 ---
+# Node 서버가 대화 요약마다 /add 를 호출하므로 거의 같은 요약이 계속 쌓입니다.
+#   - 중복 쌍 찾기는 서버가 벡터 인덱스(ANN)로 각 기억의 이웃 몇 개만 보고 cos >= threshold 인 쌍을 모읍니다. (O(n²) 전체 비교 없음)
+#   - 이 모듈은 그 쌍을 union-find 로 묶고, 그룹마다 대표(canonical) 기억을 고릅니다.
+#     A~B, B~C 처럼 사슬로만 이어진 그룹은 A 와 C 가 전혀 다를 수 있으므로, 대표와 직접 threshold 이상인 기억만 남깁니다.
+#   - mmr 은 검색 후보를 "질의와 가깝지만 이미 고른 결과와는 덜 겹치게" 다시 고릅니다.
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+CANONICAL_RULES = ("oldest", "longest")
+
+
+class UnionFind:
+    def __init__(self):
+        self._parent: Dict[int, int] = {}
+
+    def find(self, x: int) -> int:
+        parent = self._parent
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]  # 경로 절반 압축
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self._parent[max(ra, rb)] = min(ra, rb)
+
+    def groups(self) -> List[List[int]]:
+        members: Dict[int, List[int]] = {}
+        for x in self._parent:
+            members.setdefault(self.find(x), []).append(x)
+        return [sorted(ids) for ids in members.values() if len(ids) > 1]
+
+
+def canonical_key(rule: str, texts: Dict[int, str]) -> Callable[[int], tuple]:
+    """대표를 고르는 정렬 키. oldest: 가장 작은 id / longest: 가장 긴 본문 (같으면 작은 id)."""
+    if rule == "oldest":
+        return lambda id_: (id_,)
+    if rule == "longest":
+        return lambda id_: (-len(texts.get(id_) or ""), id_)
+    raise ValueError(f"canonical 은 {', '.join(CANONICAL_RULES)} 중 하나여야 합니다.")
+
+
+def group_pairs(pairs: Iterable[Tuple[int, int, float]], vectors: Dict[int, np.ndarray], threshold: float,
+                key: Callable[[int], tuple]) -> List[Dict[str, object]]:
+    """
+    (id, id, 점수) 쌍을 그룹으로 묶습니다. 그룹마다 key 가 가장 작은 기억이 대표이고,
+    대표와의 코사인 유사도가 threshold 이상인 기억만 duplicate 로 남깁니다. (남은 것이 없으면 그룹에서 빠짐)
+    """
+    uf = UnionFind()
+    for a, b, _ in pairs:
+        uf.union(a, b)
+    groups = []
+    for ids in uf.groups():
+        canonical = min(ids, key=key)
+        anchor = vectors[canonical]
+        members = [(id_, float(vectors[id_] @ anchor)) for id_ in ids if id_ != canonical]
+        members = [(id_, score) for id_, score in members if score >= threshold]
+        if members:
+            groups.append({
+                "canonical_id": canonical,
+                "duplicate_ids": [id_ for id_, _ in members],
+                "min_score": round(min(score for _, score in members), 4),
+            })
+    groups.sort(key=lambda group: group["canonical_id"])
+    return groups
+
+
+def mapping(groups: Sequence[Dict[str, object]]) -> Dict[int, int]:
+    """{중복 기억 id: 대표 기억 id}"""
+    return {dup: group["canonical_id"] for group in groups for dup in group["duplicate_ids"]}
+
+
+def mmr(vectors: np.ndarray, relevance: Sequence[float], k: int, lambda_: float) -> List[int]:
+    """
+    Maximal Marginal Relevance. 매번 lambda * 관련도 - (1 - lambda) * (이미 고른 것과의 최대 유사도) 가 가장 큰 후보를 고릅니다.
+    lambda 가 1 이면 관련도 순서 그대로, 작을수록 서로 다른 결과를 선호합니다. 고른 후보의 위치 목록을 돌려줍니다.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    count = vectors.shape[0]
+    k = min(k, count)
+    if k <= 0:
+        return []
+    relevance = np.asarray(relevance, dtype=np.float32)
+    similarity = vectors @ vectors.T
+    redundancy = np.full(count, -np.inf, dtype=np.float32)
+    picked: List[int] = []
+    available = np.ones(count, dtype=bool)
+    for _ in range(k):
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        scores = np.where(available, lambda_ * relevance - (1.0 - lambda_) * penalty, -np.inf)
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return picked
@@ -0,0 +1,101 @@
+# --- 기억 전문(full-text) 인덱스 ---
+# LanceDB 벡터 옆에 SQLite FTS5 인덱스를 두고 BM25 로 검색합니다. (정확한 이름, 날짜, 드문 단어 보완용)
+# 한국어는 형태소 분석기 없이도 조사가 붙은 단어를 찾을 수 있도록, 한글 구간을 글자 2-gram 으로 쪼개 색인합니다.
+#   "서울에서 만났다" -> 서울 울에 에서 만났 났다
+# 색인 토큰은 미리 만들어 저장하고, FTS5 의 unicode61 토크나이저는 공백으로만 나누게 됩니다.
+import re
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import db_access
+import stage_timing
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_HANGUL_SPLIT = re.compile(r"[가-힣]+|[^가-힣]+")
+
+
+def _is_hangul(part: str) -> bool:
+    return "가" <= part[0] <= "힣"
+
+
+def tokenize(text: str) -> List[str]:
+    """색인/질의에 공통으로 쓰는 토큰화. 한글은 2-gram, 나머지는 소문자 단어."""
+    tokens: List[str] = []
+    for word in _WORD.findall(unicodedata.normalize("NFKC", text or "").lower()):
+        for part in _HANGUL_SPLIT.findall(word):
+            if _is_hangul(part) and len(part) > 1:
+                tokens.extend(part[i:i + 2] for i in range(len(part) - 1))
+            else:
+                tokens.append(part)
+    return tokens
+
+
+def _match_expression(query: str) -> Optional[str]:
+    # 각 토큰을 따옴표로 감싸 FTS5 연산자(AND, NEAR, * 등)로 해석되지 않게 하고 OR 로 묶습니다.
+    unique = list(dict.fromkeys(tokenize(query)))
+    if not unique:
+        return None
+    return " OR ".join('"' + token.replace('"', '""') + '"' for token in unique)
+
+
+class MemoryTextIndex:
+    """memory_fts(rowid = 기억 id, tokens, text) FTS5 테이블을 관리합니다."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pool = db_access.ConnectionPool({"fts": path})
+        self._write_lock = threading.Lock()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts USING fts5("
+                "tokens, text UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+
+    def _conn(self):
+        return self._pool.connection("fts")
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT count(*) FROM memory_fts").fetchone()[0]
+
+    def upsert(self, items: Iterable[Tuple[int, str]]) -> int:
+        rows = [(int(id_), " ".join(tokenize(text)), text) for id_, text in items]
+        if not rows:
+            return 0
+        with stage_timing.stage("sqlite_write"), self._write_lock, self._conn() as conn:
+            conn.executemany("DELETE FROM memory_fts WHERE rowid = ?", [(row[0],) for row in rows])
+            conn.executemany("INSERT INTO memory_fts (rowid, tokens, text) VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def delete(self, ids: Iterable[int]) -> int:
+        params = [(int(id_),) for id_ in ids]
+        if not params:
+            return 0
+        with stage_timing.stage("sqlite_write"), self._write_lock, self._conn() as conn:
+            conn.executemany("DELETE FROM memory_fts WHERE rowid = ?", params)
+        return len(params)
+
+    def replace_all(self, items: Iterable[Tuple[int, str]]) -> int:
+        rows = [(int(id_), " ".join(tokenize(text)), text) for id_, text in items]
+        with stage_timing.stage("sqlite_write"), self._write_lock, self._conn() as conn:
+            conn.execute("DELETE FROM memory_fts")
+            conn.executemany("INSERT INTO memory_fts (rowid, tokens, text) VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def search(self, query: str, limit: int, ids: Optional[Sequence[int]] = None) -> List[Dict]:
+        """BM25 점수 순 [{id, text, score}] (score 는 클수록 관련 있음)."""
+        expression = _match_expression(query)
+        if expression is None:
+            return []
+        sql = "SELECT rowid, text, bm25(memory_fts) AS rank FROM memory_fts WHERE memory_fts MATCH ?"
+        params: list = [expression]
+        if ids:
+            sql += f" AND rowid IN ({', '.join('?' * len(ids))})"
+            params.extend(int(i) for i in ids)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(int(limit))
+        # FTS5 의 bm25() 는 관련도가 높을수록 더 작은(음수) 값을 돌려주므로 부호를 뒤집습니다.
+        return [{"id": row[0], "text": row[1], "score": -row[2]} for row in self._conn().execute(sql, params)]
+
+    def close(self):
+        self._pool.close_all()
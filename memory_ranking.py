@@ -0,0 +1,103 @@
+# --- 최신성 / 감정 강도를 반영한 기억 순위 ---
+# 검색 요청에 ranking 을 주면 서버가 후보마다
+#   score = similarity_weight * 코사인 유사도 + recency_weight * 0.5^(경과 시간 / half_life) + salience_weight * 감정 강도
+# 를 계산해 순위를 매깁니다. 감정 강도는 min(1, |sentiment_score| + emotion_weights[emotion_tag]) 입니다.
+# 가산 항목은 최대 recency_weight + salience_weight 이므로, 유사도 순으로 받은 후보 중 마지막 후보의 유사도로
+# "아직 보지 않은 기억이 얻을 수 있는 최고 점수" 를 구할 수 있고, 그 값이 현재 k 번째 점수보다 낮으면 top-k 가 확정됩니다.
+import math
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+
+def to_epoch(value: Union[None, int, float, str]) -> Optional[float]:
+    """
+    epoch 초 / ISO 8601 문자열 ("2024-05-01T12:00:00Z") / SQLite DATETIME ("2024-05-01 12:00:00") 을 epoch 초로 바꿉니다.
+    시간대가 없는 문자열은 SQLite CURRENT_TIMESTAMP 와 같이 UTC 로 봅니다. 읽을 수 없으면 ValueError.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        if not math.isfinite(value):
+            raise ValueError(f"timestamp 가 올바르지 않습니다: {value}")
+        return float(value)
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(text[:-1] + "+00:00" if text.endswith("Z") else text)
+    except ValueError:
+        raise ValueError(f"timestamp 를 읽을 수 없습니다: {value} (epoch 초 또는 ISO 8601)")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def recency(timestamps: Sequence[Optional[float]], now: float, half_life_hours: float) -> np.ndarray:
+    """0.5^(경과 시간 / half_life). 미래 시각은 1, timestamp 가 없는 기억은 0 입니다."""
+    values = np.array([np.nan if t is None else t for t in timestamps], dtype=np.float64)
+    age_hours = np.maximum(0.0, now - values) / 3600.0
+    decay = np.power(0.5, age_hours / half_life_hours)
+    return np.where(np.isnan(values), 0.0, decay)
+
+
+def salience(sentiments: Sequence[Optional[float]], tags: Sequence[Optional[str]],
+             emotion_weights: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """min(1, |sentiment_score| + emotion_weights[emotion_tag]). 값이 없으면 그 항은 0 입니다."""
+    emotion_weights = emotion_weights or {}
+    values = []
+    for sentiment, tag in zip(sentiments, tags):
+        value = min(1.0, abs(sentiment)) if sentiment is not None else 0.0
+        values.append(value + emotion_weights.get(tag, 0.0) if tag else value)
+    return np.clip(np.asarray(values, dtype=np.float64), 0.0, 1.0)
+
+
+class Ranking:
+    """검색 요청 하나의 순위 설정. 가중치는 모두 0 이상이어야 합니다."""
+
+    def __init__(self, similarity_weight: float, recency_weight: float, half_life_hours: float,
+                 salience_weight: float, emotion_weights: Optional[Dict[str, float]] = None, now: Optional[float] = None):
+        if min(similarity_weight, recency_weight, salience_weight) < 0:
+            raise ValueError("ranking 가중치는 0 이상이어야 합니다.")
+        if similarity_weight == 0:
+            raise ValueError("similarity_weight 가 0 이면 검색 결과가 질의와 무관해집니다.")
+        if not half_life_hours > 0:
+            raise ValueError("half_life_hours 는 0 보다 커야 합니다.")
+        if emotion_weights and any(not 0.0 <= w <= 1.0 for w in emotion_weights.values()):
+            raise ValueError("emotion_weights 값은 0 과 1 사이여야 합니다.")
+        self.similarity_weight = float(similarity_weight)
+        self.recency_weight = float(recency_weight)
+        self.half_life_hours = float(half_life_hours)
+        self.salience_weight = float(salience_weight)
+        self.emotion_weights = dict(emotion_weights or {})
+        self.now = time.time() if now is None else float(now)
+
+    @property
+    def max_bonus(self) -> float:
+        return self.recency_weight + self.salience_weight
+
+    def score(self, hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        hits (id, score=유사도, timestamp, emotion_tag, sentiment_score) 에 합친 점수를 매겨 내림차순으로 돌려줍니다.
+        score 는 합친 점수로 바뀌고, 원래 유사도는 similarity 에 남습니다.
+        """
+        if not hits:
+            return []
+        similarity = np.array([hit["score"] for hit in hits], dtype=np.float64)
+        rec = recency([hit.get("timestamp") for hit in hits], self.now, self.half_life_hours)
+        sal = salience([hit.get("sentiment_score") for hit in hits], [hit.get("emotion_tag") for hit in hits],
+                       self.emotion_weights)
+        blended = self.similarity_weight * similarity + self.recency_weight * rec + self.salience_weight * sal
+        ranked = [{**hit, "similarity": hit["score"], "score": float(total)} for hit, total in zip(hits, blended)]
+        ranked.sort(key=lambda hit: hit["score"], reverse=True)
+        return ranked
+
+    def settled(self, ranked: List[Dict[str, Any]], k: int, lowest_similarity: float) -> bool:
+        """유사도가 lowest_similarity 이하인 (아직 가져오지 않은) 기억이 현재 top-k 에 들 수 없으면 True."""
+        if len(ranked) < k:
+            return False
+        return self.similarity_weight * lowest_similarity + self.max_bonus < ranked[k - 1]["score"]
@@ -0,0 +1,95 @@
+# --- 자막 세그먼트 벡터 저장소 ---
+# video_id 별로 "미리 정규화된 float32 행렬 + 세그먼트 메타데이터" 를 LRU 로 보관합니다.
+# 검색은 행렬-벡터 곱 한 번과 argpartition 으로 top-k 를 고릅니다.
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_cosine(matrix: np.ndarray, query: np.ndarray, top_k: int, min_score: Optional[float] = None) -> List[tuple]:
+    """
+    행이 정규화된 matrix 와 query 의 코사인 유사도 상위 top_k 개를 (index, score) 로 돌려줍니다.
+    전체 정렬 대신 argpartition 으로 후보만 고른 뒤 그 안에서만 정렬합니다.
+    """
+    if matrix.shape[0] == 0 or top_k <= 0:
+        return []
+    scores = matrix @ normalize_rows(query.reshape(1, -1))[0]
+    k = min(top_k, scores.shape[0])
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    candidates = candidates[np.argsort(-scores[candidates])]
+    return [(int(i), float(scores[i])) for i in candidates if min_score is None or scores[i] >= min_score]
+
+
+class SegmentEntry:
+    __slots__ = ("video_id", "matrix", "segments")
+
+    def __init__(self, video_id: str, matrix: np.ndarray, segments: List[Dict[str, Any]]):
+        self.video_id = video_id
+        self.matrix = matrix
+        self.segments = segments
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+
+class SegmentStore:
+    """video_id -> SegmentEntry LRU. 영상 수와 총 바이트 두 가지로 크기를 제한합니다."""
+
+    def __init__(self, max_videos: int = 32, max_bytes: int = 256 * 1024 * 1024):
+        self.max_videos = max(1, int(max_videos))
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries: "OrderedDict[str, SegmentEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def put(self, video_id: str, vectors: np.ndarray, segments: List[Dict[str, Any]]) -> SegmentEntry:
+        entry = SegmentEntry(video_id, normalize_rows(vectors), segments)
+        with self._lock:
+            old = self._entries.pop(video_id, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[video_id] = entry
+            self._bytes += entry.nbytes
+            while len(self._entries) > self.max_videos or (self.max_bytes and self._bytes > self.max_bytes and len(self._entries) > 1):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.counters["evictions"] += 1
+        return entry
+
+    def get(self, video_id: str) -> Optional[SegmentEntry]:
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(video_id)
+            self.counters["hits"] += 1
+            return entry
+
+    def remove(self, video_id: str) -> bool:
+        with self._lock:
+            entry = self._entries.pop(video_id, None)
+            if entry is not None:
+                self._bytes -= entry.nbytes
+            return entry is not None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "videos": len(self._entries),
+                "bytes": self._bytes,
+                "max_videos": self.max_videos,
+                "max_bytes": self.max_bytes,
+                **self.counters,
+            }
@@ -20,6 +20,7 @@ const { google } = require('googleapis');
 const { formatISO, addDays, startOfDay, endOfDay } = require('date-fns');
 const cron = require('node-cron');
 const os = require('os');
+const { AsyncLocalStorage } = require('async_hooks');
 const dbManager = require('./database/db-manager');
 const vectorDBManager = require('./database/vector-db-manager');
 const videoMemoryCache = new Map();
@@ -84,6 +85,29 @@ const app = express();
 app.use(cors());
 // 2. JSON 통역기 (req.body를 읽을 수 있게 함)
 app.use(express.json({ limit: '100mb' }));
+// 2-1. 요청 추적 ID: 요청마다 X-Request-ID 를 정하고, 이 요청 안에서 Python 서버(8001)로 보내는 axios 호출에 같은 ID 를 붙입니다.
+//      느린 대화 턴을 Python 로그(WARN: [ID] 느린 요청 ...)와 /metrics 단계별 시간까지 이어서 추적할 수 있습니다.
+const requestContext = new AsyncLocalStorage();
+const SLOW_REQUEST_MS = parseInt(process.env.SLOW_REQUEST_MS || '3000', 10);
+app.use((req, res, next) => {
+    const requestId = req.get('X-Request-ID') || uuidv4().replace(/-/g, '');
+    const startedAt = Date.now();
+    res.set('X-Request-ID', requestId);
+    res.on('finish', () => {
+        const elapsed = Date.now() - startedAt;
+        if (elapsed >= SLOW_REQUEST_MS) {
+            console.warn(`[Trace] [${requestId}] 느린 요청 ${req.method} ${req.originalUrl} ${elapsed}ms`);
+        }
+    });
+    requestContext.run({ requestId }, next);
+});
+axios.interceptors.request.use((config) => {
+    const store = requestContext.getStore();
+    if (store && config.url && config.url.startsWith('http://localhost:8001')) {
+        if (!config.headers.has('X-Request-ID')) config.headers.set('X-Request-ID', store.requestId);
+    }
+    return config;
+});
 
 // 3. 정적 파일 경로 설정
 app.use(express.static(path.join(__dirname, 'public')));
@@ -540,13 +564,14 @@ async function youtubeVideoAssistant({ query, summarize = true, display = true }
 async function downloadMediaFromUrl({ url, format = "mp4" }) {
   console.log(`[Media Butler Tool] AI가 미디어 다운로드 요청. Node.js API를 호출합니다.`);
   try {
+    // 다운로드는 백그라운드 작업으로 실행되므로 완료를 기다리지 않고 작업 링크를 바로 돌려줍니다.
     const response = await axios.post("http://localhost:3333/api/download-media", {
       url,
       format,
     });
 
-    if (response.data && response.data.public_url) {
-      return `다운로드를 완료했습니다. 아래 링크에서 확인하세요:\n[다운로드 링크](${response.data.public_url})`;
+    if (response.data && response.data.file_url) {
+      return `다운로드를 시작했습니다. 완료되면 아래 링크에서 받을 수 있습니다:\n[다운로드 링크](${response.data.file_url})`;
     } else {
       throw new Error(response.data.error || "API로부터 유효한 응답을 받지 못했습니다.");
     }
@@ -557,7 +582,21 @@ async function downloadMediaFromUrl({ url, format = "mp4" }) {
   }
 }
 
+// 파이썬 작업 상태에 공개 URL / 조회 경로를 붙입니다.
+function toDownloadJobResponse(job) {
+  const base = `/api/download-media/jobs/${job.job_id}`;
+  return {
+    ...job,
+    public_url: job.status === "completed" && job.file_path ? `/downloads/${path.basename(job.file_path)}` : null,
+    status_url: base,
+    events_url: `${base}/events`,
+    file_url: `${base}/file`,
+  };
+}
+
 // 다운로드 총괄 API 엔드포인트 
+// 파이썬 서버에 작업을 등록하고 작업 ID 를 바로 돌려줍니다 (202).
+// 진행 상황은 status_url (폴링) 또는 events_url (SSE) 로, 결과 파일은 file_url 로 받습니다.
 app.post(["/api/download-media", "/download-media"], async (req, res) => {
   const { url, format } = req.body || {};
   if (!url) return res.status(400).json({ error: "URL이 필요합니다." });
@@ -566,23 +605,15 @@ app.post(["/api/download-media", "/download-media"], async (req, res) => {
   const downloadFolderPath = path.join(process.cwd(), "public", "downloads");
 
   try {
-    const pyResponse = await axios.post("http://localhost:8001/download-media", {
+    const pyResponse = await axios.post("http://localhost:8001/jobs/download", {
       url,
       format: format || "mp4",
       output_path: downloadFolderPath,
     });
 
-    const { file_path } = pyResponse.data;
-    if (!file_path) throw new Error("파이썬 서버가 파일 경로를 반환하지 않았습니다.");
-
-    const fileName = path.basename(file_path);
-    const publicUrl = `/downloads/${fileName}`;
-
-    console.log(`[Node API] 다운로드 성공. 공개 URL: ${publicUrl}`);
-    res.json({
-      message: "다운로드 성공",
-      public_url: publicUrl,
-    });
+    const job = toDownloadJobResponse(pyResponse.data);
+    console.log(`[Node API] 다운로드 작업 ${job.deduplicated ? "재사용" : "등록"}: ${job.job_id} (${job.status})`);
+    res.status(202).json({ message: "다운로드 작업 등록", ...job });
   } catch (error) {
     const detail =
       error.response?.data?.detail || error.response?.data?.error || error.message;
@@ -593,6 +624,48 @@ app.post(["/api/download-media", "/download-media"], async (req, res) => {
   }
 });
 
+// 작업 상태 조회 (wait_version 을 주면 상태가 바뀔 때까지 기다리는 롱폴링)
+app.get("/api/download-media/jobs/:jobId", async (req, res) => {
+  try {
+    const pyResponse = await axios.get(`http://localhost:8001/jobs/${encodeURIComponent(req.params.jobId)}`, {
+      params: { wait_version: req.query.wait_version, timeout: req.query.timeout },
+    });
+    res.json(toDownloadJobResponse(pyResponse.data));
+  } catch (error) {
+    const detail = error.response?.data?.detail || error.message;
+    res.status(error.response?.status || 500).json({ error: detail });
+  }
+});
+
+// 작업 진행 상황 SSE 중계
+app.get("/api/download-media/jobs/:jobId/events", async (req, res) => {
+  try {
+    const pyResponse = await axios.get(`http://localhost:8001/jobs/${encodeURIComponent(req.params.jobId)}/events`, {
+      responseType: "stream",
+    });
+    res.set({ "Content-Type": "text/event-stream", "Cache-Control": "no-cache", Connection: "keep-alive" });
+    res.flushHeaders();
+    pyResponse.data.pipe(res);
+    req.on("close", () => pyResponse.data.destroy());
+  } catch (error) {
+    res.status(error.response?.status || 500).json({ error: error.message });
+  }
+});
+
+// 결과 파일: 완료되면 공개 URL 로 이동하고, 아직이면 현재 상태를 202 로 돌려줍니다.
+app.get("/api/download-media/jobs/:jobId/file", async (req, res) => {
+  try {
+    const pyResponse = await axios.get(`http://localhost:8001/jobs/${encodeURIComponent(req.params.jobId)}`);
+    const job = toDownloadJobResponse(pyResponse.data);
+    if (job.public_url) return res.redirect(job.public_url);
+    if (job.status === "failed") return res.status(500).json({ message: "미디어 다운로드 실패", error: job.error });
+    res.status(202).json({ message: "다운로드 진행 중입니다. 잠시 후 다시 열어 주세요.", ...job });
+  } catch (error) {
+    const detail = error.response?.data?.detail || error.message;
+    res.status(error.response?.status || 500).json({ error: detail });
+  }
+});
+
 // 모든 파일의 내용을 읽어 파이썬으로 보내는 API 
 app.post("/api/read-file", upload.single("file"), async (req, res) => {
     if (!req.file) {
@@ -606,15 +679,14 @@ app.post("/api/read-file", upload.single("file"), async (req, res) => {
     console.log(`[File Reader] 파일 수신: ${fileName} (임시 경로: ${filePath})`);
 
     try {
-        // 파일을 텍스트로 읽습니다. (UTF-8 인코딩)
-        const content = await fs.readFile(filePath, "utf8");
-
-        // 파이썬 서버의 /read-file 엔드포인트로 전달합니다.
-        console.log(`[File Reader] 파이썬 서버로 파일 내용 전달 중... (확장자: ${ext})`);
-        const pyResponse = await axios.post("http://localhost:8001/read-file", {
-            filename: fileName,
-            extension: ext,
-            content: content,
+        // 파일 전체를 문자열로 읽지 않고, 원본 바이트를 그대로 파이썬 서버에 스트리밍합니다.
+        // (파이썬 서버가 줄 단위로 파싱하고, 내용을 청크로 나눠 의미 검색용으로 인덱싱합니다.)
+        console.log(`[File Reader] 파이썬 서버로 파일 스트리밍 중... (확장자: ${ext})`);
+        const pyResponse = await axios.post("http://localhost:8001/files/upload", fsSync.createReadStream(filePath), {
+            params: { filename: fileName, extension: ext },
+            headers: { "Content-Type": "application/octet-stream" },
+            maxBodyLength: Infinity,
+            maxContentLength: Infinity,
         });
 
         // 파이썬 서버의 응답을 프론트엔드로 그대로 전달합니다.
@@ -1233,7 +1305,7 @@ async function saveMemory(conversationHistory, chatId, genAI, mainModelName) {
         }
 
         // 2-2. 받은 ID와 텍스트로 Python 서버에 벡터 저장을 요청합니다.
-        await vectorDBManager.addMemory(memoryId, summaryText);
+        await vectorDBManager.addMemory(memoryId, summaryText, { timestamp: newMemory.timestamp });
         
         console.log(`[DB 동기화 저장] Memory ID ${memoryId}를 SQLite와 VectorDB에 모두 성공적으로 저장했습니다.`);
 
@@ -1861,13 +1933,23 @@ async function enrichMemoryAndProfile() {
         // 3-1. long_term_memory 테이블 업데이트 (고도화 완료!)
         if (analysisResult.enriched_memories && Array.isArray(analysisResult.enriched_memories)) {
             let updatedCount = 0;
+            const vectorUpdates = [];
             for (const enrichedMem of analysisResult.enriched_memories) {
                 if (enrichedMem.id && enrichedMem.keywords) {
                     dbManager.updateMemoryMetadata(enrichedMem.id, enrichedMem.keywords, enrichedMem.sentiment);
                     updatedCount++;
+                    // VectorDB 에도 감정 정보를 넘겨 검색 순위(salience)에 쓰이게 합니다. (내용이 같으면 벡터는 캐시에서 재사용)
+                    const original = yesterdayMemories.find(mem => mem.id === enrichedMem.id);
+                    const sentiment = vectorDBManager.sentimentMetadata(enrichedMem.sentiment);
+                    if (original && Object.keys(sentiment).length > 0) {
+                        vectorUpdates.push({ id: original.id, text: original.summary, ...sentiment });
+                    }
                 }
             }
             console.log(`[Memory Profiler] ${updatedCount}개의 기억에 메타데이터를 성공적으로 업데이트했습니다.`);
+            if (vectorUpdates.length > 0) {
+                await vectorDBManager.addMemoriesBatch(vectorUpdates);
+            }
         }
 
         // 3-2. user_profile 테이블 업데이트
@@ -2024,7 +2106,9 @@ app.post('/api/chat', async (req, res) => {
         try {
             // 1. SQLite에서 모든 텍스트 기억 가져오기 (ID와 요약문만)
             const allMemories = dbManager.getAllMemories();
-            const memoriesForVectorDB = allMemories.map(m => ({ id: m.id, text: m.summary }));
+            const memoriesForVectorDB = allMemories.map(m => ({
+                id: m.id, text: m.summary, timestamp: m.timestamp, ...vectorDBManager.sentimentMetadata(m.sentiment)
+            }));
 
             // 2. Python 서버에 보내서 VectorDB 재구축 요청 (시간이 걸릴 수 있음)
             await vectorDBManager.rebuildVectorDB(memoriesForVectorDB);
@@ -2385,7 +2469,7 @@ Analyze the user's request and call the most appropriate tool with the correct p
                 if (typeof functionResult === 'string' && functionResult.startsWith('[TIMELINE_DATA]:::')) {
                     const jsonData = functionResult.split(':::')[1];
                     finalReply = { type: 'youtube_timeline', data: JSON.parse(jsonData) };
-                } else if (name === 'downloadMediaFromUrl' && functionResult.includes('다운로드를 완료했습니다')) {
+                } else if (name === 'downloadMediaFromUrl' && functionResult.includes('다운로드를 시작했습니다')) {
                     finalReply = { type: 'text', text: functionResult };
                 } else {
                     const functionResponse = {
@@ -2843,20 +2927,21 @@ async function runMemoryGardenerProcess() {
 
     // --- 2. 의미 클러스터링 ---
     console.log('[Memory Gardener] STEP 2: 모든 기억의 의미 클러스터링을 시작합니다.');
+    const pythonReadiness = await vectorDBManager.getPythonReadiness();
     if (allMemories.length < 10) {
         console.log(`[Memory Gardener] 기억이 ${allMemories.length}개 뿐이므로, 클러스터링을 건너뜁니다.`);
+    } else if (!pythonReadiness.ready) {
+        console.log('[Memory Gardener] Python 서버의 모델/벡터 DB가 아직 준비되지 않아 클러스터링을 건너뜁니다.');
     } else {
         try {
-            const allVectors = await vectorDBManager.getAllVectors();
-            if (allVectors.length !== allMemories.length) throw new Error("DB 기억 수와 VectorDB 벡터 수가 일치하지 않습니다.");
-            
+            // 벡터를 주고받지 않고, Python 서버가 저장된 벡터로 직접 군집화해 {기억 id: 클러스터 번호} 를 돌려줍니다.
             const CLUSTER_COUNT = 5;
-            const clusterResponse = await axios.post('http://localhost:8001/cluster', { vectors: allVectors, num_clusters: CLUSTER_COUNT });
+            const clusterResponse = await axios.post('http://localhost:8001/cluster_memories', { num_clusters: CLUSTER_COUNT, mode: 'full', include_centroids: false });
             const labels = clusterResponse.data.labels;
 
             // (3) 각 클러스터의 주제를 AI에게 물어봐서 이름을 붙여줍니다. (✨ 이 부분이 수정됩니다)
         for (let i = 0; i < CLUSTER_COUNT; i++) {
-            const clusterMemories = allMemories.filter((mem, index) => labels[index] === i);
+            const clusterMemories = allMemories.filter(mem => labels[mem.id] === i);
             if (clusterMemories.length === 0) continue;
 
             const summariesForNaming = clusterMemories.map(m => `- ${m.summary}`).join('\n');
@@ -2895,7 +2980,9 @@ async function runMemoryGardenerProcess() {
         }
         
         // (5) 각 기억이 몇 번 클러스터에 속하는지 long_term_memory 테이블에 업데이트합니다.
-            const memoryUpdates = allMemories.map((mem, i) => ({ id: mem.id, cluster_id: labels[i] }));
+            const memoryUpdates = allMemories
+                .filter(mem => labels[mem.id] !== undefined)
+                .map(mem => ({ id: mem.id, cluster_id: labels[mem.id] }));
             dbManager.batchUpdateMemoryClusterIds(memoryUpdates);
         } catch (error) {
             console.error('[Memory Gardener] 의미 클러스터링 중 오류:', error.message);
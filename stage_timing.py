@@ -0,0 +1,79 @@
+# --- 요청 단계별 소요 시간 ---
+# 요청마다 {단계 이름: 누적 ms} dict 를 contextvar 로 들고 다니며, encode / search / cluster 같은 구간을 잽니다.
+# asyncio.to_thread 는 contextvar 를 복사해 가므로 스레드에서 실행되는 검색 구간도 같은 dict 에 기록됩니다.
+# 미들웨어가 결과를 Server-Timing 헤더로 내보내며, 벤치마크(benchmarks/)가 이 헤더로 단계별 시간을 나눕니다.
+# 요청 밖(백그라운드 작업, 인코더 워커)의 구간도 add_observer 로 등록한 콜백(metrics)에는 전달됩니다.
+# 요청 추적 ID(X-Request-ID)도 같은 방식으로 들고 다니며, log() 로 찍는 서버 로그 앞에 붙입니다.
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+_current: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("stage_timings", default=None)
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_observers: List[Callable[[str, float], None]] = []
+
+
+def add_observer(callback: Callable[[str, float], None]):
+    """모든 구간이 끝날 때마다 callback(단계 이름, ms) 를 호출합니다."""
+    _observers.append(callback)
+
+
+def begin(request_id: Optional[str] = None) -> tuple:
+    """새 요청의 측정을 시작합니다. (stages dict, 되돌릴 토큰) 을 돌려줍니다."""
+    stages: Dict[str, float] = {}
+    return stages, (_current.set(stages), _request_id.set(request_id))
+
+
+def end(token):
+    stages_token, request_id_token = token
+    _current.reset(stages_token)
+    _request_id.reset(request_id_token)
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def log(level: str, message: str):
+    """'LEVEL: [요청 ID] 메시지' 형식으로 출력합니다. 요청 밖이면 ID 없이 'LEVEL: 메시지' 입니다."""
+    request_id = _request_id.get()
+    print(f"{level}: [{request_id}] {message}" if request_id else f"{level}: {message}")
+
+
+@contextmanager
+def stage(name: str):
+    stages = _current.get()
+    if stages is None and not _observers:  # 요청 밖이고 메트릭도 없으면 잴 필요가 없습니다.
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        if stages is not None:
+            stages[name] = stages.get(name, 0.0) + elapsed
+        for observer in _observers:
+            observer(name, elapsed)
+
+
+def server_timing_header(stages: Dict[str, float], total_ms: float) -> str:
+    parts = [f"{name};dur={ms:.3f}" for name, ms in stages.items()]
+    parts.append(f"total;dur={total_ms:.3f}")
+    return ", ".join(parts)
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """'encode;dur=1.2, total;dur=3.4' -> {'encode': 1.2, 'total': 3.4}"""
+    result: Dict[str, float] = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                try:
+                    result[name] = float(value)
+                except ValueError:
+                    pass
+    return result
@@ -0,0 +1,7 @@
+# 테스트는 저장소 최상위 모듈(text_chunking, memory_ranking ...)을 바로 import 합니다.
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
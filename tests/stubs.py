@@ -0,0 +1,34 @@
+# --- 테스트용 로컬 fetcher ---
+# TRANSCRIPT_FETCHER=tests.stubs:fake_fetcher 로 서버에 꽂거나, 테스트에서 TranscriptService 에 직접 넘깁니다.
+import asyncio
+from typing import Any, Dict, List
+
+from transcript_service import TranscriptNotFound
+
+MISSING_VIDEO_ID = "missing"
+
+
+class FakeFetcher:
+    """yt-dlp 대신 고정된 세그먼트를 돌려주고, 호출 횟수와 동시 실행 수를 기록합니다."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls: List[tuple] = []
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, video_id: str, languages: str) -> List[Dict[str, Any]]:
+        self.calls.append((video_id, languages))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            if video_id == MISSING_VIDEO_ID:
+                raise TranscriptNotFound("자막 없음")
+            return [{"start": 0.0, "end": 1.5, "text": f"{video_id} 첫 자막"},
+                    {"start": 1.5, "end": 3.0, "text": f"{video_id} 두 번째 자막"}]
+        finally:
+            self.running -= 1
+
+
+fake_fetcher = FakeFetcher()
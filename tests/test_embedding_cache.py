@@ -0,0 +1,34 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def test_disk_row_count_tracks_inserts_and_evictions(tmp_path):
+    cache = EmbeddingCache("model-a", max_memory_bytes=0, disk_path=str(tmp_path / "cache.sqlite3"), max_disk_rows=5)
+    cache.put_many(["a", "b", "c"], np.ones((3, 4)))
+    cache.put_many(["a", "d"], np.ones((2, 4)))
+    assert cache.stats()["disk_rows"] == 4
+
+    cache.put_many(["e", "f", "g"], np.ones((3, 4)))
+    stats = cache.stats()
+    assert stats["disk_rows"] == 5
+    assert stats["disk_evictions"] == 2
+    assert cache._disk.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 5
+
+
+def test_switching_model_key_keeps_other_rows(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    EmbeddingCache("model-a", disk_path=path).put_many(["hello"], np.ones((1, 4)))
+    EmbeddingCache("model-b", disk_path=path).put_many(["hello"], np.zeros((1, 4)))
+
+    cache = EmbeddingCache("model-a", max_memory_bytes=0, disk_path=path)
+    assert cache.stats()["disk_rows"] == 2
+    [vec] = cache.get_many(["hello"])
+    assert vec is not None and float(vec.sum()) == 4.0
+
+
+def test_memory_probe_does_not_wait_for_disk_lock(tmp_path):
+    cache = EmbeddingCache("model-a", disk_path=str(tmp_path / "cache.sqlite3"))
+    cache.put_many(["hello"], np.ones((1, 4)))
+    with cache._disk_lock:
+        assert cache.get_memory("hello") is not None
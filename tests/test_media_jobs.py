@@ -0,0 +1,88 @@
+import asyncio
+import threading
+
+import pytest
+
+import media_jobs
+from media_jobs import DownloadJobManager
+
+
+def test_parse_progress_line():
+    progress = media_jobs.parse_progress_line("PROGRESS 50 NA 200 3 1024.5")
+    assert progress == {"downloaded_bytes": 50, "total_bytes": 200, "percent": 25.0, "eta_seconds": 3, "speed_bps": 1024}
+    assert media_jobs.parse_progress_line("[download] 10%") is None
+
+
+class BlockingRunner:
+    """호스트별로 풀어 줄 때까지 멈춰 있는 가짜 yt-dlp. 실행 순서를 기록합니다."""
+
+    def __init__(self):
+        self.started = []
+        self.release = {}
+
+    def __call__(self, job, on_line):
+        self.started.append(job.url)
+        self.release.setdefault(job.host, threading.Event()).wait(5)
+        on_line(f"{media_jobs.FILEPATH_PREFIX} {job.output_path}/{job.id}.mp4")
+        return 0
+
+
+async def wait_until(predicate, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("조건을 기다리다 시간 초과")
+        await asyncio.sleep(0.01)
+
+
+def test_saturated_host_does_not_block_other_hosts(tmp_path):
+    runner = BlockingRunner()
+    for host in ("slow", "fast"):
+        runner.release[host] = threading.Event()
+    runner.release["fast"].set()
+
+    async def scenario():
+        manager = DownloadJobManager(max_workers=2, per_host_limit=1, runner=runner)
+        manager.start()
+        try:
+            slow = [manager.submit(f"http://slow/{i}", "mp4", str(tmp_path))[0] for i in range(3)]
+            fast = [manager.submit(f"http://fast/{i}", "mp4", str(tmp_path))[0] for i in range(2)]
+            # slow 호스트는 한 작업이 멈춰 있어도, 남은 워커가 fast 작업을 모두 처리해야 합니다.
+            await wait_until(lambda: all(job.done for job in fast))
+            assert [job.status for job in slow] == ["running", "queued", "queued"]
+            assert manager.stats()["queue_depth"] == 2
+            runner.release["slow"].set()
+            await wait_until(lambda: all(job.done for job in slow))
+            assert all(job.status == "completed" for job in slow + fast)
+        finally:
+            runner.release["slow"].set()
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_dedupe_key_includes_output_path(tmp_path):
+    runner = BlockingRunner()
+    runner.release["site"] = threading.Event()
+
+    async def scenario():
+        manager = DownloadJobManager(max_workers=2, per_host_limit=2, runner=runner)
+        manager.start()
+        try:
+            first, reused = manager.submit("http://site/v", "mp4", str(tmp_path / "a"))
+            assert not reused
+            assert manager.submit("http://site/v", "mp4", str(tmp_path / "a"))[0] is first
+            other, reused = manager.submit("http://site/v", "mp4", str(tmp_path / "b"))
+            assert not reused and other is not first
+            assert not manager.submit("http://site/v", "mp3", str(tmp_path / "a"))[1]
+        finally:
+            runner.release["site"].set()
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_submit_requires_start():
+    manager = DownloadJobManager()
+    with pytest.raises(RuntimeError):
+        manager.submit("http://site/v", "mp4", "out")
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import memory_consolidation
+from memory_consolidation import UnionFind
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_union_find_groups_connected_ids():
+    uf = UnionFind()
+    for a, b in [(5, 3), (3, 9), (1, 2)]:
+        uf.union(a, b)
+    uf.find(7)  # 혼자인 id 는 그룹이 아닙니다.
+    assert sorted(uf.groups()) == [[1, 2], [3, 5, 9]]
+    assert uf.find(9) == 3  # 루트는 가장 작은 id
+
+
+def test_canonical_keys():
+    texts = {1: "짧음", 2: "조금 더 긴 본문", 3: "조금 더 긴 본문"}
+    assert min(texts, key=memory_consolidation.canonical_key("oldest", texts)) == 1
+    assert min(texts, key=memory_consolidation.canonical_key("longest", texts)) == 2
+    with pytest.raises(ValueError):
+        memory_consolidation.canonical_key("newest", texts)
+
+
+def test_group_pairs_drops_chain_members_far_from_canonical():
+    # 1~2, 2~3 은 가깝지만 1 과 3 은 멉니다. (사슬) -> 대표 1 과 직접 가까운 2 만 중복
+    vectors = {1: unit(1, 0), 2: unit(1, 0.3), 3: unit(1, 0.9)}
+    pairs = [(1, 2, 0.95), (2, 3, 0.95)]
+    groups = memory_consolidation.group_pairs(pairs, vectors, 0.9, memory_consolidation.canonical_key("oldest", {}))
+    assert groups == [{"canonical_id": 1, "duplicate_ids": [2], "min_score": pytest.approx(float(vectors[2] @ vectors[1]), abs=1e-4)}]
+    assert memory_consolidation.mapping(groups) == {2: 1}
+
+
+def test_group_pairs_skips_groups_without_close_members():
+    vectors = {1: unit(1, 0), 2: unit(0, 1)}
+    groups = memory_consolidation.group_pairs([(1, 2, 0.99)], vectors, 0.9, memory_consolidation.canonical_key("oldest", {}))
+    assert groups == []
+
+
+def test_mmr_lambda_one_keeps_relevance_order():
+    vectors = np.stack([unit(1, 0), unit(1, 0.01), unit(0, 1)])
+    assert memory_consolidation.mmr(vectors, [0.9, 0.8, 0.1], k=3, lambda_=1.0) == [0, 1, 2]
+
+
+def test_mmr_prefers_diverse_results():
+    vectors = np.stack([unit(1, 0), unit(1, 0.01), unit(0, 1)])
+    assert memory_consolidation.mmr(vectors, [0.9, 0.85, 0.6], k=2, lambda_=0.5) == [0, 2]
+    assert memory_consolidation.mmr(vectors, [0.9, 0.85, 0.6], k=0, lambda_=0.5) == []
@@ -0,0 +1,20 @@
+import memory_fts
+
+
+def test_hangul_is_split_into_bigrams():
+    assert memory_fts.tokenize("서울에서 만났다") == ["서울", "울에", "에서", "만났", "났다"]
+
+
+def test_latin_words_are_lowercased_and_normalized():
+    # NFKC 로 전각 문자도 같은 토큰이 됩니다.
+    assert memory_fts.tokenize("Hello ＷＯＲＬＤ 2024") == ["hello", "world", "2024"]
+
+
+def test_mixed_word_keeps_single_hangul_and_other_parts():
+    assert memory_fts.tokenize("GPT가 좋아") == ["gpt", "가", "좋아"]
+    assert memory_fts.tokenize("") == []
+
+
+def test_match_expression_quotes_tokens():
+    assert memory_fts._match_expression('AND "x" 서울') == '"and" OR "x" OR "서울"'
+    assert memory_fts._match_expression("!!!") is None
@@ -0,0 +1,83 @@
+import pytest
+
+import memory_ranking
+from memory_ranking import Ranking
+
+NOW = 1_700_000_000.0
+HOUR = 3600.0
+
+
+def test_to_epoch_formats():
+    assert memory_ranking.to_epoch(None) is None
+    assert memory_ranking.to_epoch("") is None
+    assert memory_ranking.to_epoch(12.5) == 12.5
+    assert memory_ranking.to_epoch("12.5") == 12.5
+    assert memory_ranking.to_epoch("1970-01-01T00:01:00Z") == 60.0
+    # 시간대가 없는 SQLite DATETIME 은 UTC 로 봅니다.
+    assert memory_ranking.to_epoch("1970-01-01 00:01:00") == 60.0
+    with pytest.raises(ValueError):
+        memory_ranking.to_epoch("yesterday")
+    with pytest.raises(ValueError):
+        memory_ranking.to_epoch(float("nan"))
+
+
+def test_recency_halves_every_half_life():
+    values = memory_ranking.recency([NOW, NOW - 24 * HOUR, NOW + HOUR, None], NOW, half_life_hours=24)
+    assert values.tolist() == pytest.approx([1.0, 0.5, 1.0, 0.0])
+
+
+def test_salience_combines_sentiment_and_emotion_weight():
+    values = memory_ranking.salience([0.3, -0.9, None, 0.8], ["joy", None, "sad", "joy"], {"joy": 0.5, "sad": 0.2})
+    assert values.tolist() == pytest.approx([0.8, 0.9, 0.2, 1.0])
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"recency_weight": -0.1},
+    {"similarity_weight": 0},
+    {"half_life_hours": 0},
+    {"emotion_weights": {"joy": 1.5}},
+])
+def test_invalid_settings_raise(kwargs):
+    settings = {"similarity_weight": 1.0, "recency_weight": 0.2, "half_life_hours": 24, "salience_weight": 0.1, **kwargs}
+    with pytest.raises(ValueError):
+        Ranking(**settings)
+
+
+def test_score_blends_and_sorts():
+    ranking = Ranking(1.0, recency_weight=0.5, half_life_hours=24, salience_weight=0.0, now=NOW)
+    hits = [
+        {"id": 1, "score": 0.9, "timestamp": NOW - 240 * HOUR},
+        {"id": 2, "score": 0.8, "timestamp": NOW},
+    ]
+    ranked = ranking.score(hits)
+    assert [hit["id"] for hit in ranked] == [2, 1]
+    assert ranked[0]["similarity"] == 0.8
+    assert ranked[0]["score"] == pytest.approx(1.3)
+    assert ranking.score([]) == []
+
+
+def test_settled_bound():
+    ranking = Ranking(1.0, recency_weight=0.2, half_life_hours=24, salience_weight=0.1, now=NOW)
+    assert ranking.max_bonus == pytest.approx(0.3)
+    ranked = [{"score": 1.0}, {"score": 0.9}]
+    # 아직 보지 않은 기억은 유사도 0.5 이하 -> 최대 0.8 < 0.9 이므로 top-2 확정
+    assert ranking.settled(ranked, 2, lowest_similarity=0.5)
+    # 유사도 0.65 면 0.95 까지 가능 -> 아직 확정 아님
+    assert not ranking.settled(ranked, 2, lowest_similarity=0.65)
+    # 후보가 k 개보다 적으면 확정할 수 없음
+    assert not ranking.settled(ranked, 3, lowest_similarity=0.0)
+
+
+def test_settled_matches_exhaustive_ranking():
+    # 유사도 순으로 앞부분만 보고 확정한 top-k 가 전체를 본 top-k 와 같아야 합니다.
+    ranking = Ranking(1.0, recency_weight=0.3, half_life_hours=24, salience_weight=0.2, now=NOW)
+    hits = [{"id": i, "score": 1.0 - i * 0.02, "timestamp": NOW - (i % 7) * 12 * HOUR,
+             "sentiment_score": (i % 3) / 3} for i in range(40)]
+    full = [hit["id"] for hit in ranking.score(hits)[:5]]
+    for fetch in range(5, 41):
+        ranked = ranking.score(hits[:fetch])
+        if ranking.settled(ranked, 5, hits[fetch - 1]["score"]):
+            assert [hit["id"] for hit in ranked[:5]] == full
+            break
+    else:
+        pytest.fail("top-k 가 확정되지 않았습니다.")
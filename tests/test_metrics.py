@@ -0,0 +1,48 @@
+import pytest
+
+import metrics
+
+
+def test_counter_and_gauge_render():
+    registry = metrics.Registry()
+    requests = registry.counter("app_requests_total", "요청 수", ("route",))
+    requests.inc("/search")
+    requests.inc("/search", amount=2)
+    registry.gauge("app_rows", "행 수", callback=lambda: 7)
+    registry.gauge("app_jobs", "작업 수", ("status",), callback=lambda: {"running": 1, "queued": 2})
+    text = registry.render()
+    assert 'app_requests_total{route="/search"} 3.0' in text
+    assert "app_rows 7.0" in text
+    assert 'app_jobs{status="queued"} 2.0' in text
+    assert "# TYPE app_requests_total counter" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("lat", "지연", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 5.0):
+        histogram.observe(value, "/x")
+    lines = histogram.render()
+    assert 'lat_bucket{route="/x",le="0.1"} 1' in lines
+    assert 'lat_bucket{route="/x",le="1.0"} 3' in lines
+    assert 'lat_bucket{route="/x",le="+Inf"} 4' in lines
+    assert 'lat_count{route="/x"} 4' in lines
+    assert 'lat_sum{route="/x"} 6.25' in lines
+
+
+def test_failing_gauge_callback_is_skipped():
+    registry = metrics.Registry()
+    registry.gauge("broken", "실패", callback=lambda: 1 / 0)
+    assert registry.render().splitlines()[-1] == "# TYPE broken gauge"
+
+
+def test_duplicate_names_are_rejected():
+    registry = metrics.Registry()
+    registry.counter("dup", "a")
+    with pytest.raises(ValueError):
+        registry.gauge("dup", "b")
+
+
+def test_label_values_are_escaped():
+    counter = metrics.Counter("c", "h", ("path",))
+    counter.inc('a"b\nc')
+    assert counter.render()[-1] == 'c{path="a\\"b\\nc"} 1.0'
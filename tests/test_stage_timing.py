@@ -0,0 +1,45 @@
+import asyncio
+
+import stage_timing
+
+
+def test_stages_accumulate_per_request_including_threads():
+    async def scenario():
+        stages, token = stage_timing.begin("req-1")
+        try:
+            with stage_timing.stage("encode"):
+                pass
+            with stage_timing.stage("encode"):
+                pass
+
+            def in_thread():
+                with stage_timing.stage("search"):
+                    return stage_timing.current_request_id()
+
+            request_id = await asyncio.to_thread(in_thread)
+        finally:
+            stage_timing.end(token)
+        return stages, request_id
+
+    stages, request_id = asyncio.run(scenario())
+    assert set(stages) == {"encode", "search"}
+    assert request_id == "req-1"
+    assert stage_timing.current_request_id() is None
+
+
+def test_server_timing_round_trip():
+    header = stage_timing.server_timing_header({"encode": 1.5, "search": 2.25}, 4.0)
+    assert header == "encode;dur=1.500, search;dur=2.250, total;dur=4.000"
+    assert stage_timing.parse_server_timing(header) == {"encode": 1.5, "search": 2.25, "total": 4.0}
+    assert stage_timing.parse_server_timing("bad;dur=x, ok;desc=y;dur=3") == {"ok": 3.0}
+    assert stage_timing.parse_server_timing(None) == {}
+
+
+def test_log_prefixes_current_request_id(capsys):
+    stage_timing.log("INFO", "밖")
+    _, token = stage_timing.begin("req-9")
+    try:
+        stage_timing.log("ERROR", "안")
+    finally:
+        stage_timing.end(token)
+    assert capsys.readouterr().out.splitlines() == ["INFO: 밖", "ERROR: [req-9] 안"]
@@ -0,0 +1,57 @@
+import re
+
+import numpy as np
+
+import text_chunking
+
+
+def word_spans(text):
+    return [m.span() for m in re.finditer(r"\S+", text)]
+
+
+def test_short_text_is_single_chunk():
+    text = "짧은 기억 하나"
+    assert text_chunking.split(text, word_spans(text), max_tokens=8, overlap=2) == [(text, 3)]
+
+
+def test_empty_offsets_keep_text_whole():
+    # none 모드와 글자 수가 짧은 텍스트는 토큰 위치 없이 넘어옵니다.
+    assert text_chunking.split("아무 내용", [], max_tokens=4, overlap=1) == [("아무 내용", 1)]
+
+
+def test_long_text_chunks_overlap_and_cover_all_tokens():
+    words = [f"w{i}" for i in range(10)]
+    text = " ".join(words)
+    chunks = text_chunking.split(text, word_spans(text), max_tokens=4, overlap=1)
+    assert [chunk for chunk, _ in chunks] == ["w0 w1 w2 w3", "w3 w4 w5 w6", "w6 w7 w8 w9"]
+    assert all(tokens <= 4 for _, tokens in chunks)
+
+
+def test_overlap_is_capped_at_half_window():
+    text = " ".join(f"w{i}" for i in range(6))
+    chunks = text_chunking.split(text, word_spans(text), max_tokens=2, overlap=5)
+    # overlap 이 max_tokens // 2 로 줄어들어 한 토큰씩 전진합니다.
+    assert [chunk for chunk, _ in chunks] == ["w0 w1", "w1 w2", "w2 w3", "w3 w4", "w4 w5"]
+
+
+def test_split_many_tracks_owners_and_weights():
+    texts = ["a b c d e", "x"]
+    chunks, owners, weights = text_chunking.split_many(texts, [word_spans(t) for t in texts], max_tokens=3, overlap=1)
+    assert chunks == ["a b c", "c d e", "x"]
+    assert owners == [0, 0, 1]
+    assert weights == [3, 3, 1]
+
+
+def test_pool_single_chunk_returns_vector_unchanged():
+    vectors = np.array([[0.6, 0.8], [1.0, 0.0]], dtype=np.float32)
+    pooled = text_chunking.pool(vectors, owners=[1, 0], weights=[5, 7], count=2)
+    np.testing.assert_array_equal(pooled, vectors[[1, 0]])
+
+
+def test_pool_weights_by_tokens_and_normalizes():
+    vectors = np.array([[1.0, 0.0], [0.0, 1.0], [0.6, 0.8]], dtype=np.float32)
+    pooled = text_chunking.pool(vectors, owners=[0, 0, 1], weights=[3, 1, 2], count=2)
+    expected = np.array([3.0, 1.0]) / np.linalg.norm([3.0, 1.0])
+    np.testing.assert_allclose(pooled[0], expected, rtol=1e-6)
+    np.testing.assert_allclose(pooled[1], [0.6, 0.8], rtol=1e-6)
+    np.testing.assert_allclose(np.linalg.norm(pooled, axis=1), [1.0, 1.0], rtol=1e-6)
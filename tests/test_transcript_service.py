@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+import pytest
+
+import transcript_service
+from tests.stubs import MISSING_VIDEO_ID, FakeFetcher
+from transcript_service import TranscriptCache, TranscriptNotFound, TranscriptService
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_load_fetcher_uses_module_spec():
+    fetcher = transcript_service.load_fetcher("tests.stubs:fake_fetcher")
+    assert isinstance(fetcher, FakeFetcher)
+    assert isinstance(transcript_service.load_fetcher("tests.stubs:FakeFetcher"), FakeFetcher)
+    assert isinstance(transcript_service.load_fetcher(""), transcript_service.YtDlpFetcher)
+
+
+def test_cache_hit_skips_fetcher(tmp_path):
+    fetcher = FakeFetcher()
+    service = TranscriptService(fetcher, TranscriptCache(str(tmp_path), ttl_seconds=3600))
+
+    async def scenario():
+        first = await service.get("abc", "ko,en")
+        second = await service.get("abc", "ko,en")
+        return first, second
+
+    first, second = run(scenario())
+    assert first == second
+    assert fetcher.calls == [("abc", "ko,en")]
+    assert service.stats()["cache_hits"] == 1
+
+
+def test_refresh_bypasses_cache(tmp_path):
+    fetcher = FakeFetcher()
+    service = TranscriptService(fetcher, TranscriptCache(str(tmp_path), ttl_seconds=3600))
+
+    async def scenario():
+        await service.get("abc")
+        await service.get("abc", refresh=True)
+
+    run(scenario())
+    assert len(fetcher.calls) == 2
+
+
+def test_concurrent_requests_are_coalesced():
+    fetcher = FakeFetcher(delay=0.05)
+    service = TranscriptService(fetcher, cache=None)
+
+    async def scenario():
+        return await asyncio.gather(*(service.get("same") for _ in range(5)))
+
+    results = run(scenario())
+    assert all(result == results[0] for result in results)
+    assert len(fetcher.calls) == 1
+    assert service.stats()["coalesced"] == 4
+
+
+def test_semaphore_bounds_concurrent_fetches():
+    fetcher = FakeFetcher(delay=0.02)
+    service = TranscriptService(fetcher, cache=None, max_concurrency=2)
+
+    async def scenario():
+        await asyncio.gather(*(service.get(f"video{i}") for i in range(6)))
+
+    run(scenario())
+    assert len(fetcher.calls) == 6
+    assert fetcher.max_running == 2
+
+
+def test_failures_are_counted_and_not_cached(tmp_path):
+    fetcher = FakeFetcher()
+    cache = TranscriptCache(str(tmp_path), ttl_seconds=3600)
+    service = TranscriptService(fetcher, cache)
+
+    with pytest.raises(TranscriptNotFound):
+        run(service.get(MISSING_VIDEO_ID))
+    assert service.stats()["failures"] == 1
+    assert cache.get(MISSING_VIDEO_ID, "ko,en") is None
+
+
+def test_expired_cache_entry_is_ignored(tmp_path):
+    cache = TranscriptCache(str(tmp_path), ttl_seconds=1)
+    cache.put("abc", "ko", [{"start": 0.0, "end": 1.0, "text": "hi"}])
+    assert cache.get("abc", "ko") is not None
+    # fetched_at 을 아주 오래전으로 바꿔 만료시킵니다.
+    path = cache._path("abc", "ko")
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    data["fetched_at"] = 0
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    assert cache.get("abc", "ko") is None
+
+
+@pytest.mark.parametrize("url, video_id", [
+    ("https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=10", "dQw4w9WgXcQ"),
+    ("https://youtu.be/dQw4w9WgXcQ", "dQw4w9WgXcQ"),
+    ("https://www.youtube.com/shorts/abcDEF12345", "abcDEF12345"),
+])
+def test_extract_video_id(url, video_id):
+    assert transcript_service.extract_video_id(url) == video_id
+
+
+def test_extract_video_id_rejects_other_urls():
+    with pytest.raises(ValueError):
+        transcript_service.extract_video_id("https://example.com/watch?v=x")
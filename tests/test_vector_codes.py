@@ -0,0 +1,70 @@
+import numpy as np
+import pyarrow as pa
+import pytest
+
+import vector_codes
+
+DIM = 16
+
+
+def random_unit(rng, rows):
+    vectors = rng.standard_normal((rows, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_encode_shapes():
+    vectors = np.ones((3, DIM), dtype=np.float32)
+    assert vector_codes.encode("float16", vectors).dtype == np.float16
+    assert vector_codes.encode("binary", vectors).shape == (3, DIM // 8)
+    with pytest.raises(ValueError):
+        vector_codes.encode("int4", vectors)
+
+
+@pytest.mark.parametrize("kind, value_type, row_bytes", [("float16", pa.float16(), DIM * 2), ("binary", pa.uint8(), DIM // 8)])
+def test_arrow_column_round_trip(kind, value_type, row_bytes):
+    rng = np.random.default_rng(0)
+    vectors = random_unit(rng, 5)
+    column = vector_codes.to_arrow(kind, vectors)
+    assert column.type == vector_codes.arrow_type(kind, DIM)
+    assert column.type.value_type == value_type
+    assert vector_codes.kind_of(column.type) == kind
+    assert vector_codes.bytes_per_row(kind, DIM) == row_bytes
+    np.testing.assert_array_equal(vector_codes.from_arrow(pa.chunked_array([column])), vector_codes.encode(kind, vectors))
+
+
+def test_kind_of_float32_vector_is_none():
+    assert vector_codes.kind_of(pa.list_(pa.float32(), DIM)) is None
+
+
+def test_top_candidates_sorted():
+    scores = np.array([0.1, 0.9, 0.5, 0.7])
+    assert vector_codes.top_candidates(scores, 3).tolist() == [1, 3, 2]
+    assert vector_codes.top_candidates(scores, 0).tolist() == []
+
+
+@pytest.mark.parametrize("kind", vector_codes.KINDS)
+def test_scan_finds_exact_match_across_pages(kind):
+    rng = np.random.default_rng(1)
+    vectors = random_unit(rng, 50)
+    ids = np.arange(100, 150)
+    codes = vector_codes.encode(kind, vectors)
+    pages = [(ids[start:start + 7], codes[start:start + 7]) for start in range(0, 50, 7)]
+    assert vector_codes.scan(kind, pages, vectors[37], 1).tolist() == [137]
+
+
+@pytest.mark.parametrize("kind", vector_codes.KINDS)
+def test_scan_matches_single_page_ranking(kind):
+    rng = np.random.default_rng(2)
+    vectors = random_unit(rng, 40)
+    codes = vector_codes.encode(kind, vectors)
+    whole = vector_codes.scan(kind, [(np.arange(40), codes)], vectors[0], 10)
+    paged = vector_codes.scan(kind, [(np.arange(start, start + 8), codes[start:start + 8]) for start in range(0, 40, 8)],
+                              vectors[0], 10)
+    scores = vector_codes.approximate_scores(kind, codes, vectors[0])
+    assert len(paged) == 10
+    assert sorted(scores[paged].tolist(), reverse=True) == sorted(scores[whole].tolist(), reverse=True)
+
+
+def test_scan_of_no_rows_is_empty():
+    assert vector_codes.scan("binary", [], np.ones(DIM), 5).tolist() == []
+    assert vector_codes.scan("binary", [(np.empty(0, dtype=np.int64), np.empty((0, 2), dtype=np.uint8))], np.ones(DIM), 5).tolist() == []
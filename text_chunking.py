@@ -0,0 +1,65 @@
+# --- 긴 텍스트 청크 분할 / 풀링 ---
+# all-MiniLM-L6-v2 는 최대 시퀀스 길이(256 토큰)를 넘는 부분을 조용히 잘라 버리므로,
+# 긴 기억 / 파일 청크는 토크나이저 길이 기준으로 겹치게 나눠 모두 인코딩한 뒤
+#   - pooled: 토큰 수로 가중 평균한 벡터 하나 (L2 정규화)
+#   - chunks: 청크마다 벡터를 따로 저장 (검색 결과는 부모 기억 단위로 최댓값 점수로 합침)
+# 으로 씁니다. 모델 최대 길이 안에 들어가는 텍스트는 청크 하나 = 원문이므로 벡터가 기존과 같습니다.
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+MODES = ("none", "pooled", "chunks")
+
+Span = Tuple[int, int]  # 토큰의 (시작, 끝) 글자 위치
+
+
+def split(text: str, offsets: Sequence[Span], max_tokens: int, overlap: int) -> List[Tuple[str, int]]:
+    """
+    text 를 max_tokens 토큰 이하의 청크로 나눕니다. 다음 청크는 이전 청크의 마지막 overlap 토큰부터 시작합니다.
+    (청크 텍스트, 토큰 수) 목록을 돌려주며, 청크 경계는 토큰 경계에 맞춥니다.
+    """
+    max_tokens = max(1, int(max_tokens))
+    if len(offsets) <= max_tokens:
+        return [(text, max(1, len(offsets)))]
+    overlap = max(0, min(int(overlap), max_tokens // 2))
+    step = max_tokens - overlap
+    chunks = []
+    for start in range(0, len(offsets), step):
+        window = offsets[start:start + max_tokens]
+        chunks.append((text[window[0][0]:window[-1][1]], len(window)))
+        if start + max_tokens >= len(offsets):
+            break
+    return chunks
+
+
+def split_many(texts: Sequence[str], offsets: Sequence[Sequence[Span]], max_tokens: int,
+               overlap: int) -> Tuple[List[str], List[int], List[int]]:
+    """여러 텍스트를 한꺼번에 나눕니다. (청크 텍스트, 각 청크의 원래 텍스트 번호, 청크 토큰 수) 를 돌려줍니다."""
+    chunks, owners, weights = [], [], []
+    for i, (text, spans) in enumerate(zip(texts, offsets)):
+        for chunk, tokens in split(text, spans, max_tokens, overlap):
+            chunks.append(chunk)
+            owners.append(i)
+            weights.append(tokens)
+    return chunks, owners, weights
+
+
+def pool(vectors: np.ndarray, owners: Sequence[int], weights: Sequence[int], count: int) -> np.ndarray:
+    """청크 벡터를 원래 텍스트별로 토큰 수 가중 평균해 (count, dim) 행렬로 만듭니다. 청크가 하나면 그 벡터 그대로."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    owners = np.asarray(owners, dtype=np.int64)
+    chunk_counts = np.bincount(owners, minlength=count)
+    if np.all(chunk_counts == 1):
+        pooled = np.empty((count, vectors.shape[1]), dtype=np.float32)
+        pooled[owners] = vectors
+        return pooled
+    pooled = np.zeros((count, vectors.shape[1]), dtype=np.float32)
+    np.add.at(pooled, owners, vectors * np.asarray(weights, dtype=np.float32)[:, None])
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    pooled /= norms
+    single = chunk_counts == 1
+    if single.any():
+        rows = np.flatnonzero(single[owners])
+        pooled[owners[rows]] = vectors[rows]
+    return pooled
@@ -0,0 +1,222 @@
+# --- 유튜브 자막 서비스 ---
+# 1. 디스크 캐시: video_id + 언어별로 파싱된 세그먼트 목록을 JSON 으로 저장 (TTL)
+# 2. 비동기 subprocess 풀: yt-dlp 동시 실행 수를 세마포어로 제한
+# 3. 진행 중 요청 합치기: 같은 영상에 대한 동시 요청은 yt-dlp 한 번의 결과를 공유
+# 4. 교체 가능한 fetcher: 테스트에서는 yt-dlp 대신 로컬 스텁을 꽂을 수 있습니다.
+import asyncio
+import importlib
+import json
+import os
+import re
+import subprocess
+import tempfile
+import time
+from io import StringIO
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import stage_timing
+
+
+class TranscriptNotFound(Exception):
+    """영상에 사용할 수 있는 자막이 없을 때."""
+
+
+def extract_video_id(raw_url: str) -> str:
+    """youtube.com/watch?v=, /shorts/, youtu.be 형식의 URL 에서 비디오 ID 를 꺼냅니다."""
+    parsed_url = urlparse(raw_url)
+    video_id = None
+    if 'youtube.com' in parsed_url.netloc:
+        query_params = parse_qs(parsed_url.query)
+        if 'v' in query_params: video_id = query_params['v'][0]
+        elif parsed_url.path.startswith('/shorts/'): video_id = parsed_url.path.split('/shorts/')[1]
+    elif 'youtu.be' in parsed_url.netloc:
+        video_id = parsed_url.path.lstrip('/')
+    if not video_id: raise ValueError("URL에서 비디오 ID를 추출할 수 없습니다.")
+    return video_id
+
+
+def parse_vtt(vtt_content: str) -> List[Dict[str, Any]]:
+    """VTT 자막 텍스트를 [{start, end, text}, ...] 로 파싱합니다."""
+    import webvtt  # 자막을 실제로 파싱할 때만 불러옵니다.
+
+    vtt_content = re.sub(r'(WEBVTT\s*?\n)+', 'WEBVTT\n', vtt_content.strip())
+    try:
+        captions = webvtt.read_buffer(StringIO(vtt_content))
+    except Exception: # 더 넓은 범위의 파싱 에러를 잡습니다.
+        print("WARN: (VTT 파싱) 기본 파싱 실패, UTF-8-SIG 인코딩으로 재시도.")
+        captions = webvtt.read_buffer(StringIO(vtt_content.encode('utf-8-sig').decode('utf-8')))
+    segments = []
+    for caption in captions:
+        # `&gt;&gt;` 같은 HTML 엔티티를 실제 문자로 변환하고, 불필요한 공백을 정리합니다.
+        clean_text = caption.text.replace('&gt;&gt;', '').strip().replace('\n', ' ')
+        if clean_text: # 텍스트가 있는 경우에만 추가
+            segments.append({"start": caption.start_in_seconds, "end": caption.end_in_seconds, "text": clean_text})
+    return segments
+
+
+async def run_subprocess(command: List[str], timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+    """
+    asyncio subprocess 로 명령을 실행합니다.
+    이벤트 루프가 subprocess 를 지원하지 않으면 (Windows SelectorEventLoop 등) 스레드에서 subprocess.run 으로 대신 실행합니다.
+    """
+    with stage_timing.stage("subprocess"):
+        try:
+            proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except NotImplementedError:
+            return await asyncio.to_thread(subprocess.run, command, capture_output=True, text=True, encoding='utf-8', errors='replace', timeout=timeout)
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise
+    return subprocess.CompletedProcess(command, proc.returncode,
+                                       stdout.decode('utf-8', errors='replace'), stderr.decode('utf-8', errors='replace'))
+
+
+class YtDlpFetcher:
+    """yt-dlp 로 자막(vtt)을 내려받아 파싱하는 기본 fetcher."""
+
+    def __init__(self, executable: str = 'yt-dlp', timeout: float = 120.0):
+        self.executable = executable
+        self.timeout = timeout
+
+    async def __call__(self, video_id: str, languages: str) -> List[Dict[str, Any]]:
+        video_url = f"https://www.youtube.com/watch?v={video_id}"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            command = [
+                self.executable,
+                '--restrict-filenames', # 파일명에 포함될 수 없는 특수문자, 이모지 등을 안전한 문자로 치환
+                '--write-sub', '--write-automatic-sub',
+                '--sub-lang', languages,
+                '--skip-download',
+                '--sub-format', 'vtt',
+                '--output', os.path.join(temp_dir, '%(id)s.%(ext)s'),
+                # --sleep-interval 은 호출마다 몇 초씩 기다리게 하므로 쓰지 않습니다. (동시 실행 수는 세마포어로 제한)
+                video_url
+            ]
+            result = await run_subprocess(command, timeout=self.timeout)
+            if result.returncode != 0:
+                print(f"ERROR: (yt-dlp) 실행 실패. STDERR 전체:\n{result.stderr}")
+                raise TranscriptNotFound(result.stderr)
+
+            # "하나라도 성공하면 OK" - 요청한 언어 순서대로 우선 선택합니다.
+            found_subs = [f for f in os.listdir(temp_dir) if f.endswith('.vtt')]
+            if not found_subs:
+                raise TranscriptNotFound("yt-dlp가 어떤 자막 파일도 생성하지 않았습니다.")
+            chosen = found_subs[0]
+            for lang in languages.split(','):
+                preferred = [f for f in found_subs if f'.{lang.strip()}.vtt' in f]
+                if preferred:
+                    chosen = preferred[0]
+                    break
+            print(f"INFO: (yt-dlp) 자막 '{chosen}'을 선택했습니다.")
+            with open(os.path.join(temp_dir, chosen), 'r', encoding='utf-8') as f:
+                return parse_vtt(f.read())
+
+
+class TranscriptCache:
+    """video_id + 언어별 세그먼트 목록을 JSON 파일로 보관하는 디스크 캐시."""
+
+    def __init__(self, directory: str, ttl_seconds: float):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, video_id: str, languages: str) -> str:
+        safe = re.sub(r'[^A-Za-z0-9_-]', '_', f"{video_id}.{languages}")
+        return os.path.join(self.directory, f"{safe}.json")
+
+    def get(self, video_id: str, languages: str) -> Optional[List[Dict[str, Any]]]:
+        path = self._path(video_id, languages)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if self.ttl_seconds and time.time() - payload.get("fetched_at", 0) > self.ttl_seconds:
+            return None
+        return payload.get("segments")
+
+    def put(self, video_id: str, languages: str, segments: List[Dict[str, Any]]):
+        path = self._path(video_id, languages)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"video_id": video_id, "languages": languages, "fetched_at": time.time(), "segments": segments}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def purge_expired(self) -> int:
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.json') and self.ttl_seconds and now - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                removed += 1
+        return removed
+
+
+class TranscriptService:
+    def __init__(self, fetcher, cache: Optional[TranscriptCache], max_concurrency: int = 2):
+        self.fetcher = fetcher
+        self.cache = cache
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self.counters = {"cache_hits": 0, "coalesced": 0, "fetches": 0, "failures": 0}
+        self.running = 0
+
+    async def get(self, video_id: str, languages: str = 'ko,en', refresh: bool = False) -> List[Dict[str, Any]]:
+        key = (video_id, languages)
+        if not refresh and self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, video_id, languages)
+            if cached is not None:
+                self.counters["cache_hits"] += 1
+                return cached
+
+        # 같은 영상을 이미 가져오는 중이면 그 결과를 기다립니다.
+        # 실제 작업은 별도 태스크에서 돌려서, 먼저 요청한 쪽이 연결을 끊어도 나머지는 결과를 받습니다.
+        task = self._inflight.get(key)
+        if task is not None:
+            self.counters["coalesced"] += 1
+        else:
+            task = asyncio.get_running_loop().create_task(self._fetch(video_id, languages))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, video_id: str, languages: str) -> List[Dict[str, Any]]:
+        async with self._semaphore:
+            self.running += 1
+            self.counters["fetches"] += 1
+            try:
+                segments = await self.fetcher(video_id, languages)
+            except Exception:
+                self.counters["failures"] += 1
+                raise
+            finally:
+                self.running -= 1
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, video_id, languages, segments)
+        return segments
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self.running,
+            "inflight": len(self._inflight),
+            **self.counters,
+        }
+
+
+def load_fetcher(spec: Optional[str]):
+    """
+    "모듈:이름" 형식의 fetcher 를 불러옵니다 (예: tests.stubs:fake_fetcher).
+    클래스면 인자 없이 인스턴스를 만들고, 비어 있으면 기본 YtDlpFetcher 를 사용합니다.
+    """
+    if not spec:
+        return YtDlpFetcher()
+    module_name, _, attr = spec.partition(':')
+    fetcher = getattr(importlib.import_module(module_name), attr)
+    return fetcher() if isinstance(fetcher, type) else fetcher
@@ -0,0 +1,120 @@
+# --- 압축 벡터 코드 (float16 / 1-bit 이진 양자화) ---
+# 기억 테이블에 벡터의 압축 코드를 컬럼으로 함께 저장하고, 검색을 두 단계로 나눕니다.
+#   1) 압축 코드 컬럼만 읽어 훑으며 후보를 고름 (binary: 해밍 거리, float16: 내적)
+#   2) 후보의 원래 벡터만 읽어 정확한 코사인 유사도로 다시 순위를 매김
+# 384 차원 기준 코드는 한 행에 float16 768 bytes / binary 48 bytes 입니다. (float32 는 1536 bytes)
+# 코드는 LanceDB 컬럼이라 테이블과 함께 저장 / 교체되며, 따로 메모리에 올려 두는 사본은 없습니다.
+from typing import Iterable, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+KINDS = ("float16", "binary")
+_SCAN_CHUNK_ROWS = 4096  # float16 내적을 float32 로 올려 계산할 때 한 번에 처리하는 행 수 (임시 메모리 ~6MB)
+
+# numpy < 2.0 에는 np.bitwise_count 가 없으므로 바이트별 popcount 표를 씁니다.
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    counter = getattr(np, "bitwise_count", None)
+    return counter(values) if counter is not None else _POPCOUNT[values]
+
+
+def _check_kind(kind: str):
+    if kind not in KINDS:
+        raise ValueError(f"알 수 없는 벡터 코드 형식입니다: {kind} (사용 가능: {', '.join(KINDS)})")
+
+
+def code_width(kind: str, dim: int) -> int:
+    """한 행의 코드 원소 수. binary 는 부호 비트 8개를 묶은 바이트 수입니다."""
+    _check_kind(kind)
+    return (dim + 7) // 8 if kind == "binary" else dim
+
+
+def bytes_per_row(kind: str, dim: int) -> int:
+    return code_width(kind, dim) * (1 if kind == "binary" else 2)
+
+
+def arrow_type(kind: str, dim: int) -> pa.DataType:
+    """코드 컬럼의 Arrow 타입 (fixed_size_list<float16> 또는 fixed_size_list<uint8>)."""
+    value_type = pa.uint8() if kind == "binary" else pa.float16()
+    return pa.list_(value_type, code_width(kind, dim))
+
+
+def kind_of(data_type: pa.DataType):
+    """코드 / 벡터 컬럼 타입에서 코드 형식을 알아냅니다. float16 도 uint8 도 아니면 None."""
+    value_type = getattr(data_type, "value_type", None)
+    if value_type == pa.float16():
+        return "float16"
+    if value_type == pa.uint8():
+        return "binary"
+    return None
+
+
+def encode(kind: str, vectors: np.ndarray) -> np.ndarray:
+    """(N, dim) float 벡터를 kind 형식의 코드로 바꿉니다. binary 는 부호 비트를 8개씩 묶은 uint8 입니다."""
+    _check_kind(kind)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    if kind == "float16":
+        return vectors.astype(np.float16)
+    return np.packbits(vectors > 0, axis=1)
+
+
+def to_arrow(kind: str, vectors: np.ndarray) -> pa.FixedSizeListArray:
+    codes = encode(kind, vectors)
+    return pa.FixedSizeListArray.from_arrays(pa.array(codes.ravel()), codes.shape[1])
+
+
+def from_arrow(column) -> np.ndarray:
+    """Arrow fixed_size_list 코드 컬럼을 (N, width) 배열로 바꿉니다. (float16 / uint8 그대로, 복사 최소화)"""
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    width = column.type.list_size
+    return column.flatten().to_numpy(zero_copy_only=False).reshape(-1, width)
+
+
+def approximate_scores(kind: str, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """
+    코드와 질의의 근사 유사도 (클수록 가까움).
+    binary 는 -해밍 거리, float16 은 내적입니다. (정규화된 벡터이므로 코사인 유사도의 근사)
+    """
+    query = np.asarray(query, dtype=np.float32).reshape(-1)
+    if kind == "binary":
+        query_code = np.packbits(query > 0)
+        return -_popcount(np.bitwise_xor(codes, query_code)).sum(axis=1, dtype=np.int32)
+    scores = np.empty(codes.shape[0], dtype=np.float32)
+    for start in range(0, codes.shape[0], _SCAN_CHUNK_ROWS):
+        block = codes[start:start + _SCAN_CHUNK_ROWS]
+        scores[start:start + block.shape[0]] = block.astype(np.float32) @ query
+    return scores
+
+
+def top_candidates(scores: np.ndarray, k: int) -> np.ndarray:
+    """scores 상위 k 개의 위치 (정렬됨). 전체 정렬 대신 argpartition."""
+    if scores.shape[0] == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+    k = min(k, scores.shape[0])
+    picked = np.argpartition(-scores, k - 1)[:k]
+    return picked[np.argsort(-scores[picked], kind="stable")]
+
+
+def scan(kind: str, pages: Iterable[Tuple[np.ndarray, np.ndarray]], query: np.ndarray, k: int) -> np.ndarray:
+    """
+    (ids, codes) 페이지들을 차례로 훑어 근사 유사도 상위 k 개의 id 를 돌려줍니다. (정렬됨)
+    페이지마다 상위 k 개만 남기므로 한 번에 한 페이지 분량의 코드만 메모리에 올라갑니다.
+    """
+    best_ids = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0, dtype=np.float32)
+    for ids, codes in pages:
+        if len(ids) == 0:
+            continue
+        scores = approximate_scores(kind, codes, query).astype(np.float32, copy=False)
+        picked = top_candidates(scores, k)
+        best_ids = np.concatenate([best_ids, np.asarray(ids, dtype=np.int64)[picked]])
+        best_scores = np.concatenate([best_scores, scores[picked]])
+        keep = top_candidates(best_scores, k)
+        best_ids, best_scores = best_ids[keep], best_scores[keep]
+    return best_ids
@@ -0,0 +1,104 @@
+# --- 벡터 전송 형식 (콘텐츠 협상) ---
+# JSON float 리스트 대신 Accept 헤더로 더 가벼운 형식을 고를 수 있습니다.
+#   application/json                        : 기존 형식 ({"vectors": [[...], ...]})
+#   application/octet-stream                : 아래 프레임 형식의 원시 little-endian 벡터
+#   application/vnd.apache.arrow.stream     : Arrow IPC 스트림 (id, vector 컬럼)
+#
+# 프레임 형식 (모든 정수는 little-endian uint32):
+#   magic "LVEC" | rows | dim | flags (bit0 = ids 포함, bit1 = float16, bit2 = binary)
+#   [ids: int64 x rows]            (flags & 1 일 때만)
+#   vectors: float32 x (rows * dim)
+#            float16 x (rows * dim)            (flags & 2)
+#            uint8 x (rows * dim / 8)          (flags & 4, 부호 비트 8개씩 묶음. dim 은 비트 수)
+# 스트리밍 응답은 이 프레임이 여러 개 이어진 것이며, 클라이언트는 EOF 까지 프레임을 읽으면 됩니다.
+import io
+import struct
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+JSON = "application/json"
+OCTET_STREAM = "application/octet-stream"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+FRAME_MAGIC = b"LVEC"
+_HEADER = struct.Struct("<4sIII")
+FLAG_IDS = 1
+FLAG_FLOAT16 = 2
+FLAG_BINARY = 4
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Accept 헤더에서 지원하는 형식을 고릅니다. 명시가 없으면 JSON."""
+    accept = (accept or "").lower()
+    if ARROW_STREAM in accept or "application/x-apache-arrow" in accept:
+        return ARROW_STREAM
+    if OCTET_STREAM in accept:
+        return OCTET_STREAM
+    return JSON
+
+
+def pack_frame(vectors: np.ndarray, ids: Optional[np.ndarray] = None) -> bytes:
+    """float16 / uint8(binary 코드) 배열은 그 형식 그대로, 나머지는 float32 로 보냅니다."""
+    vectors = np.asarray(vectors)
+    if vectors.dtype == np.uint8:
+        vectors, flags = np.ascontiguousarray(vectors), FLAG_BINARY
+    elif vectors.dtype == np.float16:
+        vectors, flags = np.ascontiguousarray(vectors, dtype="<f2"), FLAG_FLOAT16
+    else:
+        vectors, flags = np.ascontiguousarray(vectors, dtype="<f4"), 0
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    rows, dim = vectors.shape
+    if flags & FLAG_BINARY:
+        dim *= 8
+    if ids is not None:
+        flags |= FLAG_IDS
+    parts = [_HEADER.pack(FRAME_MAGIC, rows, dim, flags)]
+    if ids is not None:
+        parts.append(np.ascontiguousarray(ids, dtype="<i8").tobytes())
+    parts.append(vectors.tobytes())
+    return b"".join(parts)
+
+
+def unpack_frames(data: bytes) -> List[Tuple[Optional[np.ndarray], np.ndarray]]:
+    """pack_frame 으로 만든 프레임(들)을 (ids, vectors) 목록으로 되돌립니다."""
+    frames, offset = [], 0
+    while offset < len(data):
+        magic, rows, dim, flags = _HEADER.unpack_from(data, offset)
+        if magic != FRAME_MAGIC:
+            raise ValueError("잘못된 벡터 프레임입니다.")
+        offset += _HEADER.size
+        ids = None
+        if flags & FLAG_IDS:
+            ids = np.frombuffer(data, dtype="<i8", count=rows, offset=offset)
+            offset += rows * 8
+        if flags & FLAG_BINARY:
+            dtype, width = np.uint8, dim // 8
+        else:
+            dtype, width = ("<f2" if flags & FLAG_FLOAT16 else "<f4"), dim
+        vectors = np.frombuffer(data, dtype=dtype, count=rows * width, offset=offset).reshape(rows, width)
+        offset += vectors.nbytes
+        frames.append((ids, vectors))
+    return frames
+
+
+def arrow_ipc_stream(batches: Iterable, schema) -> Iterator[bytes]:
+    """Arrow RecordBatch 들을 IPC 스트림 바이트 조각으로 하나씩 내보냅니다. (전체를 메모리에 모으지 않음)"""
+    import pyarrow as pa
+
+    sink = io.BytesIO()
+
+    def drain() -> bytes:
+        chunk = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return chunk
+
+    writer = pa.ipc.new_stream(sink, schema)
+    yield drain()
+    for batch in batches:
+        writer.write_batch(batch)
+        yield drain()
+    writer.close()
+    yield drain()
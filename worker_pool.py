@@ -0,0 +1,137 @@
+# --- 다중 프로세스 인코딩 / 검색 워커 ---
+# SERVER_WORKERS > 1 이면 부모 프로세스가 모델을 한 번 로드한 뒤 fork 해서 자식 프로세스들을 만듭니다. (fork-after-load)
+# 자식은 가중치를 copy-on-write 로 공유하므로 모델이 워커 수만큼 복제되지 않고, 인코딩과 벡터 검색이 여러 코어에서 돌아갑니다.
+#
+# - HTTP 요청, 잡 / 세그먼트 같은 메모리 상태, 그리고 LanceDB 쓰기(/add, 재구축, 삭제, 인덱스 관리)는 모두 부모가 맡습니다.
+#   즉 쓰기 주체는 항상 부모 하나이고, 자식은 테이블을 읽기 전용으로만 엽니다.
+# - 부모는 검색을 보낼 때 자신이 보고 있는 (테이블 이름, 버전) 을 같이 넘기고, 자식은 그보다 오래된 스냅샷이면
+#   checkout_latest 로 새로 고칩니다. 재구축으로 테이블 이름이 바뀌면 새 테이블을 엽니다.
+# - fork 전에 부모가 LanceDB 나 CUDA, OpenMP 스레드 풀을 건드리면 자식에서 멈출 수 있으므로,
+#   풀은 모델 로드 직후 / 테이블을 열기 전에 만들고, 워밍업 forward pass 는 자식에서 합니다.
+# - 자식이 죽어 풀이 깨지면 다시 fork 하지 않고 (부모는 이미 LanceDB 를 쓰고 있음) 부모 프로세스 안에서 처리합니다.
+import concurrent.futures
+import gc
+import multiprocessing
+import os
+import signal
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+# 부모가 fork 직전에 채워 두는 값들. 자식은 fork 로 그대로 물려받습니다.
+_backend = None
+_backend_loader: Optional[Callable[[], Any]] = None
+_db_path: Optional[str] = None
+_start_barrier = None  # 자식 수만큼 모일 때까지 시작 작업을 붙잡아 두는 Barrier (start 참고)
+
+# 자식 프로세스 안의 상태
+_reader = None
+
+
+def fork_supported() -> bool:
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+class TableReader:
+    """자식 프로세스의 읽기 전용 LanceDB 테이블 핸들. (memories, memory_chunks 처럼 이름별로 보관)"""
+
+    MAX_TABLES = 4  # 재구축으로 이름이 바뀐 옛 테이블 핸들은 오래된 것부터 닫습니다.
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._db = None
+        self._tables: Dict[str, Any] = {}
+
+    def connect(self):
+        if self._db is None:
+            import lancedb
+            self._db = lancedb.connect(self.db_path)
+        return self._db
+
+    def table(self, name: str, version: Optional[int]):
+        table = self._tables.get(name)
+        if table is None:
+            table = self._tables[name] = self.connect().open_table(name)
+            while len(self._tables) > self.MAX_TABLES:
+                self._tables.pop(next(iter(self._tables)))
+        elif version is not None and table.version < version:
+            table.checkout_latest()
+        return table
+
+
+def _init_worker(threads: Optional[int]):
+    global _backend, _reader
+    # Ctrl+C 는 부모가 처리합니다. (자식마다 KeyboardInterrupt 트레이스백이 찍히지 않도록)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if _backend is None and _backend_loader is not None:
+        _backend = _backend_loader()  # fork 이후에 로드해야 하는 백엔드 (ONNX Runtime 세션 등)
+    if threads:
+        _backend.set_num_threads(threads)
+    _backend.encode(["warmup"])
+    _reader = TableReader(_db_path)
+    _reader.connect()  # lancedb import / 연결은 fork 이후 자식에서 (첫 검색이 느려지지 않도록 미리)
+
+
+def _encode(texts: List[str]) -> np.ndarray:
+    return _backend.encode(texts, batch_size=len(texts))
+
+
+def _read(fn: Callable, table_name: str, table_version: Optional[int], args: tuple):
+    return fn(_reader.table(table_name, table_version), *args)
+
+
+def _wait_started(timeout: float) -> int:
+    # 모든 자식이 이 작업을 하나씩 잡을 때까지 기다리므로, 한 자식이 시작 작업을 두 개 처리할 수 없습니다.
+    _start_barrier.wait(timeout)
+    return os.getpid()
+
+
+class WorkerPool:
+    """fork 한 자식 프로세스 풀. encode / read 는 concurrent.futures.Future 를 돌려줍니다."""
+
+    def __init__(self, backend, workers: int, db_path: str, threads_per_worker: Optional[int] = None,
+                 backend_loader: Optional[Callable[[], Any]] = None):
+        global _backend, _backend_loader, _db_path, _start_barrier
+        if not fork_supported():
+            raise RuntimeError("이 플랫폼은 fork 를 지원하지 않습니다.")
+        self.workers = max(1, int(workers))
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self.shares_weights = getattr(backend, "fork_safe", False)
+        _backend = backend if self.shares_weights else None
+        _backend_loader = None if self.shares_weights else backend_loader
+        _db_path = os.path.abspath(db_path)
+        self.pids: List[int] = []
+        context = multiprocessing.get_context("fork")
+        _start_barrier = context.Barrier(self.workers)
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=context,
+            initializer=_init_worker, initargs=(self.threads_per_worker,),
+        )
+
+    def start(self, timeout: float = 600.0):
+        """자식 프로세스를 지금 모두 fork 하고, 각자 워밍업이 끝날 때까지 기다립니다."""
+        # fork 전에 지금까지 만든 객체를 GC 추적 대상에서 빼 두면, 자식에서 GC 가 돌 때 공유 페이지를 덜 건드립니다.
+        gc.freeze()
+        # 자식을 언제 몇 개 만드는지는 Python 버전마다 다르므로 (3.11 부터는 필요할 때 하나씩), 자식 수만큼
+        # Barrier 에서 기다리는 작업을 넣어 모든 자식이 뜨고 워밍업까지 마치게 합니다. 각 작업은 자기 pid 를 돌려줍니다.
+        started = [self._executor.submit(_wait_started, timeout) for _ in range(self.workers)]
+        done, pending = concurrent.futures.wait(started, timeout=timeout)
+        if pending:
+            raise TimeoutError(f"워커 {self.workers}개 중 {len(done)}개만 준비되었습니다.")
+        self.pids = [future.result() for future in started]
+        return self
+
+    def encode(self, texts: List[str]) -> concurrent.futures.Future:
+        return self._executor.submit(_encode, list(texts))
+
+    def read(self, fn: Callable, table_name: str, table_version: Optional[int], *args) -> concurrent.futures.Future:
+        """fn(테이블, *args) 를 자식에서 실행합니다. fn 은 모듈 최상위 함수여야 합니다. (pickle 로 전달)"""
+        return self._executor.submit(_read, fn, table_name, table_version, args)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "threads_per_worker": self.threads_per_worker,
+                "shares_weights": self.shares_weights, "pids": self.pids}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)